@@ -1,10 +1,301 @@
-from flask import Flask
+from aiohttp import web
+from discord.ext import commands
+from jinja2 import Environment, FileSystemLoader, Template, select_autoescape
+from markupsafe import escape
+from itertools import groupby
+from collections import OrderedDict
+from typing import Optional, Iterator, List, Tuple, Dict, Any
+import asyncio
+import hmac
+import json
+import math
+import time
+from utils import get_bit_positions
+import monitor
+import exporter
+import profiler
+import response_presets
+from variable import PROFILE_TOKEN, EXPORT_TOKEN
+from rest_scheduler import scheduler
+from reply_throttle import throttle
 
-app = Flask(__name__)
+HEALTH_CACHE_SECONDS: float = 1.0
+# 單一頁面超過PAGE_CACHE_LIMIT時不快取，所有快取的頁面合計不超過PAGE_CACHE_BYTES
+PAGE_CACHE_LIMIT:     int   = 256 * 1024
+PAGE_CACHE_BYTES:     int   = 16 * 1024 * 1024
 
-@app.route('/')
-def main() -> str:
-    return 'Bot is alive!'
+# 每次啟動都不同，避免重啟後版本號重複造成ETag誤判
+BOOT_ID: str = format(time.time_ns(), 'x')
 
-def run(host: str='0.0.0.0', port: int=8080) -> None:
-	app.run(host=host, port=port)
\ No newline at end of file
+templates: Environment = Environment(
+    loader=FileSystemLoader('templates'),
+    autoescape=select_autoescape(['html'])
+)
+
+routes: web.RouteTableDef = web.RouteTableDef()
+
+class PageCache:
+    """依伺服器快取頁面(資料版本, 內容)
+
+    所有頁面的大小合計超過max_bytes時，移除最久沒有被讀取的頁面。
+    """
+    def __init__(self, max_bytes: int = PAGE_CACHE_BYTES) -> None:
+        self.max_bytes: int = max_bytes
+        self.size:      int = 0
+        self.pages:     'OrderedDict[str, Tuple[int, bytes]]' = OrderedDict()
+
+    def get(self, key: str, version: int) -> Optional[bytes]:
+        cached: Optional[Tuple[int, bytes]] = self.pages.get(key)
+        if cached is None or cached[0] != version:
+            return None
+        self.pages.move_to_end(key)
+        return cached[1]
+
+    def put(self, key: str, version: int, body: bytes) -> None:
+        self.discard(key)
+        self.pages[key] = (version, body)
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            _, (_, oldest) = self.pages.popitem(last=False)
+            self.size -= len(oldest)
+
+    def discard(self, key: str) -> None:
+        cached: Optional[Tuple[int, bytes]] = self.pages.pop(key, None)
+        if cached is not None:
+            self.size -= len(cached[1])
+
+@routes.get('/')
+async def main(request: web.Request) -> web.Response:
+    return web.Response(text='Bot is alive!')
+
+@routes.get('/health')
+async def health(request: web.Request) -> web.Response:
+    """回報機器人狀態
+
+    為了應付頻繁的監控請求，結果會快取HEALTH_CACHE_SECONDS秒。
+    """
+    cached_at, status, body = request.app['health_cache']
+    if time.monotonic() - cached_at > HEALTH_CACHE_SECONDS:
+        bot: commands.Bot = request.app['bot']
+        ready: bool = bot.is_ready() and not bot.is_closed()
+        status = 200 if ready else 503
+        body = json.dumps({
+            'ready': ready,
+            'latency_ms': _finite(bot.latency * 1000),
+            'loop': monitor.loop_lag.snapshot(),
+            'shards': _shard_state(bot),
+            'guilds': len(bot.guilds),
+            'rest': scheduler.stats(),
+            'replies': throttle.stats(),
+            'ack_latency': monitor.ack_latency.snapshot(),
+            'errors': monitor.errors.snapshot(),
+            'tasks': {
+                'background': len(monitor.background_tasks),
+                'all': len(asyncio.all_tasks())
+            }
+        }).encode('utf-8')
+        request.app['health_cache'] = (time.monotonic(), status, body)
+
+    return web.Response(body=body, status=status, content_type='application/json')
+
+@routes.get('/debug/profile')
+async def profile(request: web.Request) -> web.Response:
+    """取樣分析機器人
+
+    ?seconds=取樣秒數(預設10)，回傳collapsed stack文字；
+    ?slowest=1 時改為回傳最近最慢的回呼。
+    沒有設定PROFILE_TOKEN時此網頁不存在。
+    """
+    _check_token(request, PROFILE_TOKEN)
+
+    if request.query.get('slowest'):
+        return web.json_response([
+            { 'name': name, 'ms': seconds * 1000, 'at': at } for seconds, name, at in monitor.callbacks.slowest(50)
+        ])
+
+    if profiler.running():
+        raise web.HTTPConflict(text='profiler is already running')
+    try:
+        seconds: float = max(0.1, min(float(request.query.get('seconds', '10')), profiler.MAX_SECONDS))
+    except ValueError:
+        raise web.HTTPBadRequest(text='seconds must be a number')
+    return web.Response(body=profiler.collapsed(await profiler.profile(seconds)), content_type='text/plain', charset='utf-8')
+
+@routes.get('/api/guilds/{guild_id}/votes')
+async def vote_list(request: web.Request) -> web.Response:
+    """列出伺服器上的投票"""
+    data_manager = _vote_data_manager(request)
+    guild_id: str = request.match_info['guild_id']
+    votes: List[Dict[str, Any]] = []
+    for _, title in data_manager.keys(guild_id):
+        vote_info: Dict[str, Any] = data_manager.get_val(title, guild_id)
+        votes.append({ 'title': title, 'closed': vote_info['closed'], 'close_date': vote_info['close_date'] })
+    return web.json_response(votes)
+
+@routes.get('/api/guilds/{guild_id}/votes/{title}')
+async def vote_detail(request: web.Request) -> web.Response:
+    """顯示投票的各選項票數"""
+    data_manager = _vote_data_manager(request)
+    vote_info: Optional[Dict[str, Any]] = data_manager.get_val(request.match_info['title'], request.match_info['guild_id'])
+    if not vote_info:
+        raise web.HTTPNotFound()
+
+    counts: List[int] = [0] * len(vote_info['options'])
+    for votes in vote_info['voted'].values():
+        for bit in get_bit_positions(votes):
+            counts[bit.bit_length()-1] += 1
+
+    return web.json_response({
+        'title': request.match_info['title'],
+        'options': [ { 'name': opt, 'votes': count } for opt, count in zip(vote_info['options'], counts) ],
+        'voters': len(vote_info['voted']),
+        'max_votes': vote_info['max_votes'],
+        'closed': vote_info['closed'],
+        'close_date': vote_info['close_date']
+    })
+
+@routes.get('/api/guilds/{guild_id}/export/{kind}')
+async def export(request: web.Request) -> web.StreamResponse:
+    """匯出投票或回應資料
+
+    kind為votes或responses，?format=csv|jsonl(預設csv)，投票可用?title=指定單一投票。
+    資料逐段編碼並直接串流輸出。
+    資料包含每個成員的選擇(包括不顯示投票成員的投票)，沒有設定EXPORT_TOKEN時此網頁不存在。
+    """
+    _check_token(request, EXPORT_TOKEN)
+    kind: str = request.match_info['kind']
+    fmt: str = request.query.get('format', 'csv')
+    guild_id: str = request.match_info['guild_id']
+    if fmt not in exporter.FORMATS:
+        raise web.HTTPBadRequest(text=f'format must be one of {", ".join(exporter.FORMATS)}')
+
+    chunks: Iterator[str]
+    if kind == 'votes':
+        data_manager = _vote_data_manager(request)
+        title: Optional[str] = request.query.get('title')
+        if title is not None and not data_manager.get_val(title, guild_id):
+            raise web.HTTPNotFound()
+        chunks = exporter.encode(exporter.vote_rows(data_manager, guild_id, title), exporter.VOTE_FIELDS, fmt)
+    elif kind == 'responses':
+        cog: Optional[commands.Cog] = request.app['bot'].get_cog('Response')
+        if cog is None:
+            raise web.HTTPServiceUnavailable()
+        data: Optional[Dict[str, Any]] = cog.data_manager.get_val(guild_id) # type: ignore
+        if data is None:
+            raise web.HTTPNotFound()
+        chunks = exporter.encode(exporter.response_rows(response_presets.flatten(data)), exporter.RESPONSE_FIELDS, fmt)
+    else:
+        raise web.HTTPNotFound()
+
+    response: web.StreamResponse = web.StreamResponse(headers={
+        'Content-Disposition': f'attachment; filename="{guild_id}-{kind}.{fmt}"'
+    })
+    response.content_type = exporter.FORMATS[fmt]
+    response.charset = 'utf-8'
+    await response.prepare(request)
+    for chunk in chunks:
+        await response.write(chunk.encode('utf-8'))
+    await response.write_eof()
+    return response
+
+@routes.get('/guilds/{guild_id}/responses')
+async def response_page(request: web.Request) -> web.StreamResponse:
+    """以網頁表格顯示伺服器的回應
+
+    頁面依伺服器與資料版本快取(PageCache)，並支援ETag；過大的頁面不快取，直接串流輸出。
+    表格的每一列在輸出時才產生，不會先在記憶體中建立整個表格。
+    """
+    cog: Optional[commands.Cog] = request.app['bot'].get_cog('Response')
+    if cog is None:
+        raise web.HTTPServiceUnavailable()
+    data_manager = cog.data_manager # type: ignore
+    guild_id: str = request.match_info['guild_id']
+
+    version: int = data_manager.version(guild_id)
+    etag: str = f'"{BOOT_ID}-{guild_id}-{version}"'
+    headers: Dict[str, str] = { 'ETag': etag, 'Cache-Control': 'no-cache' }
+    if etag in request.headers.get('If-None-Match', ''):
+        return web.Response(status=304, headers=headers)
+
+    page_cache: PageCache = request.app['response_pages']
+    body: Optional[bytes] = page_cache.get(guild_id, version)
+    if body is not None:
+        return web.Response(body=body, headers=headers, content_type='text/html', charset='utf-8')
+
+    data: Optional[Dict[str, Any]] = data_manager.get_val(guild_id)
+    if data is None:
+        raise web.HTTPNotFound()
+
+    response: web.StreamResponse = web.StreamResponse(headers=headers)
+    response.content_type = 'text/html'
+    response.charset = 'utf-8'
+    await response.prepare(request)
+
+    template: Template = templates.get_template('response.html')
+    chunks: Optional[List[bytes]] = []
+    size: int = 0
+    flat: Dict[str, Any] = response_presets.flatten(data)
+    maxcol: int = max([ bin(trip['links']).count('1') for trip in flat['trips'] ], default=0)
+    for text in template.generate(responsesPedia=_responses_pedia(flat), maxcol=maxcol):
+        chunk: bytes = text.encode('utf-8')
+        await response.write(chunk)
+        if chunks is not None:
+            size += len(chunk)
+            chunks.append(chunk)
+            if size > PAGE_CACHE_LIMIT:
+                chunks = None
+    await response.write_eof()
+
+    if chunks is not None:
+        page_cache.put(guild_id, version, b''.join(chunks))
+    else:
+        page_cache.discard(guild_id)
+    return response
+
+def _responses_pedia(data: Dict[str, Any]) -> Iterator[Tuple[str, List[str]]]:
+    """依序產生樣板表格的每一列(觸發詞, 回應)
+
+    連結相同回應的觸發詞會合併在同一列，以「</>」分開。
+    """
+    trip_links: List[Tuple[int, str]] = sorted([ (t['links'], t['word']) for t in data['trips'] ], key=lambda x: x[0])
+    for links, group in groupby(trip_links, key=lambda x: x[0]):
+        yield '</>'.join([ word for _, word in group ]), [ str(escape(data['reacts'][bit.bit_length()-1])) for bit in get_bit_positions(links) ]
+
+def _check_token(request: web.Request, token: Optional[str]) -> None:
+    """檢查請求的 Authorization: Bearer <token>，沒有設定token時網頁不存在"""
+    if token is None:
+        raise web.HTTPNotFound()
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        raise web.HTTPUnauthorized()
+
+def _vote_data_manager(request: web.Request) -> Any:
+    cog: Optional[commands.Cog] = request.app['bot'].get_cog('Vote')
+    if cog is None:
+        raise web.HTTPServiceUnavailable()
+    return cog.data_manager # type: ignore
+
+def _shard_state(bot: commands.Bot) -> Dict[str, Any]:
+    shards: Dict[str, Any] = {}
+    for shard_id, shard in getattr(bot, 'shards', {}).items():
+        shards[str(shard_id)] = { 'latency_ms': _finite(shard.latency * 1000), 'closed': shard.is_closed() }
+    return {
+        'shard_id': bot.shard_id,
+        'shard_count': bot.shard_count,
+        'shards': shards
+    }
+
+def _finite(n: float) -> Optional[float]:
+    return n if math.isfinite(n) else None
+
+async def run(bot: commands.Bot, host: str='0.0.0.0', port: int=8080) -> None:
+    """在機器人的事件迴圈上啟動網頁伺服器"""
+    app: web.Application = web.Application()
+    app['bot'] = bot
+    app['health_cache'] = (0.0, 503, b'')
+    app['response_pages'] = PageCache()
+    app.add_routes(routes)
+
+    runner: web.AppRunner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    monitor.spawn(monitor.loop_lag.run(), name='loop_lag')
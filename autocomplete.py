@@ -0,0 +1,79 @@
+import discord
+from discord.ext import commands
+from discord_slash import SlashCommand
+from discord_slash.utils.manage_commands import create_option
+from typing import Optional, Callable, List, Tuple, Dict, Any
+from rest_scheduler import scheduler, INTERACTION
+import monitor
+import tracing
+
+"""自動完成
+
+discord_slash 2.4不支援自動完成互動(type 4)，收到時會錯誤跳出。
+setup()以自己的監聽器取代discord_slash的on_socket_response，自動完成互動在此處理，其他互動交回discord_slash。
+
+以register(指令, 選項名稱, handler)註冊，handler(guild_id, 子指令路徑, 目前輸入值)回傳候選值清單，
+必須是不讀取資料庫的同步程序，每次按鍵都會呼叫。
+"""
+
+MAX_CHOICES:      int = 25
+MAX_CHOICE_CHARS: int = 100
+
+Handler = Callable[[str, List[str], str], List[str]]
+
+handlers: Dict[Tuple[str, str], Handler] = {}
+
+def register(command: str, option: str, handler: Handler) -> None:
+    handlers[(command, option)] = handler
+
+def create_autocomplete_option(name: str, description: str, option_type: int, required: bool) -> Dict[str, Any]:
+    """與create_option相同，但開啟自動完成(不可與choices同時使用)"""
+    option: Dict[str, Any] = create_option(name=name, description=description, option_type=option_type, required=required)
+    del option['choices']
+    option['autocomplete'] = True
+    return option
+
+def setup(bot: commands.Bot, slash: SlashCommand) -> None:
+    bot.remove_listener(slash.on_socket_response)
+
+    async def on_socket_response(msg: Dict[str, Any]) -> None:
+        if msg['t'] == 'INTERACTION_CREATE' and msg['d']['type'] == 4:
+            await _complete(slash, msg['d'])
+        else:
+            await slash.on_socket_response(msg)
+
+    bot.add_listener(on_socket_response, 'on_socket_response')
+
+async def _complete(slash: SlashCommand, interaction: Dict[str, Any]) -> None:
+    command: str = interaction['data']['name']
+    path: List[str] = []
+    options: List[Dict[str, Any]] = interaction['data'].get('options', [])
+    # 子指令群組(2)與子指令(1)的選項在下一層
+    while options and options[0]['type'] in (1, 2):
+        path.append(options[0]['name'])
+        options = options[0].get('options', [])
+    focused: Optional[Dict[str, Any]] = next((option for option in options if option.get('focused')), None)
+    handler: Optional[Handler] = handlers.get((command, focused['name'])) if focused is not None else None
+
+    with tracing.span(f'autocomplete /{" ".join([command] + path)}', **{ 'discord.interaction_id': interaction['id'] }):
+        choices: List[str] = []
+        if handler is not None and focused is not None and interaction.get('guild_id'):
+            try:
+                choices = handler(interaction['guild_id'], path, str(focused.get('value', '')))
+            except Exception as ex:
+                monitor.errors.report(f'autocomplete:{command}', ex)
+        data: Dict[str, Any] = {
+            'type': 8,
+            'data': {
+                'choices': [
+                    { 'name': choice, 'value': choice }
+                    for choice in choices if len(choice) <= MAX_CHOICE_CHARS
+                ][:MAX_CHOICES]
+            }
+        }
+        try:
+            await scheduler.submit(INTERACTION, ('interaction', interaction['id']),
+                                   lambda: slash.req.post_initial_response(data, interaction['id'], interaction['token']))
+        except discord.NotFound:
+            # 使用者輸入太快時，舊的自動完成互動可能已經失效
+            pass
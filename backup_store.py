@@ -0,0 +1,179 @@
+from typing import Optional, Iterator, List, Tuple, Dict, Set, Any
+from hashlib import sha256
+import asyncio
+import gzip
+import json
+import os
+import time
+from variable import BACKUP_DIR
+from records import encode
+import tracing
+
+"""增量備份
+
+以鍵值(一個投票、一個伺服器的回應)為單位備份，內容以sha256定址，相同的內容只存一份：
+
+<BACKUP_DIR>/objects/ab/cdef....json.gz     一筆內容值(排序鍵值的json)
+<BACKUP_DIR>/<type>.jsonl                   每行一次快照中改變的鍵值：
+{ "time": 時間戳, "changes": [ [ [tag1, ..., key], hash 或 null(已刪除) ], ... ] }
+
+快照只讀取DataManager.take_dirty()回傳的鍵值，只寫入內容改變的鍵值，
+備份的空間與時間隨變更量增加，而不是隨資料總量增加。
+json編碼在事件迴圈中分批進行(不會讀到修改到一半的紀錄)，雜湊、壓縮與寫檔在執行緒中進行。
+
+還原時依序讀取快照紀錄到指定時間，取得當時的內容值，可以還原單一鍵值或一組tags(例如一個伺服器)下的所有鍵值。
+多行程分片時只應由一個行程進行快照。
+"""
+
+# 每編碼多少筆內容值讓出一次事件迴圈
+BATCH_SIZE: int = 100
+
+Key = Tuple[str, ...]
+
+class BackupStore:
+    """一種資料(DataManager)的備份"""
+    def __init__(self, data_manager: Any, root: str = BACKUP_DIR) -> None:
+        self.data_manager: Any = data_manager
+        self.__objects: str = os.path.join(root, 'objects')
+        self.__log: str = os.path.join(root, f'{data_manager.type}.jsonl')
+        # 最後一次快照時每個鍵值的hash，第一次快照時從快照紀錄讀取
+        self.__current: Optional[Dict[Key, str]] = None
+        # 快照失敗時尚未備份的鍵值，下一次快照時一併處理
+        self.__retry: Set[Key] = set()
+        self.__lock: asyncio.Lock = asyncio.Lock()
+        os.makedirs(self.__objects, exist_ok=True)
+
+    def __object_path(self, digest: str) -> str:
+        return os.path.join(self.__objects, digest[:2], f'{digest[2:]}.json.gz')
+
+    def __put(self, digest: str, raw: bytes) -> None:
+        path: str = self.__object_path(digest)
+        if os.path.isfile(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f'{path}.tmp', 'wb') as f:
+            f.write(gzip.compress(raw, mtime=0))
+        os.replace(f'{path}.tmp', path)
+
+    def __load(self, digest: str) -> Dict[str, Any]:
+        with open(self.__object_path(digest), 'rb') as f:
+            return json.loads(gzip.decompress(f.read()))
+
+    def __snapshots(self) -> Iterator[Dict[str, Any]]:
+        if not os.path.isfile(self.__log):
+            return
+        with open(self.__log, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # 寫到一半中斷的最後一行
+                    continue
+
+    def __replay(self, at: Optional[float] = None, prefix: Key = ()) -> Dict[Key, str]:
+        """回傳at時(None為最新)以prefix開頭的鍵值的hash"""
+        hashes: Dict[Key, str] = {}
+        for snapshot in self.__snapshots():
+            if at is not None and snapshot['time'] > at:
+                break
+            for k, digest in snapshot['changes']:
+                key: Key = tuple(k)
+                if key[:len(prefix)] != prefix:
+                    continue
+                if digest is None:
+                    hashes.pop(key, None)
+                else:
+                    hashes[key] = digest
+        return hashes
+
+    def __write(self, encoded: List[Tuple[Key, Optional[bytes]]]) -> int:
+        """(執行緒中)寫入內容改變的鍵值與快照紀錄，回傳改變的數量"""
+        assert self.__current is not None
+        changes: List[Tuple[Key, Optional[str]]] = []
+        for key, raw in encoded:
+            digest: Optional[str] = sha256(raw).hexdigest() if raw is not None else None
+            if self.__current.get(key) == digest:
+                continue
+            if raw is not None and digest is not None:
+                self.__put(digest, raw)
+            changes.append((key, digest))
+        if not changes:
+            return 0
+
+        with open(self.__log, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({ 'time': time.time(), 'changes': [ [list(key), digest] for key, digest in changes ] }, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        for key, digest in changes:
+            if digest is None:
+                self.__current.pop(key, None)
+            else:
+                self.__current[key] = digest
+        return len(changes)
+
+    async def snapshot(self) -> int:
+        """備份上次快照後改變的鍵值，回傳改變的數量"""
+        async with self.__lock:
+            loop: asyncio.AbstractEventLoop = asyncio.get_event_loop()
+            with tracing.span('backup.snapshot', **{ 'db.collection': self.data_manager.type }):
+                if self.__current is None:
+                    self.__current = await loop.run_in_executor(None, self.__replay)
+                dirty: Optional[List[Tuple[List[str], str]]] = self.data_manager.take_dirty()
+                keys: Set[Key]
+                if dirty is None:
+                    # 無法得知哪些鍵值改變，檢查所有鍵值與已刪除的鍵值
+                    keys = { tuple(tags) + (key,) for tags, key in self.data_manager.keys() } | set(self.__current)
+                else:
+                    keys = { tuple(tags) + (key,) for tags, key in dirty }
+                keys |= self.__retry
+                self.__retry = set()
+
+                try:
+                    pairs: List[Tuple[List[str], str]] = [ (list(key[:-1]), key[-1]) for key in keys ]
+                    encoded: List[Tuple[Key, Optional[bytes]]] = []
+                    for i in range(0, len(pairs), BATCH_SIZE):
+                        batch: List[Tuple[List[str], str]] = pairs[i:i+BATCH_SIZE]
+                        for (tags, key), data in zip(batch, self.data_manager.get_many(batch)):
+                            encoded.append((tuple(tags) + (key,), json.dumps(
+                                data, ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=encode
+                            ).encode('utf-8') if data is not None else None))
+                        await asyncio.sleep(0)
+                    return await loop.run_in_executor(None, self.__write, encoded)
+                except Exception:
+                    self.__retry |= keys
+                    raise
+
+    def history(self, prefix: Key) -> List[float]:
+        """回傳以prefix開頭的鍵值有改變的快照時間"""
+        return [
+            snapshot['time'] for snapshot in self.__snapshots()
+            if any(tuple(k)[:len(prefix)] == prefix for k, _ in snapshot['changes'])
+        ]
+
+    async def restore(self, prefix: Key, at: float) -> int:
+        """將prefix本身與prefix開頭的鍵值還原成at時的內容，回傳還原的鍵值數量
+
+        prefix為(guild_id,)時還原整個伺服器，(guild_id, 標題)時還原一個投票。
+        at時不存在的鍵值會被刪除。
+        """
+        loop: asyncio.AbstractEventLoop = asyncio.get_event_loop()
+        with tracing.span('backup.restore', **{ 'db.collection': self.data_manager.type, 'db.key': '/'.join(prefix) }):
+            hashes: Dict[Key, str] = await loop.run_in_executor(None, self.__replay, at, prefix)
+            values: Dict[Key, Dict[str, Any]] = await loop.run_in_executor(
+                None, lambda: { key: self.__load(digest) for key, digest in hashes.items() }
+            )
+
+            existing: List[Key] = [ tuple(tags) + (key,) for tags, key in self.data_manager.keys(list(prefix)) ]
+            if self.data_manager.get_val(prefix[-1], list(prefix[:-1])) is not None:
+                existing.append(prefix)
+
+            groups: Dict[Key, Tuple[List[Tuple[str, Dict[str, Any]]], List[str]]] = {}
+            for key, data in values.items():
+                groups.setdefault(key[:-1], ([], []))[0].append((key[-1], data))
+            for key in existing:
+                if key not in values:
+                    groups.setdefault(key[:-1], ([], []))[1].append(key[-1])
+            for tags, (items, deleted) in groups.items():
+                self.data_manager.set_many(items, list(tags))
+                self.data_manager.del_many(deleted, list(tags))
+            return len(values) + sum(len(deleted) for _, deleted in groups.values())
@@ -0,0 +1,148 @@
+from discord.ext import commands, tasks
+from discord_slash import cog_ext
+from discord_slash.utils.manage_commands import create_option, create_choice
+from discord_slash.context import SlashContext
+from typing import Optional, List, Tuple, Dict
+from datetime import datetime, timedelta, timezone
+from variable import DATETIME_FORMAT, BACKUP_INTERVAL_MINUTES, SHARD_IDS
+from utils import UserError
+from backup_store import BackupStore, Key
+from rest_scheduler import scheduler
+
+class Backup(commands.Cog):
+    """備份模組
+
+    定期將投票與回應的變更備份(見backup_store)，並提供機器人擁有者還原伺服器或投票的指令。
+    備份的時間與投票的關閉時間相同，以UTC+8表示。
+    """
+    def __init__(self, bot: commands.Bot) -> None:
+        self.bot: commands.Bot = bot
+        self.stores: Dict[str, BackupStore] = {}
+        # 多行程分片時只由負責分片0的行程進行快照
+        if BACKUP_INTERVAL_MINUTES and (not SHARD_IDS or 0 in SHARD_IDS):
+            self.backup_snapshot.change_interval(minutes=BACKUP_INTERVAL_MINUTES)
+            self.backup_snapshot.start()
+
+    def store(self, kind: str) -> BackupStore:
+        """取得投票(vote)或回應(response)的備份"""
+        if kind not in self.stores:
+            cog: Optional[commands.Cog] = self.bot.get_cog(kind.capitalize())
+            if cog is None:
+                raise UserError('permission', f'{kind}模組沒有載入！')
+            self.stores[kind] = BackupStore(cog.data_manager) # type: ignore
+        return self.stores[kind]
+
+    @tasks.loop(minutes=60.0)
+    async def backup_snapshot(self) -> None:
+        """備份行程
+
+        每BACKUP_INTERVAL_MINUTES分鐘備份一次投票與回應的變更。
+        """
+        for kind in ('vote', 'response'):
+            await self.store(kind).snapshot()
+
+    @backup_snapshot.before_loop
+    async def before_backup_snapshot(self) -> None:
+        await self.bot.wait_until_ready()
+
+    def cog_unload(self) -> None:
+        self.backup_snapshot.cancel()
+
+    @staticmethod
+    def to_timestamp(at: str) -> float:
+        try:
+            return (datetime.strptime(at.strip(), DATETIME_FORMAT) - timedelta(hours=8)).replace(tzinfo=timezone.utc).timestamp()
+        except ValueError:
+            raise UserError('permission', f'時間格式錯誤，請使用 {datetime(2021, 1, 1).strftime(DATETIME_FORMAT)} 的格式。')
+
+    @staticmethod
+    def to_datetime(timestamp: float) -> str:
+        return (datetime.fromtimestamp(timestamp, timezone.utc) + timedelta(hours=8)).strftime(DATETIME_FORMAT)
+
+    def prefix(self, ctx: SlashContext, kind: str, guild_id: Optional[str], title: Optional[str]) -> Key:
+        if title is not None and kind != 'vote':
+            raise UserError('permission', '只有投票可以指定標題！')
+        guild: str = (guild_id or str(ctx.guild_id)).strip()
+        return (guild, title.strip()) if title is not None else (guild,)
+
+    backup_options = [
+        create_option(
+            name='kind',
+            description='資料種類。',
+            option_type=3,
+            required=True,
+            choices=[
+                create_choice(name='投票', value='vote'),
+                create_choice(name='回應', value='response')
+            ]
+        ),
+        create_option(
+            name='guild_id',
+            description='伺服器id。(預設為此伺服器)',
+            option_type=3,
+            required=False
+        ),
+        create_option(
+            name='title',
+            description='投票標題，只處理此投票。(預設為整個伺服器)',
+            option_type=3,
+            required=False
+        )
+    ]
+
+    @cog_ext.cog_subcommand(
+        base='backup',
+        name='history',
+        description='列出伺服器或投票的備份時間。(限機器人擁有者)',
+        options=backup_options
+    )
+    async def _backup_history(self, ctx: SlashContext, kind: str, guild_id: Optional[str] = None, title: Optional[str] = None) -> None:
+        """備份紀錄指令
+
+        /backup history <kind> [guild_id] [title]
+        列出最近有變更的快照時間，用於選擇還原的時間。
+        """
+        if not await self.bot.is_owner(ctx.author):
+            raise UserError('permission', '只有機器人擁有者可以使用此指令！')
+        prefix: Key = self.prefix(ctx, kind, guild_id, title)
+        times: List[float] = await self.bot.loop.run_in_executor(None, self.store(kind).history, prefix)
+        if not times:
+            raise UserError('permission', '沒有備份紀錄！')
+        await scheduler.respond(ctx, content='\n'.join([ self.to_datetime(t) for t in times[-20:] ]), hidden=True)
+
+    @cog_ext.cog_subcommand(
+        base='backup',
+        name='restore',
+        description='將伺服器或投票還原到指定時間的備份。(限機器人擁有者)',
+        options=backup_options + [
+            create_option(
+                name='at',
+                description=f'還原到此時間的備份。(UTC+8，格式為 {datetime(2021, 1, 1).strftime(DATETIME_FORMAT)})',
+                option_type=3,
+                required=True
+            )
+        ]
+    )
+    async def _backup_restore(self, ctx: SlashContext, kind: str, at: str, guild_id: Optional[str] = None, title: Optional[str] = None) -> None:
+        """還原指令
+
+        /backup restore <kind> <at> [guild_id] [title]
+        還原前先進行一次快照，還原的內容也會記錄在下一次快照，還原後仍可再還原回來。
+        投票表單不會自動更新。
+        """
+        if not await self.bot.is_owner(ctx.author):
+            raise UserError('permission', '只有機器人擁有者可以使用此指令！')
+        prefix: Key = self.prefix(ctx, kind, guild_id, title)
+        timestamp: float = self.to_timestamp(at)
+
+        await scheduler.defer(ctx, hidden=True)
+        store: BackupStore = self.store(kind)
+        await store.snapshot()
+        count: int = await store.restore(prefix, timestamp)
+        if kind == 'vote':
+            # 標題索引下次使用時重新讀取，其他行程則在讀到修改時重新讀取(見title_index)
+            self.bot.get_cog('Vote').titles.drop(prefix[0]) # type: ignore
+        await scheduler.respond(ctx, content=f'已還原{count}筆資料至 {at.strip()} 的備份。', hidden=True)
+
+def setup(bot: commands.Bot) -> None:
+    bot.add_cog( Backup(bot) )
@@ -1,6 +1,15 @@
+import discord
 from discord.ext import commands
 from discord_slash import cog_ext
+from discord_slash.utils.manage_commands import create_option
 from discord_slash.context import SlashContext
+from typing import List, Tuple
+from datetime import datetime
+from io import BytesIO
+import monitor
+import profiler
+from rest_scheduler import scheduler
+from utils import UserError
 
 class Misc(commands.Cog):
     def __init__(self, bot: commands.Bot) -> None:
@@ -12,7 +21,42 @@ class Misc(commands.Cog):
     }
     @cog_ext.cog_slash(**ping_kwargs)
     async def _ping(self, ctx: SlashContext) -> None:
-        await ctx.send(f'Pong! ({self.bot.latency*1000}ms)', hidden=True)
+        await scheduler.respond(ctx, content=f'Pong! ({self.bot.latency*1000}ms)', hidden=True)
+
+    profile_kwargs = {
+        'name': 'profile',
+        'description': '分析機器人效能。(限機器人擁有者)',
+        'options': [
+            create_option(
+                name='seconds',
+                description='取樣秒數。(預設為10，最多60)',
+                option_type=4,
+                required=False
+            )
+        ]
+    }
+    @cog_ext.cog_slash(**profile_kwargs)
+    async def _profile(self, ctx: SlashContext, seconds: int=10) -> None:
+        """效能分析指令
+
+        /profile [seconds]
+        取樣整個行程的呼叫堆疊，回傳collapsed stack檔案，並列出最近最慢的回呼。
+        """
+        if not await self.bot.is_owner(ctx.author):
+            raise UserError('permission', '只有機器人擁有者可以使用此指令！')
+        if profiler.running():
+            raise UserError('permission', '已經有一個分析正在進行中！')
+        seconds = max(1, min(seconds, int(profiler.MAX_SECONDS)))
+
+        await scheduler.defer(ctx, hidden=True)
+        stacks = await profiler.profile(seconds)
+
+        slowest: List[Tuple[float, str, float]] = monitor.callbacks.slowest(10)
+        lines: List[str] = [ f'{s*1000:8.1f}ms {name} ({datetime.fromtimestamp(at):%H:%M:%S})' for s, name, at in slowest ]
+        content: str = f'取樣{seconds}秒，共{sum(stacks.values())}筆堆疊。'
+        if lines:
+            content += '\n最慢的回呼：\n```\n' + '\n'.join(lines) + '\n```'
+        await scheduler.respond(ctx, content=content, file=discord.File(BytesIO(profiler.collapsed(stacks)), filename='profile.collapsed.txt'), hidden=True)
 
 def setup(bot: commands.Bot) -> None:
-    bot.add_cog( Misc(bot) )
\ No newline at end of file
+    bot.add_cog( Misc(bot) )
@@ -5,14 +5,28 @@ from discord_slash.utils.manage_commands import create_option, create_choice
 from discord_slash.utils.manage_components import create_select, create_select_option, create_actionrow
 from discord_slash.context import SlashContext, ComponentContext
 from discord_slash.model import SlashMessage
-from typing import Optional, Union, List, Tuple, Dict, Set, Any
+from typing import Optional, Iterator, Union, List, Tuple, Dict, Set, Any
+from tempfile import SpooledTemporaryFile
+import discord
 import re
-from random import choice
+from bisect import bisect_left
 from math import log2
 from itertools import groupby
-from utils import get_bit_positions
+from utils import get_bit_positions, AliasTable, UserError
 from variable import DATETIME_FORMAT
 from data_manager import DataManager
+from records import ResponseSet
+from trip_matcher import TripMatcher, check_pattern
+from normalizer import normalize, normalize_with_offsets
+from react_template import ReactTemplate
+import react_template
+import response_presets
+from reply_throttle import throttle
+from rest_scheduler import scheduler
+import reply_throttle
+import tracing
+import exporter
+import importer
 
 class Response(commands.Cog):
     """Response modules
@@ -26,6 +40,23 @@ class Response(commands.Cog):
     with it; if user's message contain the word 'trip_2', the bot will follow
     the link and find the words: 'react_1' and 'react_2', and reply the user
     with one of it.
+
+    A trip may give its links weights, keyed by the react position. Links
+    without a weight have a weight of 1. In the example below, 'trip_2'
+    replies 'react_2' three times as often as 'react_1'.
+
+    A trip may also have a 'mode' (see trip_matcher.MODES) to be matched as
+    a whole word, a wildcard or a regex instead of a plain substring.
+
+    Reacts may be templates (see react_template), for example
+    '{{author}} said {{}}!'.
+
+    A guild may also install shared presets (see response_presets), its
+    own trips are matched first and shadow preset trips with the same word.
+
+    Replies are throttled per channel (see reply_throttle). During a burst a
+    guild's replies are merged into one message, or dropped if its 'burst'
+    is set to 'drop'.
     
     data = {
         'trips': [
@@ -35,7 +66,8 @@ class Response(commands.Cog):
             },
             {
                 'word': 'trip_2',
-                'links': 3
+                'links': 3,
+                'weights': { '1': 3 }
             }
         ],
         'reacts': [
@@ -46,7 +78,11 @@ class Response(commands.Cog):
     """
     def __init__(self, bot: commands.Bot) -> None:
         self.bot: commands.Bot = bot
-        self.data_manager = DataManager('response')
+        self.data_manager = DataManager('response', ResponseSet)
+        # guild id -> (data version, matcher, preset trip words the guild does not use)
+        self.matchers: Dict[int, Tuple[int, TripMatcher, Set[str]]] = {}
+        # guild id -> (data version, trip word -> (links, sampler))
+        self.samplers: Dict[int, Tuple[int, Dict[str, Tuple[int, AliasTable]]]] = {}
         
     @commands.Cog.listener()
     async def on_ready(self) -> None:
@@ -66,31 +102,128 @@ class Response(commands.Cog):
         self.data_manager.del_val(guild.id)
     
     @commands.Cog.listener()
+    @tracing.traced('on_message')
     async def on_message(self, message: Message) -> None:
         # if the message sender is the bot itself, return
         if message.author == self.bot.user:
             return
 
-        message.content = re.sub("((?:(?:https?|ftp):\/\/)[\w/\-?=%.]+\.[\w/\-&?=%.]+)", '', message.content).lower().replace('\\|', '|')
+        text: str = re.sub("((?:(?:https?|ftp):\/\/)[\w/\-?=%.]+\.[\w/\-&?=%.]+)", '', message.content).replace('\\|', '|')
+        content: str
+        offsets: Optional[List[int]]
+        content, offsets = normalize_with_offsets(text)
             
-        # print(message.content)
+        # print(content)
 
         data: Dict[str, Any] = self.data_manager.get_val(message.guild.id)
 
         replys: List[Tuple[int, str]] = []
+        chosen: Dict[Tuple[str, str], int] = {}
         
-        for trip in sorted(data['trips'], key=lambda x:len(x['word']), reverse=True):
-            if trip['word'] in message.content:
-                bit: int = choice(list(get_bit_positions(trip['links'])))
-                for match in re.finditer(trip['word'], message.content):
-                    replys.append((match.start(), data['reacts'][int(log2(bit))]))
+        # every occurrence of the same trip gets the same react
+        for start, end, layer, trip, reacts in self.find_trips(message.guild.id, data, content):
+            if (layer, trip['word']) not in chosen:
+                chosen[(layer, trip['word'])] = (
+                    response_presets.presets[layer].sampler(trip) if layer else self.get_sampler(message.guild.id, trip)
+                ).sample()
+            if offsets:
+                start, end = offsets[start], offsets[end-1] + 1
+            react: ReactTemplate = react_template.get(reacts[chosen[(layer, trip['word'])]])
+            replys.append((start, react.render(text[start:end], message.author.mention)))
         
         replys = sorted(replys, key=lambda x: x[0])
         
         if replys:
-            await message.reply('\n'.join([ r[1] for r in replys ]))  
+            reply: str = '\n'.join([ r[1] for r in replys ])[:react_template.MAX_LENGTH]
+            sent: Optional[Any] = throttle.send(message, reply, data.get('burst', reply_throttle.MERGE))
+            if sent is not None:
+                await sent
         
     
+    def find_trips(self, guild_id: int, data: Dict[str, Any], content: str
+                   ) -> Iterator[Tuple[int, int, str, Dict[str, Any], List[Any]]]:
+        """Yield (start, end, layer, trip, reacts) of every trip found in content
+
+        The guild's own trips are layered over its presets: layer is '' for
+        the guild's trips, or the name of the preset the trip comes from.
+        Preset matchers are shared by every guild that installed the preset.
+
+        Earlier layers win: a preset match is skipped if it overlaps a span
+        matched by an earlier layer, or if its word was already matched by an
+        earlier layer, so one piece of text never gets two replies.
+        """
+        # matched text of earlier layers, as sorted disjoint spans
+        spans: List[Tuple[int, int]] = []
+        words: Set[str] = set()
+
+        def overlaps(start: int, end: int) -> bool:
+            # only the last span starting before end can overlap
+            i: int = bisect_left(spans, (end, end))
+            return i > 0 and spans[i-1][1] > start
+
+        def cover(start: int, end: int) -> None:
+            # matches of one layer may overlap each other, merge them
+            i: int = bisect_left(spans, (start, start))
+            if i > 0 and spans[i-1][1] >= start:
+                i -= 1
+                start = spans[i][0]
+            j: int = i
+            while j < len(spans) and spans[j][0] <= end:
+                end = max(end, spans[j][1])
+                j += 1
+            spans[i:j] = [(start, end)]
+
+        matcher, hidden = self.get_matcher(guild_id, data)
+        layers: List[Tuple[str, TripMatcher, List[Any]]] = [ ('', matcher, data['reacts']) ] + [
+            (preset.name, preset.matcher, preset.reacts) for preset in response_presets.installed(data)
+        ]
+        for layer, layer_matcher, reacts in layers:
+            matches: List[Tuple[int, int, Dict[str, Any]]] = [
+                (start, end, trip) for start, end, trip in layer_matcher.finditer(content)
+                if not layer or trip['word'] not in hidden and trip['word'] not in words and not overlaps(start, end)
+            ]
+            for start, end, trip in matches:
+                yield start, end, layer, trip, reacts
+            for start, end, trip in matches:
+                cover(start, end)
+                words.add(trip['word'])
+
+    def get_matcher(self, guild_id: int, data: Dict[str, Any]) -> Tuple[TripMatcher, Set[str]]:
+        """Get the compiled trips of a guild, and the preset trips it does not use
+
+        Matchers are cached per guild and rebuilt when the guild's data version changes.
+        """
+        version: int = self.data_manager.version(guild_id)
+        cached: Optional[Tuple[int, TripMatcher, Set[str]]] = self.matchers.get(guild_id)
+        if cached and cached[0] == version:
+            return cached[1], cached[2]
+
+        matcher: TripMatcher = TripMatcher(data['trips'])
+        hidden: Set[str] = response_presets.hidden_words(data)
+        self.matchers[guild_id] = (version, matcher, hidden)
+        return matcher, hidden
+
+    def get_sampler(self, guild_id: int, trip: Dict[str, Any]) -> AliasTable:
+        """Get the react sampler of a trip
+
+        Samplers are cached per trip and rebuilt when the trip's links change,
+        or when the guild's data version changes (add/remove/import/restore,
+        or a write from another process).
+        """
+        version: int = self.data_manager.version(guild_id)
+        if guild_id not in self.samplers or self.samplers[guild_id][0] != version:
+            self.samplers[guild_id] = (version, {})
+        samplers: Dict[str, Tuple[int, AliasTable]] = self.samplers[guild_id][1]
+        cached: Optional[Tuple[int, AliasTable]] = samplers.get(trip['word'])
+        if cached and cached[0] == trip['links']:
+            return cached[1]
+
+        weights: Dict[str, int] = trip.get('weights', {})
+        react_pos_list: List[int] = [ bit.bit_length()-1 for bit in get_bit_positions(trip['links']) ]
+        sampler: AliasTable = AliasTable(react_pos_list, [ weights.get(str(pos), 1) for pos in react_pos_list ])
+        samplers[trip['word']] = (trip['links'], sampler)
+        return sampler
+
     response_add_kwargs = {
         'base': 'response',
         'name': 'add',
@@ -109,6 +242,24 @@ class Response(commands.Cog):
                 option_type=3,
                 required=True
             ),
+            create_option(
+                name='mode',
+                description='How trips are matched. (Default as literal, use "\\|" for "|" in patterns)',
+                option_type=3,
+                required=False,
+                choices=[
+                    create_choice(name='literal: contains the text', value='literal'),
+                    create_choice(name='word: contains the text as a whole word', value='word'),
+                    create_choice(name='wildcard: "*" is any text, "?" is any character', value='wildcard'),
+                    create_choice(name='regex: regular expression', value='regex')
+                ]
+            ),
+            create_option(
+                name='weight',
+                description='How likely these reacts are picked compared to the other reacts of the trips. (Default as 1)',
+                option_type=4,
+                required=False
+            ),
             create_option(
                 name='hide',
                 description='Shhh... Let\'s try not to let others find out what you are adding (Default as False)',
@@ -118,19 +269,36 @@ class Response(commands.Cog):
         ]
     }
     @cog_ext.cog_subcommand(**response_add_kwargs)
-    async def _response_add(self, ctx: SlashContext, trips: str, reacts: str, hide: bool = False) -> None:
+    async def _response_add(self, ctx: SlashContext, trips: str, reacts: str, mode: str = 'literal',
+                            weight: int = 1, hide: bool = False) -> None:
         """Add responses command
 
-        /response add <trips> <reacts>
+        /response add <trips> <reacts> [mode] [weight]
         Add responses with trips/reacts system.
+        Pattern trips are checked before anything is added.
         """
-        trips                   = trips.lower().strip()
+        if weight <= 0:
+            raise UserError('response', 'Weight must be at least 1!')
+
+        # lowering a regex changes its meaning ('\S' -> '\s'), regex trips ignore case instead
+        trips                   = (trips if mode == 'regex' else normalize(trips)).strip()
         trip_list: List[str]    = list(dict.fromkeys([ self.to_origin(t).strip() for t in self.to_bracket(trips).split('|') if t ]))
+        if mode != 'literal':
+            for trip in trip_list:
+                check_pattern(trip, mode)
         reacts                  = reacts.strip()
         react_list: List[str]   = list(dict.fromkeys([ self.to_origin(r).strip() for r in self.to_bracket(reacts).split('|') if r ]))
 
         data: Dict[str, Any] = self.data_manager.get_val(ctx.guild_id)
 
+        # compile the reacts first, so invalid templates are rejected before anything is added
+        for react in react_list:
+            react_template.load(react)
+
+        # preset trips are copied into the guild before they are changed
+        for trip in trip_list:
+            response_presets.copy_on_write(data, trip)
+
         react_bits: int = 0
         
         # find exsiting react pos for bits
@@ -162,13 +330,19 @@ class Response(commands.Cog):
                         'word': trip,
                         'links': react_bits
                     })
+                    words.append(trip)
+                if mode == 'literal':
+                    data['trips'][words.index(trip)].pop('mode', None)
+                else:
+                    data['trips'][words.index(trip)]['mode'] = mode
+                self.set_weights(data['trips'][words.index(trip)], react_bits, weight)
 
             self.data_manager.set_val(ctx.guild_id, data)
 
-            await ctx.reply(f'{", ".join([ t.strip() for t in trip_list ])} are successfully added!', hidden=hide)
+            await scheduler.respond(ctx, content=f'{", ".join([ t.strip() for t in trip_list ])} are successfully added!', hidden=hide)
         else:
             miss_text: str = ' or '.join( ([] if trip_list else ['trips']) + ([] if react_list else ['reacts']) )
-            raise KeyError('response', f'You did not enter any {miss_text}!')
+            raise UserError('response', f'You did not enter any {miss_text}!')
         
 
     response_remove_kwargs = {
@@ -205,12 +379,17 @@ class Response(commands.Cog):
         Remove trips's links otherwise.
         Follow by cleaning the unlinked reacts.
         """
-        trips                   = trips.lower().strip()
+        trips                   = normalize(trips).strip()
         trip_list: List[str]    = list(dict.fromkeys([ self.to_origin(t).strip() for t in self.to_bracket(trips).split('|') if t ]))
         reacts                  = reacts.strip()
         react_list: List[str]   = list(dict.fromkeys([ self.to_origin(r).strip() for r in self.to_bracket(reacts).split('|') if r ]))
 
         data: Dict[str, Any] = self.data_manager.get_val(ctx.guild_id)
+
+        # unlinking reacts changes a preset trip, so copy it into the guild first
+        if reacts:
+            for trip in trip_list:
+                response_presets.copy_on_write(data, trip)
         
         react_bits: int = 0
         existed_trips: List[str] = []
@@ -225,16 +404,22 @@ class Response(commands.Cog):
         # unlink specify the reacts from trips
         # remove exsiting trips if reacts are not specify 
         for trip in trip_list:
-            words: List[str] = [ t['word'] for t in data['trips'] ]
+            words: List[str] = [ normalize(t['word']) for t in data['trips'] ]
             if trip in words:
                 if react_bits:
                     data['trips'][words.index(trip)]['links'] &= ~react_bits
+                    self.set_weights(data['trips'][words.index(trip)], react_bits, 1)
                     if not data['trips'][words.index(trip)]['links']:
                         del data['trips'][words.index(trip)]
+                        response_presets.mask(data, trip)
                 elif react_list:
-                    raise KeyError('response', f'Bot won\'t ever reply {", ".join([ f"[{r}]" for r in react_list ])}')
+                    raise UserError('response', f'Bot won\'t ever reply {", ".join([ f"[{r}]" for r in react_list ])}')
                 else:
                     del data['trips'][words.index(trip)]
+                    response_presets.mask(data, trip)
+                existed_trips.append(trip)
+            elif not reacts and response_presets.find_preset_trip(data, trip) is not None:
+                response_presets.mask(data, trip)
                 existed_trips.append(trip)
         
         exist_bits: int = 0
@@ -242,14 +427,16 @@ class Response(commands.Cog):
             exist_bits |= d_trip['links']
         for i in range(len(data['reacts'])):
             if (1 << i) not in list(get_bit_positions(exist_bits)):
+                if data['reacts'][i] is not None:
+                    react_template.discard(data['reacts'][i])
                 data['reacts'][i] = None
 
         self.data_manager.set_val(ctx.guild_id, data)
 
         if existed_trips:
-            await ctx.reply(f'{", ".join(existed_trips)} are successfully removed!', hidden=hide)
+            await scheduler.respond(ctx, content=f'{", ".join(existed_trips)} are successfully removed!', hidden=hide)
         else:
-            raise KeyError('response', f'Are you sure the trips exsit in the first place?')
+            raise UserError('response', f'Are you sure the trips exsit in the first place?')
 
     @cog_ext.cog_subcommand(
         base='response',
@@ -271,7 +458,7 @@ class Response(commands.Cog):
         Show all responses that contian trips,
         show all responses if trips is not specify.
         """
-        trips                   = trips.lower().strip()
+        trips                   = normalize(trips).strip()
         trip_list: List[str]    = list(dict.fromkeys([ self.to_origin(t).strip() for t in self.to_bracket(trips).split('|') if t ]))
 
         data: Dict[str, Any] = self.data_manager.get_val(ctx.guild_id)
@@ -279,13 +466,14 @@ class Response(commands.Cog):
         if not data:
             data = { 'trips': [], 'reacts': [] }
             self.data_manager.set_val(ctx.guild_id, data)
+        data = response_presets.flatten(data)
             
         embed: Embed     = Embed(title='Responses')
         words: List[str] = [ t['word'] for t in data['trips'] ]
         trip_links: List[Tuple[int, str]]
 
         if trip_list:
-            trip_links = [ (t['links'], trip) for trip in trip_list for t in data['trips'] if trip == t['word'] ]
+            trip_links = [ (t['links'], t['word']) for trip in trip_list for t in data['trips'] if trip == normalize(t['word']) ]
         else:
             trip_links = [ (t['links'], t['word']) for t in data['trips'] ]
             
@@ -303,9 +491,212 @@ class Response(commands.Cog):
         else:
             embed.add_field(name='No result of', value=', '.join(trip_list) + '\u200b')
         
-        await ctx.reply(embed=embed, hidden=True)
-            
+        await scheduler.respond(ctx, embed=embed, hidden=True)
+
+    @cog_ext.cog_subcommand(
+        base='response',
+        name='export',
+        description='Export responses as a file.',
+        options=[
+            create_option(
+                name='format',
+                description='File format. (Default as csv)',
+                option_type=3,
+                required=False,
+                choices=[ create_choice(name=fmt, value=fmt) for fmt in exporter.FORMATS ]
+            )
+        ]
+    )
+    async def _response_export(self, ctx: SlashContext, format: str = 'csv') -> None:
+        """Export responses command
+
+        /response export [format]
+        Send every trip/react link of the guild as a csv or jsonl file,
+        one row per link. The file is written to disk once it gets large.
+        """
+        data: Optional[Dict[str, Any]] = self.data_manager.get_val(ctx.guild_id)
+        if data:
+            data = response_presets.flatten(data)
+        if not data or not data['trips']:
+            raise UserError('response', 'There are no responses to export!')
+
+        await scheduler.defer(ctx, hidden=True)
+        fp = SpooledTemporaryFile(max_size=exporter.CHUNK_SIZE * 16)
+        exporter.write(fp, exporter.response_rows(data), exporter.RESPONSE_FIELDS, format)
+        fp.seek(0)
+        await scheduler.respond(ctx, file=discord.File(fp, filename=f'responses.{format}'), hidden=True)
+
+    @cog_ext.cog_subcommand(
+        base='response',
+        name='import',
+        description='Import responses from a csv or jsonl file.',
+        options=[
+            create_option(
+                name='url',
+                description='Link to the file uploaded to Discord, in the same format as /response export.',
+                option_type=3,
+                required=True
+            )
+        ]
+    )
+    async def _response_import(self, ctx: SlashContext, url: str) -> None:
+        """Import responses command
+
+        /response import <url>
+        Merge every trip/react link in the file into the guild's responses,
+        then save them with a single write.
+        """
+        await scheduler.defer(ctx, hidden=True)
+        fp = await importer.download(url, 'response')
+        with fp:
+            data: Dict[str, Any] = self.data_manager.get_val(ctx.guild_id) or { 'trips': [], 'reacts': [] }
+            result: importer.ImportResult = importer.merge_responses(data, importer.rows(fp))
+
+        if result.added or result.merged:
+            self.data_manager.set_val(ctx.guild_id, data)
+        await scheduler.respond(ctx, content=f'Imported! {result.added} added, {result.merged} merged, {result.skipped} skipped.', hidden=True)
+
+    @cog_ext.cog_subcommand(
+        base='response',
+        subcommand_group='preset',
+        name='list',
+        description='Show the response presets that can be installed.'
+    )
+    async def _response_preset_list(self, ctx: SlashContext) -> None:
+        """List presets command
+
+        /response preset list
+        Show every preset and whether the guild installed it.
+        """
+        data: Dict[str, Any] = self.data_manager.get_val(ctx.guild_id) or {}
+        if not response_presets.presets:
+            raise UserError('response', 'There are no presets to install!')
+
+        embed: Embed = Embed(title='Response presets')
+        for name, preset in response_presets.presets.items():
+            installed: str = ' (installed)' if name in data.get('presets', []) else ''
+            embed.add_field(name=f'{name}{installed}', value=f'{preset.description}\n{len(preset.trips)} trips', inline=False)
+        await scheduler.respond(ctx, embed=embed, hidden=True)
+
+    @cog_ext.cog_subcommand(
+        base='response',
+        subcommand_group='preset',
+        name='install',
+        description='Install a response preset, the guild\'s own responses take priority over it.',
+        options=[
+            create_option(
+                name='name',
+                description='Name of the preset. (See /response preset list)',
+                option_type=3,
+                required=True
+            )
+        ]
+    )
+    async def _response_preset_install(self, ctx: SlashContext, name: str) -> None:
+        """Install preset command
+
+        /response preset install <name>
+        Only the preset's name is saved, its trips are shared with every guild
+        that installed it until the guild edits one of them.
+        """
+        name = name.strip()
+        if name not in response_presets.presets:
+            raise UserError('response', f'There is no preset called "{name}"!')
+
+        data: Dict[str, Any] = self.data_manager.get_val(ctx.guild_id) or { 'trips': [], 'reacts': [] }
+        if name in data.get('presets', []):
+            raise UserError('response', f'"{name}" is already installed!')
+        data.setdefault('presets', []).append(name)
+        self.data_manager.set_val(ctx.guild_id, data)
+        await scheduler.respond(ctx, content=f'"{name}" is successfully installed!', hidden=True)
+
+    @cog_ext.cog_subcommand(
+        base='response',
+        subcommand_group='preset',
+        name='uninstall',
+        description='Uninstall a response preset, trips copied from it are kept.',
+        options=[
+            create_option(
+                name='name',
+                description='Name of the preset.',
+                option_type=3,
+                required=True
+            )
+        ]
+    )
+    async def _response_preset_uninstall(self, ctx: SlashContext, name: str) -> None:
+        """Uninstall preset command
+
+        /response preset uninstall <name>
+        Trips the guild has edited were copied into its own responses and stay.
+        Masked trips no other installed preset has are forgotten.
+        """
+        name = name.strip()
+        data: Optional[Dict[str, Any]] = self.data_manager.get_val(ctx.guild_id)
+        if not data or name not in data.get('presets', []):
+            raise UserError('response', f'"{name}" is not installed!')
+
+        data['presets'].remove(name)
+        if not data['presets']:
+            del data['presets']
+        masked: List[str] = [ word for word in data.get('masked', []) if response_presets.find_preset_trip({ **data, 'masked': [] }, word) ]
+        if masked:
+            data['masked'] = masked
+        else:
+            data.pop('masked', None)
+        self.data_manager.set_val(ctx.guild_id, data)
+        await scheduler.respond(ctx, content=f'"{name}" is successfully uninstalled!', hidden=True)
+
+    @cog_ext.cog_subcommand(
+        base='response',
+        name='burst',
+        description='Choose what happens to replies when a channel is spammed with trips.',
+        options=[
+            create_option(
+                name='policy',
+                description='What to do with replies over the channel\'s rate.',
+                option_type=3,
+                required=True,
+                choices=[
+                    create_choice(name='merge: send them together in one message', value=reply_throttle.MERGE),
+                    create_choice(name='drop: do not reply', value=reply_throttle.DROP)
+                ]
+            )
+        ]
+    )
+    async def _response_burst(self, ctx: SlashContext, policy: str) -> None:
+        """Burst policy command
+
+        /response burst <policy>
+        Replies within a channel's rate are always sent right away, the policy
+        only applies to the replies over it. Default as merge.
+        """
+        if policy not in reply_throttle.POLICIES:
+            raise UserError('response', f'There is no policy called "{policy}"!')
+
+        data: Dict[str, Any] = self.data_manager.get_val(ctx.guild_id) or { 'trips': [], 'reacts': [] }
+        if policy == reply_throttle.MERGE:
+            data.pop('burst', None)
+        else:
+            data['burst'] = policy
+        self.data_manager.set_val(ctx.guild_id, data)
+        await scheduler.respond(ctx, content=f'Replies over the rate will be {"merged" if policy == reply_throttle.MERGE else "dropped"}!', hidden=True)
+
             
+    def set_weights(self, trip: Dict[str, Any], react_bits: int, weight: int) -> None:
+        """Set the weight of the trip's links to the reacts in react_bits
+
+        Only weights other than 1 are stored.
+        """
+        weights: Dict[str, int] = trip.setdefault('weights', {})
+        for bit in get_bit_positions(react_bits):
+            if weight == 1:
+                weights.pop(str(bit.bit_length()-1), None)
+            else:
+                weights[str(bit.bit_length()-1)] = weight
+        if not weights:
+            del trip['weights']
+
     def to_bracket(self, s: str) -> str:
         return s.replace('\\|', '[[hor_bar]]').replace('||', '[[spoiler]]')
     
@@ -7,10 +7,30 @@ from discord_slash.context import SlashContext, ComponentContext
 from discord_slash.model import SlashMessage
 from typing import Optional, Union, List, Tuple, Dict, Set, Any
 from datetime import datetime, timedelta
+from tempfile import SpooledTemporaryFile
+from functools import partial
+from array import array
 import asyncio
-from utils import get_bit_positions, utc_plus
-from variable import DATETIME_FORMAT
+import time
+import numpy as np
+from utils import get_bit_positions, utc_plus, owns_guild, UserError
+from variable import DATETIME_FORMAT, ARCHIVE_AFTER_DAYS, ARCHIVE_RETENTION_DAYS
 from data_manager import DataManager
+from records import Poll
+from vote_archive import VoteArchive
+from title_index import TitleIndex
+from autocomplete import create_autocomplete_option
+from rest_scheduler import scheduler, BOARD_EDIT, CLOSER
+import monitor
+import tracing
+import vote_stats
+import tally
+import exporter
+import importer
+import autocomplete
+
+MESSAGE_LIMIT:  int   = 2000
+MEMBER_IDS_TTL: float = 60.0
 
 class Vote(commands.Cog):
     """投票模組
@@ -19,33 +39,60 @@ class Vote(commands.Cog):
     """
     def __init__(self, bot: commands.Bot) -> None:
         self.bot: commands.Bot = bot
-        self.data_manager = DataManager('vote')
+        self.data_manager = DataManager('vote', Poll)
+        self.member_ids: Dict[int, Tuple[float, 'array[int]']] = {}
+        self.archive: VoteArchive = VoteArchive()
+        self.titles: TitleIndex = TitleIndex(self.load_titles, lambda: self.data_manager.reloads)
+        # 其他行程修改的投票(例如還原備份)下次使用時重新讀取標題
+        self.data_manager.listen(lambda tags, key: self.titles.drop(tags[0]) if tags else None)
+        autocomplete.register('vote', 'title', self.complete_title)
         self.vote_closer.start()
+        if ARCHIVE_AFTER_DAYS > 0:
+            self.vote_archiver.start()
 
     @commands.Cog.listener()
     async def on_guild_remove(self, guild: discord.Guild) -> None:
         """在離開伺服器時的處理
 
-        在離開伺服器時，將伺服器所有投票從資料庫刪除。
+        在離開伺服器時，將伺服器所有投票從資料庫與封存檔刪除。
         """
-        for _, title in self.data_manager.keys(guild.id):
-            self.data_manager.del_val(title, guild.id)
+        titles: List[str] = [ title for _, title in self.data_manager.keys(guild.id) ]
+        if titles:
+            self.data_manager.del_many(titles, guild.id)
+        self.titles.drop(guild.id)
+        await self.bot.loop.run_in_executor(None, self.archive.drop, guild.id)
+
+    def load_titles(self, guild_id: str) -> List[Tuple[str, bool]]:
+        """從資料庫讀取伺服器上所有投票的(標題, 是否關閉)，用於標題索引"""
+        pairs: List[Tuple[List[str], str]] = self.data_manager.keys(guild_id)
+        return [ (title, vote_info['closed']) for (_, title), vote_info in zip(pairs, self.data_manager.get_many(pairs)) if vote_info ]
+
+    def complete_title(self, guild_id: str, path: List[str], value: str) -> List[str]:
+        """自動完成投票標題
+
+        關閉投票時只列出開啟中的投票，開啟投票時只列出已關閉的投票。
+        """
+        state: str = { 'close': 'open', 'open': 'close' }.get(path[0] if path else '', 'all')
+        return self.titles.complete(guild_id, value, state)
 
     @tasks.loop(minutes=1.0)
     async def vote_closer(self) -> None:
         """投票關閉行程
 
         每一分鐘進行一次檢查，如果有投票超過關閉時間，關閉其投票並更新所有對應投票表單。
+        分片時只處理此行程負責的伺服器，所有投票以一次批次讀取。
         """
-        for tags, title in self.data_manager.keys():
-            vote_info: Dict[str, Any] = self.data_manager.get_val(title, tags)
-            if vote_info['closed'] or vote_info['close_date'] == None:
+        pairs: List[Tuple[List[str], str]] = [ (tags, title) for tags, title in self.data_manager.keys() if owns_guild(self.bot, tags[0]) ]
+        for (tags, title), vote_info in zip(pairs, self.data_manager.get_many(pairs)):
+            if not vote_info or vote_info['closed'] or vote_info['close_date'] == None:
                 continue
             if utc_plus(8) >= datetime.strptime(vote_info['close_date'], DATETIME_FORMAT):
                 vote_info['closed'] = True
                 vote_info['forced'] = False
+                vote_info['closed_at'] = time.time()
                 self.data_manager.set_val(title, vote_info, tags)
-                await self.vote_update(self.bot, title, tags[0])
+                self.titles.set(tags[0], title, True)
+                await self.vote_update(self.bot, title, tags[0], CLOSER)
 
     @vote_closer.before_loop
     async def before_vote_closer(self) -> None:
@@ -55,6 +102,46 @@ class Vote(commands.Cog):
         """
         await self.bot.wait_until_ready()
         await asyncio.sleep(( 60 - (datetime.now().second + datetime.now().microsecond/1_000_000) ) % 60)
+
+    @tasks.loop(hours=1.0)
+    async def vote_archiver(self) -> None:
+        """投票封存行程
+
+        每一小時進行一次檢查，將關閉超過ARCHIVE_AFTER_DAYS天的投票移至封存檔，
+        並刪除超過ARCHIVE_RETENTION_DAYS天的封存片段。分片時只處理此行程負責的伺服器。
+        """
+        now: float = time.time()
+        expired: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+        pairs: List[Tuple[List[str], str]] = [ (tags, title) for tags, title in self.data_manager.keys() if owns_guild(self.bot, tags[0]) ]
+        for (tags, title), vote_info in zip(pairs, self.data_manager.get_many(pairs)):
+            if not vote_info or not vote_info['closed']:
+                continue
+            if 'closed_at' not in vote_info:
+                # 舊的投票沒有關閉時間，從現在開始計算
+                vote_info['closed_at'] = now
+                self.data_manager.set_val(title, vote_info, tags)
+            elif now - vote_info['closed_at'] >= ARCHIVE_AFTER_DAYS * 86400:
+                expired.setdefault(tags[0], []).append((title, vote_info))
+
+        # 壓縮與寫入封存檔在執行緒中進行，不阻塞事件迴圈
+        for guild_id, records in expired.items():
+            await self.bot.loop.run_in_executor(None, self.archive.append, guild_id, records)
+            self.data_manager.del_many([ title for title, _ in records ], guild_id)
+            for title, _ in records:
+                self.titles.remove(guild_id, title)
+
+        if ARCHIVE_RETENTION_DAYS is not None:
+            for guild_id in self.archive.guilds():
+                if owns_guild(self.bot, guild_id):
+                    await self.bot.loop.run_in_executor(None, self.archive.expire, guild_id, now - ARCHIVE_RETENTION_DAYS * 86400)
+
+    @vote_archiver.before_loop
+    async def before_vote_archiver(self) -> None:
+        """投票封存行程預備
+
+        等待機器人就緒後開始。
+        """
+        await self.bot.wait_until_ready()
     
     vote_add_kwargs = {
         'base': 'vote',
@@ -82,7 +169,7 @@ class Vote(commands.Cog):
             ),
             create_option(
                 name='max_votes',
-                description='一人最多能投幾票。(預設為1)',
+                description='一人最多能投幾票，排序投票時為最多能排幾個順位。(預設為1，排序投票預設為全部)',
                 option_type=4,
                 required=False
             ),
@@ -91,17 +178,25 @@ class Vote(commands.Cog):
                 description='是否在投票選項上顯示成員的選擇。(預設為False)',
                 option_type=5,
                 required=False
+            ),
+            create_option(
+                name='mode',
+                description='投票方式。(預設為一般)',
+                option_type=3,
+                required=False,
+                choices=[ create_choice(name=name, value=value) for value, name in tally.MODES.items() ]
             )
         ]
     }
     @cog_ext.cog_subcommand(**vote_add_kwargs)
     async def _vote_add(self, ctx: SlashContext, title: str, options: str,
-                        close_date: Optional[str]=None, max_votes: int=1,
-                        show_members: bool=False) -> None:
+                        close_date: Optional[str]=None, max_votes: Optional[int]=None,
+                        show_members: bool=False, mode: str='plurality') -> None:
         """新增投票指令
 
-        /vote add <title> <option> [close_date] [max_votes] [show_members]
+        /vote add <title> <option> [close_date] [max_votes] [show_members] [mode]
         新增一個投票並公佈投票表單在聊天室裡。
+        排序投票(即時決選、波達計數)時，max_votes為成員最多能排的順位數。
         """
         title   = title.strip()
         options = options.strip()
@@ -109,35 +204,46 @@ class Vote(commands.Cog):
         vote_info: Dict[str, Any] = self.data_manager.get_val(title, ctx.guild_id)
 
         if vote_info:
-            raise ValueError('vote', f'投票「{title}」」已經存在！')
+            raise UserError('vote', f'投票「{title}」」已經存在！')
         else:
             if close_date:
                 self.check_close_date(close_date.strip())
 
-            if max_votes <= 0:
-                raise ValueError('vote', 'max_votes必須為大於等於1的值。')
+            if max_votes is not None and max_votes <= 0:
+                raise UserError('vote', 'max_votes必須為大於等於1的值。')
+
+            option_list: List[str] = [x.strip() for x in options.split('|')]
+            if len(option_list) > tally.MAX_SELECT_OPTIONS:
+                raise UserError('vote', f'選項不能超過{tally.MAX_SELECT_OPTIONS}個！')
+            if mode != 'plurality':
+                max_votes = min(max_votes or len(option_list), len(option_list), tally.MAX_RANKS)
 
             vote_info = {
-                'options': [x.strip() for x in options.split('|')],
+                'options': option_list,
                 'close_date': close_date,
-                'max_votes': max_votes,
+                'max_votes': max_votes or 1,
                 'show_members': show_members,
                 'closed': False,
                 'forced': False,
                 'voted': {},
                 'vote_msgs': []
             }
+            if mode != 'plurality':
+                vote_info['mode'] = mode
+                vote_info['ballots'] = {}
+                vote_info['standings'] = tally.standings(vote_info)
 
-            vote_msg: SlashMessage = await ctx.send(embed=self.make_embed(title, vote_info), components=[self.make_select(title, vote_info)])
+            vote_msg: SlashMessage = await scheduler.respond(ctx, embed=self.make_embed(title, vote_info), components=self.make_components(title, vote_info))
             vote_info['vote_msgs'].append(str(vote_msg.id))
             self.data_manager.set_val(title, vote_info, ctx.guild_id)
+            self.titles.set(ctx.guild_id, title, False)
 
     vote_remove_kwargs = {
         'base': 'vote',
         'name': 'remove',
         'description': '刪除指定投票。',
         'options': [
-            create_option(
+            create_autocomplete_option(
                 name='title',
                 description='投票標題。',
                 option_type=3,
@@ -165,16 +271,19 @@ class Vote(commands.Cog):
                     pass
 
             self.data_manager.del_val(title, ctx.guild_id)
-            await ctx.send(f'以成功將投票「{title}」刪除！', hidden=True)
+            self.titles.remove(ctx.guild_id, title)
+            await scheduler.respond(ctx, content=f'以成功將投票「{title}」刪除！', hidden=True)
+        elif await self.bot.loop.run_in_executor(None, self.archive.pop, ctx.guild_id, title) is not None:
+            await scheduler.respond(ctx, content=f'以成功將已封存的投票「{title}」刪除！', hidden=True)
         else:
-            raise KeyError('vote', f'投票「{title}」並不存在！')
+            raise UserError('vote', f'投票「{title}」並不存在！')
 
     vote_edit_kwargs = {
         'base': 'vote',
         'name': 'edit',
         'description': '編輯指定投票的設定。',
         'options': [
-            create_option(
+            create_autocomplete_option(
                 name='title',
                 description='投票標題。',
                 option_type=3,
@@ -227,7 +336,7 @@ class Vote(commands.Cog):
         vote_info: Dict[str, Any] = self.data_manager.get_val(title, ctx.guild_id)
 
         if not vote_info:
-            raise KeyError('vote', f'投票「{title}」並不存在！')
+            raise UserError('vote', f'投票「{title}」並不存在！')
         else:
             if options is not None:
                 # 編輯選項
@@ -235,12 +344,16 @@ class Vote(commands.Cog):
                 try:
                     options_list: List[Tuple[int, str]] = sorted([(int(i), name) for i, name in [opt.split(':') for opt in options.split('|')]], key=lambda x: x[0])
                 except Exception as ex:
-                    raise ValueError('vote', 'options格式錯誤。(格式：0:選項A|2:選項C)')
+                    raise UserError('vote', 'options格式錯誤。(格式：0:選項A|2:選項C)')
+                if len(vote_info['options']) + len([ i for i, _ in options_list if i >= len(vote_info['options']) ]) > tally.MAX_SELECT_OPTIONS:
+                    raise UserError('vote', f'選項不能超過{tally.MAX_SELECT_OPTIONS}個！')
                 for i, name in options_list:
                     if i >= len(vote_info['options']):
                         vote_info['options'].append(name)
                     else:
                         vote_info['options'][i] = name
+                if 'mode' in vote_info:
+                    vote_info['standings'] = tally.standings(vote_info)
 
             if close_date is not None:
                 # 編輯關閉日期
@@ -249,9 +362,11 @@ class Vote(commands.Cog):
             if max_votes is not None:
                 # 編輯一人最多可投票票數
                 if max_votes > 0:
+                    if 'mode' in vote_info:
+                        max_votes = min(max_votes, len(vote_info['options']), tally.MAX_RANKS)
                     vote_info['max_votes'] = max_votes
                 else:
-                    raise ValueError('vote', 'max_votes必須為大於等於1的值。')
+                    raise UserError('vote', 'max_votes必須為大於等於1的值。')
 
             if show_members is not None:
                 # 編輯是否顯示成員的選擇
@@ -261,24 +376,26 @@ class Vote(commands.Cog):
                 # 編輯投票標題
                 new_title = new_title.strip()
                 if not new_title:
-                    raise ValueError('vote', 'new_title不得為空值')
+                    raise UserError('vote', 'new_title不得為空值')
                 if self.data_manager.get_val(new_title, ctx.guild_id):
-                    raise ValueError('vote', f'投票「{new_title}」已經存在，無法取代！')
+                    raise UserError('vote', f'投票「{new_title}」已經存在，無法取代！')
                 self.data_manager.set_val(new_title, vote_info, ctx.guild_id)
                 self.data_manager.del_val(title, ctx.guild_id)
-                await self.vote_update(ctx, new_title, ctx.guild_id)
-                await ctx.send(f'以成功編輯投票「{new_title}」！', hidden=True)
+                self.titles.remove(ctx.guild_id, title)
+                self.titles.set(ctx.guild_id, new_title, vote_info['closed'])
+                await self.acknowledge(ctx, f'以成功編輯投票「{new_title}」！', hidden=True)
+                self.schedule_update(ctx, new_title, ctx.guild_id)
             else:
                 self.data_manager.set_val(title, vote_info, ctx.guild_id)
-                await self.vote_update(ctx, title, ctx.guild_id)
-                await ctx.send(f'以成功編輯投票「{title}」！', hidden=True)
+                await self.acknowledge(ctx, f'以成功編輯投票「{title}」！', hidden=True)
+                self.schedule_update(ctx, title, ctx.guild_id)
 
     vote_close_kwargs = {
         'base': 'vote',
         'name': 'close',
         'description': '關閉指定投票。',
         'options': [
-            create_option(
+            create_autocomplete_option(
                 name='title',
                 description='投票標題。',
                 option_type=3,
@@ -300,19 +417,21 @@ class Vote(commands.Cog):
         if vote_info:
             vote_info['closed'] = True
             vote_info['forced'] = True
+            vote_info['closed_at'] = time.time()
 
             self.data_manager.set_val(title, vote_info, ctx.guild_id)
-            await self.vote_update(ctx, title, ctx.guild_id)
-            await ctx.send(f'以將投票「{title}」關閉！', hidden=True)
+            self.titles.set(ctx.guild_id, title, True)
+            await self.acknowledge(ctx, f'以將投票「{title}」關閉！', hidden=True)
+            self.schedule_update(ctx, title, ctx.guild_id)
         else:
-            raise KeyError('vote', f'投票「{title}」並不存在！')
+            raise UserError('vote', f'投票「{title}」並不存在！')
 
     vote_open_kwargs = {
         'base': 'vote',
         'name': 'open',
         'description': '重新開啟指定投票。',
         'options': [
-            create_option(
+            create_autocomplete_option(
                 name='title',
                 description='投票標題。',
                 option_type=3,
@@ -331,15 +450,21 @@ class Vote(commands.Cog):
         """開啟投票指令
 
         /vote open <title> [close_date]
-        開啟一個投票。
+        開啟一個投票，已封存的投票會被移回資料庫。
         """
         title = title.strip()
 
-        vote_info: Dict[str, Any] = self.data_manager.get_val(title, ctx.guild_id)
+        vote_info: Optional[Dict[str, Any]] = self.data_manager.get_val(title, ctx.guild_id)
+        archived: bool = False
+        if not vote_info:
+            # 解壓縮封存檔在執行緒中進行，不阻塞事件迴圈
+            vote_info = await self.bot.loop.run_in_executor(None, self.archive.get, ctx.guild_id, title)
+            archived = vote_info is not None
 
         if vote_info:
             vote_info['closed'] = False
             vote_info['forced'] = True
+            vote_info.pop('closed_at', None)
             if close_date:
                 vote_info['close_date'] = self.check_close_date(close_date.strip())
             elif vote_info['close_date'] and utc_plus(8) >= datetime.strptime(vote_info['close_date'], DATETIME_FORMAT):
@@ -347,10 +472,13 @@ class Vote(commands.Cog):
                 vote_info['close_date'] = None
 
             self.data_manager.set_val(title, vote_info, [ctx.guild_id])
-            await self.vote_update(ctx, title, ctx.guild_id)
-            await ctx.send(f'以將投票「{title}」開啟！', hidden=True)
+            self.titles.set(ctx.guild_id, title, False)
+            if archived:
+                await self.bot.loop.run_in_executor(None, self.archive.append, ctx.guild_id, [(title, None)])
+            await self.acknowledge(ctx, f'以將投票「{title}」開啟！', hidden=True)
+            self.schedule_update(ctx, title, ctx.guild_id)
         else:
-            raise KeyError('vote', f'投票「{title}」並不存在！')
+            raise UserError('vote', f'投票「{title}」並不存在！')
 
     vote_show_list_kwargs = {
         'base': 'vote',
@@ -375,6 +503,10 @@ class Vote(commands.Cog):
                   create_choice(
                     name='關閉',
                     value='close'
+                  ),
+                  create_choice(
+                    name='封存',
+                    value='archived'
                   )
                 ]
             )
@@ -384,19 +516,16 @@ class Vote(commands.Cog):
     async def _vote_show_list(self, ctx: SlashContext, state: str='all') -> None:
         """顯示投票指令
 
-        /vote show [state (all|open|close)]
-        以條件篩選並列出每個符合條件的投票。
+        /vote show [state (all|open|close|archived)]
+        以條件篩選並列出每個符合條件的投票，全部不包含已封存的投票。
         """
         matchs: List[str] = []
-        for _, title in self.data_manager.keys(ctx.guild_id):
-            vote_info: Dict[str, Any] = self.data_manager.get_val(title, ctx.guild_id)
-            
-            if ((state == 'all') or
-                (state == 'open' and not vote_info['closed']) or
-                (state == 'close' and vote_info['closed'])):
-                    matchs.append(title)
-        
-        await ctx.send('符合條件的投票：\n'+'\n'.join([title for title in matchs]) if matchs else '沒有符合條件的投票:(', hidden=True)
+        if state == 'archived':
+            matchs = await self.bot.loop.run_in_executor(None, self.archive.titles, ctx.guild_id)
+        else:
+            matchs = self.titles.titles(ctx.guild_id, state)
+
+        await scheduler.respond(ctx, content='符合條件的投票：\n'+'\n'.join([title for title in matchs]) if matchs else '沒有符合條件的投票:(', hidden=True)
 
     vote_show_result_kwargs = {
         'base': 'vote',
@@ -404,7 +533,7 @@ class Vote(commands.Cog):
         'name': 'result',
         'description': '顯示指定投票結果。',
         'options': [
-            create_option(
+            create_autocomplete_option(
                 name='title',
                 description='投票標題。',
                 option_type=3,
@@ -417,31 +546,191 @@ class Vote(commands.Cog):
         """顯示投票結果指令
 
         /vote show <title>
-        顯示一個投票的投票結果。
+        顯示一個投票的投票結果，包含已封存的投票。
         """
         title = title.strip()
 
-        vote_info: Dict[str, Any] = self.data_manager.get_val(title, ctx.guild_id)
+        vote_info: Optional[Dict[str, Any]] = self.data_manager.get_val(title, ctx.guild_id)
+        archived: bool = False
+        if not vote_info:
+            # 解壓縮封存檔在執行緒中進行，不阻塞事件迴圈
+            vote_info = await self.bot.loop.run_in_executor(None, self.archive.get, ctx.guild_id, title)
+            archived = vote_info is not None
 
         if vote_info:
             embed: discord.Embed = discord.Embed(title=f'「{title}」', color=0x07A0C3)
-            embed.set_author(name='投票結果')
+            embed.set_author(name='投票結果(已封存)' if archived else '投票結果')
             for i, opt in enumerate(vote_info['options']):
                 # 建立有投第i個選項的成員id清單
                 voted_members: List[str] = [ member_id for member_id, votes in vote_info['voted'].items() if 2**i in get_bit_positions(votes) ]
                 
                 embed.add_field(name=opt, value='\u200D'+' '.join([f'<@{member_id}>' for member_id in voted_members]), inline=False)
 
-            await ctx.send(embed=embed, hidden=True)
+            await scheduler.respond(ctx, embed=embed, hidden=True)
         else:
-            raise KeyError('vote', f'投票「{title}」並不存在！')
+            raise UserError('vote', f'投票「{title}」並不存在！')
+
+    vote_stats_kwargs = {
+        'base': 'vote',
+        'name': 'stats',
+        'description': '顯示投票統計。',
+        'options': [
+            create_autocomplete_option(
+                name='title',
+                description='投票標題。(預設為伺服器上所有投票)',
+                option_type=3,
+                required=False
+            )
+        ]
+    }
+    @cog_ext.cog_subcommand(**vote_stats_kwargs)
+    async def _vote_stats(self, ctx: SlashContext, title: Optional[str]=None) -> None:
+        """投票統計指令
+
+        /vote stats [title]
+        指定投票時顯示各選項票數、常被一起投的選項與參與率；
+        沒有指定時顯示伺服器上每個投票的參與率，與投票者重疊最多的投票。
+        """
+        members: int = max(1, (ctx.guild.member_count or 1) - 1)
+        embed: discord.Embed
+
+        if title:
+            title = title.strip()
+            vote_info: Dict[str, Any] = self.data_manager.get_val(title, ctx.guild_id)
+            if not vote_info:
+                raise UserError('vote', f'投票「{title}」並不存在！')
+
+            matrix: np.ndarray = vote_stats.vote_matrix(vote_info)
+            voters: int = matrix.shape[0]
+            counts: np.ndarray = vote_stats.option_counts(matrix)
+
+            embed = discord.Embed(title=f'「{title}」', color=0x07A0C3)
+            embed.set_author(name='投票統計')
+            for opt, count in zip(vote_info['options'], counts.tolist()):
+                embed.add_field(name=opt, value=f'票數：{count} ({count / max(1, voters):.1%})', inline=False)
+
+            pairs: List[Tuple[int, int, int]] = vote_stats.top_pairs(vote_stats.co_selection(matrix), 5)
+            if pairs:
+                embed.add_field(name='常被一起投的選項', value='\n'.join([
+                    f"{vote_info['options'][i]} + {vote_info['options'][j]}：{n}人" for i, j, n in pairs
+                ]), inline=False)
+            embed.add_field(name='參與率', value=f'{voters}/{members} ({voters / members:.1%})', inline=False)
+        else:
+            titles: List[str] = []
+            id_arrays: List[np.ndarray] = []
+            # 以一次get_many讀取所有投票，Redis時只需要一次往返
+            keys: List[Tuple[List[str], str]] = self.data_manager.keys(ctx.guild_id)
+            for (_, t), poll in zip(keys, self.data_manager.get_many(keys)):
+                if poll:
+                    titles.append(t)
+                    id_arrays.append(vote_stats.voter_ids(poll))
+            if not titles:
+                raise UserError('vote', '伺服器上沒有任何投票！')
+
+            overlap: np.ndarray = vote_stats.voter_overlap(id_arrays)
+            sizes: np.ndarray = np.diag(overlap)
+
+            embed = discord.Embed(title='所有投票', color=0x07A0C3)
+            embed.set_author(name='投票統計')
+            lines: List[str] = [ f'{t}：{n}人 ({n / members:.1%})' for t, n in zip(titles, sizes.tolist()) ]
+            embed.add_field(name='參與率', value=self.clip_lines(lines), inline=False)
+
+            lines = []
+            for i, j, n in vote_stats.top_pairs(overlap, 5):
+                jaccard: float = n / (sizes[i] + sizes[j] - n)
+                lines.append(f'{titles[i]} & {titles[j]}：{n}人 ({jaccard:.0%})')
+            if lines:
+                embed.add_field(name='投票者重疊最多的投票', value=self.clip_lines(lines), inline=False)
+
+        await scheduler.respond(ctx, embed=embed, hidden=True)
+
+    vote_export_kwargs = {
+        'base': 'vote',
+        'name': 'export',
+        'description': '匯出投票資料。',
+        'options': [
+            create_autocomplete_option(
+                name='title',
+                description='投票標題。(預設為伺服器上所有投票)',
+                option_type=3,
+                required=False
+            ),
+            create_option(
+                name='format',
+                description='檔案格式。(預設為csv)',
+                option_type=3,
+                required=False,
+                choices=[ create_choice(name=fmt, value=fmt) for fmt in exporter.FORMATS ]
+            )
+        ]
+    }
+    @cog_ext.cog_subcommand(**vote_export_kwargs)
+    async def _vote_export(self, ctx: SlashContext, title: Optional[str]=None, format: str='csv') -> None:
+        """匯出投票指令
+
+        /vote export [title] [format]
+        將投票資料以每個投票者一列的csv或jsonl檔案傳送，檔案較大時會寫入暫存檔而非記憶體。
+        """
+        if title:
+            title = title.strip()
+            if not self.data_manager.get_val(title, ctx.guild_id):
+                raise UserError('vote', f'投票「{title}」並不存在！')
+
+        await scheduler.defer(ctx, hidden=True)
+        fp = SpooledTemporaryFile(max_size=exporter.CHUNK_SIZE * 16)
+        exporter.write(fp, exporter.vote_rows(self.data_manager, ctx.guild_id, title or None), exporter.VOTE_FIELDS, format)
+        fp.seek(0)
+        await scheduler.respond(ctx, file=discord.File(fp, filename=f'votes.{format}'), hidden=True)
+
+    vote_import_kwargs = {
+        'base': 'vote',
+        'name': 'import',
+        'description': '從檔案匯入投票資料。',
+        'options': [
+            create_option(
+                name='url',
+                description='上傳至Discord的檔案連結，格式與 /vote export 相同。',
+                option_type=3,
+                required=True
+            )
+        ]
+    }
+    @cog_ext.cog_subcommand(**vote_import_kwargs)
+    async def _vote_import(self, ctx: SlashContext, url: str) -> None:
+        """匯入投票指令
+
+        /vote import <url>
+        將檔案中的投票者合併至伺服器上的投票，不存在的投票會被建立，最後一次寫入所有修改的投票。
+        """
+        await scheduler.defer(ctx, hidden=True)
+        fp = await importer.download(url, 'vote')
+        with fp:
+            polls: Dict[str, Dict[str, Any]] = { title: self.data_manager.get_val(title, ctx.guild_id) for _, title in self.data_manager.keys(ctx.guild_id) }
+            changed, result = importer.merge_votes(polls, importer.rows(fp))
+
+        if changed:
+            self.data_manager.set_many(list(changed.items()), ctx.guild_id)
+            for title, vote_info in changed.items():
+                self.titles.set(ctx.guild_id, title, vote_info['closed'])
+                if vote_info['vote_msgs']:
+                    self.schedule_update(ctx, title, ctx.guild_id)
+        await scheduler.respond(ctx, content=f'匯入完成！新增{result.added}筆、合併{result.merged}筆、略過{result.skipped}筆。', hidden=True)
+
+    def clip_lines(self, lines: List[str], limit: int = 1024) -> str:
+        """將多行文字合併並截斷至嵌入欄位的長度上限"""
+        value: str = ''
+        for line in lines:
+            if len(value) + len(line) + 2 > limit:
+                return value + '\n…'
+            value += ('\n' if value else '') + line
+        return value
 
     vote_jumpto_kwargs = {
         'base': 'vote',
         'name': 'jumpto',
         'description': '傳送至指定投票。',
         'options': [
-            create_option(
+            create_autocomplete_option(
                 name='title',
                 description='投票標題。',
                 option_type=3,
@@ -471,21 +760,21 @@ class Vote(commands.Cog):
                 for msg_id in vote_info['vote_msgs'][::-1]:
                     try:
                         msg: discord.Message = await channel.fetch_message(msg_id)
-                        await ctx.send(f'[點此跳至投票「{title}」]({msg.jump_url})', hidden=not public)
+                        await scheduler.respond(ctx, content=f'[點此跳至投票「{title}」]({msg.jump_url})', hidden=not public)
                         return
                     except:
                         pass
             else:
-                raise KeyError('vote', f'投票「{title}」沒有投票訊息！請使用 `/vote repost` 讓機器人再重新傳送一個投票訊息。')
+                raise UserError('vote', f'投票「{title}」沒有投票訊息！請使用 `/vote repost` 讓機器人再重新傳送一個投票訊息。')
         else:
-            raise KeyError('vote', f'投票「{title}」並不存在！')
+            raise UserError('vote', f'投票「{title}」並不存在！')
 
     vote_notify_kwargs = {
         'base': 'vote',
         'name': 'notify',
         'description': '列出還沒有投票的成員。',
         'options': [
-            create_option(
+            create_autocomplete_option(
                 name='title',
                 description='投票標題。',
                 option_type=3,
@@ -511,20 +800,58 @@ class Vote(commands.Cog):
         vote_info: Dict[str, Any] = self.data_manager.get_val(title, ctx.guild_id)
 
         if vote_info:
-            member_ids: str = ' '.join([ f'<@{member.id}>' for member in ctx.guild.members if str(member.id) not in vote_info['voted'] and member != self.bot.user ])
-            if member_ids:
-                await ctx.send(f'還沒有投「{title}」的成員有：\n{member_ids}', hidden=not public)
-            else:
-                await ctx.send('全部成員已經都投過此投票！', hidden=True)
+            # 取得成員可能需要數秒，先回應互動
+            await scheduler.defer(ctx, hidden=not public)
+
+            voted: Dict[str, Any] = vote_info['voted']
+            header: str = f'還沒有投「{title}」的成員有：\n'
+            page: List[str] = []
+            page_len: int = len(header)
+            sent: bool = False
+            for member_id in await self.fetch_member_ids(ctx.guild):
+                if str(member_id) in voted:
+                    continue
+                mention: str = f'<@{member_id}>'
+                if page_len + len(mention) + 1 > MESSAGE_LIMIT:
+                    await scheduler.respond(ctx, content=('' if sent else header) + ' '.join(page), hidden=not public)
+                    sent = True
+                    page, page_len = [], 0
+                page.append(mention)
+                page_len += len(mention) + 1
+
+            if page:
+                await scheduler.respond(ctx, content=('' if sent else header) + ' '.join(page), hidden=not public)
+            elif not sent:
+                await scheduler.respond(ctx, content='全部成員已經都投過此投票！', hidden=not public)
         else:
-            raise KeyError('vote', f'投票「{title}」並不存在！')
+            raise UserError('vote', f'投票「{title}」並不存在！')
+
+    async def fetch_member_ids(self, guild: discord.Guild) -> 'array[int]':
+        """取得伺服器成員id
+
+        機器人不快取成員，需要時才向Discord分頁取得單一伺服器的成員，
+        並只保留id，短暫快取MEMBER_IDS_TTL秒。
+        """
+        cached: Optional[Tuple[float, 'array[int]']] = self.member_ids.get(guild.id)
+        if cached and time.monotonic() - cached[0] < MEMBER_IDS_TTL:
+            return cached[1]
+
+        member_ids: 'array[int]' = array('Q')
+        async for member in guild.fetch_members(limit=None):
+            if member.id != self.bot.user.id:
+                member_ids.append(member.id)
+
+        now: float = time.monotonic()
+        self.member_ids = { k: v for k, v in self.member_ids.items() if now - v[0] < MEMBER_IDS_TTL }
+        self.member_ids[guild.id] = (now, member_ids)
+        return member_ids
 
     vote_repost_kwargs = {
         'base': 'vote',
         'name': 'repost',
         'description': '重新傳送一個投票訊息。',
         'options': [
-            create_option(
+            create_autocomplete_option(
                 name='title',
                 description='投票標題。',
                 option_type=3,
@@ -544,23 +871,26 @@ class Vote(commands.Cog):
         vote_info: Dict[str, Any] = self.data_manager.get_val(title, ctx.guild_id)
 
         if vote_info:
-            vote_msg: SlashMessage = await ctx.send(embed=self.make_embed(title, vote_info), components=[self.make_select(title, vote_info)])
+            vote_msg: SlashMessage = await scheduler.respond(ctx, embed=self.make_embed(title, vote_info), components=self.make_components(title, vote_info))
             vote_info['vote_msgs'].append(str(vote_msg.id))
             self.data_manager.set_val(title, vote_info, [ctx.guild_id])
         else:
-            raise KeyError('vote', f'投票「{title}」並不存在！')
+            raise UserError('vote', f'投票「{title}」並不存在！')
 
-    async def vote_update(self, ctx: Union[commands.Bot, SlashContext, ComponentContext], title: str, guild_id: Union[str, int]) -> None:
+    @tracing.traced('vote_update')
+    async def vote_update(self, ctx: Union[commands.Bot, SlashContext, ComponentContext], title: str, guild_id: Union[str, int],
+                          priority: int = BOARD_EDIT) -> None:
         """更新投票表單
 
         更新伺服器上每個對應投票表單上的內容。
+        每個頻道的更新經由排程器送出，尚未送出的同一表單更新會合併成最新的一次。
         """
         vote_info: Dict[str, Any] = self.data_manager.get_val(title, guild_id)
 
         if vote_info:
             embed:   discord.Embed  = self.make_embed(title, vote_info)
-            select:  Dict[str, Any] = self.make_select(title, vote_info)
-            msg_id_list: List[str] = vote_info['vote_msgs']
+            components: List[Dict[str, Any]] = self.make_components(title, vote_info)
+            msg_id_list: List[str] = list(vote_info['vote_msgs'])
             edited_msg_id_list: Set[str] = set()
             guild: discord.Guild
             
@@ -569,46 +899,100 @@ class Vote(commands.Cog):
             else:
                 guild = ctx.get_guild(int(guild_id))
             
-            async def edit_message_in_channel(channel: discord.abc.GuildChannel) -> None:
+            async def edit_message_in_channel(channel: discord.TextChannel) -> Set[str]:
+                edited: Set[str] = set()
                 for msg_id in msg_id_list:
                     try:
                         msg: discord.Message = await channel.fetch_message(msg_id)
-                        await msg.edit(embed=embed, components=[select])
-                        edited_msg_id_list.add(msg_id)
+                        await msg.edit(embed=embed, components=components)
+                        edited.add(msg_id)
                     except:
                         pass
+                return edited
             
-            tasks: List[asyncio.Task] = [ asyncio.create_task(edit_message_in_channel(channel)) for channel in guild.channels ]
-
-            await asyncio.wait(tasks)
+            for edited in await asyncio.gather(*[
+                scheduler.submit(priority, ('channel', channel.id), partial(edit_message_in_channel, channel),
+                                 key=('vote_update', guild.id, title, channel.id))
+                for channel in guild.text_channels
+            ]):
+                edited_msg_id_list |= edited
             
-            for msg_id in [ msg_id for msg_id in msg_id_list if msg_id not in edited_msg_id_list ]:
+            vote_info = self.data_manager.get_val(title, guild_id)
+            missing_msg_id_list: List[str] = [ msg_id for msg_id in msg_id_list if msg_id not in edited_msg_id_list ]
+            if vote_info and missing_msg_id_list:
                 # 將找不到的投票訊息(被成員手動刪除)從資料庫刪除
-                vote_info['vote_msgs'].remove(msg_id)
+                vote_info['vote_msgs'] = [ msg_id for msg_id in vote_info['vote_msgs'] if msg_id not in missing_msg_id_list ]
                 self.data_manager.set_val(title, vote_info, guild_id)
         else:
-            raise KeyError('vote', f'投票「{title}」並不存在！')
+            raise UserError('vote', f'投票「{title}」並不存在！')
+
+    def schedule_update(self, ctx: Union[SlashContext, ComponentContext], title: str, guild_id: Union[str, int]) -> None:
+        """在背景更新投票表單
+
+        讓指令可以先回應使用者，表單更新的錯誤由背景行程回報。
+        """
+        monitor.spawn(self.vote_update(ctx, title, guild_id), name=f'vote_update:{guild_id}:{title}')
+
+    async def acknowledge(self, ctx: Union[SlashContext, ComponentContext], content: str, hidden: bool = False) -> None:
+        """回應互動並記錄回應延遲"""
+        await scheduler.respond(ctx, content=content, hidden=hidden)
+        monitor.ack_latency.record((datetime.utcnow() - ctx.created_at).total_seconds())
 
     @cog_ext.cog_component()
+    @tracing.traced('vote_select')
     async def vote_select(self, ctx: ComponentContext) -> None:
         """成員投票動作
 
         成員在表單上使用下拉清單投票後的處理。
         """
-        for _, title in self.data_manager.keys(ctx.guild_id):
-            vote_info: Dict[str, Any] = self.data_manager.get_val(title, ctx.guild_id)
-            if str(ctx.origin_message_id) in vote_info['vote_msgs']:
+        pairs: List[Tuple[List[str], str]] = self.data_manager.keys(ctx.guild_id)
+        for (_, title), vote_info in zip(pairs, self.data_manager.get_many(pairs)):
+            if vote_info and str(ctx.origin_message_id) in vote_info['vote_msgs']:
                 if vote_info['closed']:
-                    raise PermissionError('vote', '投票失敗，投票「{title}」已經關閉了！')
+                    raise UserError('vote', '投票失敗，投票「{title}」已經關閉了！')
 
                 vote_info['voted'][str(ctx.author_id)] = sum(2**int(i) for i in ctx.selected_options)
 
                 self.data_manager.set_val(title, vote_info, ctx.guild_id)
-                await self.vote_update(ctx, title, ctx.guild_id)
-                await ctx.send(content=f"投票成功！\n你投給了：{', '.join([ vote_info['options'][int(i)] for i in ctx.selected_options ])}", hidden=True)
+                await self.acknowledge(ctx, f"投票成功！\n你投給了：{', '.join([ vote_info['options'][int(i)] for i in ctx.selected_options ])}", hidden=True)
+                self.schedule_update(ctx, title, ctx.guild_id)
+                break
+        else:
+            raise UserError('vote', f'投票失敗，投票「{title}」並不存在！')
+
+    @cog_ext.cog_component(components=[ f'vote_rank_{rank}' for rank in range(tally.MAX_RANKS) ])
+    @tracing.traced('vote_rank')
+    async def vote_rank(self, ctx: ComponentContext) -> None:
+        """成員排序投票動作
+
+        成員在排序投票表單上選擇某個順位的選項後的處理。
+        選項會被放到該順位，已經排在其他順位的同一選項會被移除，後面的順位依序遞補。
+        選票改變時只以新舊選票的差異更新統計(見tally.update)，不重新計票。
+        """
+        rank: int = int(ctx.custom_id[len('vote_rank_'):])
+        option: int = int(ctx.selected_options[0])
+        pairs: List[Tuple[List[str], str]] = self.data_manager.keys(ctx.guild_id)
+        for (_, title), vote_info in zip(pairs, self.data_manager.get_many(pairs)):
+            if vote_info and str(ctx.origin_message_id) in vote_info['vote_msgs']:
+                if vote_info['closed']:
+                    raise UserError('vote', f'投票失敗，投票「{title}」已經關閉了！')
+
+                member_id: str = str(ctx.author_id)
+                old: bytes = tally.unpack_ballot(vote_info['ballots'].get(member_id, ''))
+                ranking: List[int] = [ o for o in old if o != option ]
+                ranking.insert(min(rank, len(ranking)), option)
+                del ranking[vote_info['max_votes']:]
+
+                vote_info['ballots'][member_id] = tally.pack_ballot(ranking)
+                vote_info['voted'][member_id] = sum(2**o for o in ranking)
+                tally.update(vote_info, old, bytes(ranking))
+
+                self.data_manager.set_val(title, vote_info, ctx.guild_id)
+                await self.acknowledge(ctx, '投票成功！\n你的排序：\n' + '\n'.join([ f"{r+1}. {vote_info['options'][o]}" for r, o in enumerate(ranking) ]), hidden=True)
+                self.schedule_update(ctx, title, ctx.guild_id)
                 break
         else:
-            raise KeyError('vote', f'投票失敗，投票「{title}」並不存在！')
+            raise UserError('vote', '投票失敗，投票並不存在！')
 
     def make_embed(self, title: str, vote_info: Dict[str, Any]) -> discord.Embed:
         """製作投票表單
@@ -643,10 +1027,11 @@ class Vote(commands.Cog):
             title=f'「{title}」',
             color=0xD64933 if vote_info['closed'] else 0x20B05C
         )
-        embed.set_author(name='投票')
+        embed.set_author(name=tally.MODES[vote_info['mode']] if 'mode' in vote_info else '投票')
+        result: Dict[str, Any] = tally.result(vote_info) if 'mode' in vote_info else {}
         for i, opt in enumerate(vote_info['options']):
             voted_members: List[str] = [ member_id for member_id, votes in vote_info['voted'].items() if 2**i in get_bit_positions(votes) ]
-            value: str = f"票數：{len(voted_members):3}"
+            value: str = self.make_standing(i, vote_info, result) if 'mode' in vote_info else f"票數：{len(voted_members):3}"
             if vote_info['show_members']:
                 value += '\n' + ' '.join([ f'<@{member_id}>' for member_id in voted_members ])
             if i == len(vote_info['options'])-1:
@@ -656,6 +1041,45 @@ class Vote(commands.Cog):
         embed.set_footer(text='≡'*43 + '\n' + ('投票已關閉' if vote_info['closed'] else '點擊下面選單以投票'))
         return embed
 
+    def make_standing(self, option: int, vote_info: Dict[str, Any], standings: Dict[str, Any]) -> str:
+        """製作排序投票選項的目前結果
+
+        standings為tally.result()的結果，一個表單只計算一次。
+        """
+        if vote_info['mode'] == 'borda':
+            points: List[int] = standings.get('points', [])
+            return f"分數：{points[option] if option < len(points) else 0:3}"
+
+        rounds: List[List[Optional[int]]] = standings.get('rounds', [])
+        for k, counts in enumerate(rounds):
+            if option < len(counts) and counts[option] is None:
+                return f'於第{k}輪淘汰'
+        count: Optional[int] = rounds[-1][option] if rounds and option < len(rounds[-1]) else 0
+        if standings.get('winner') == option:
+            return f'票數：{count:3}　★第{len(rounds)}輪過半'
+        return f'票數：{count:3}' + (f'　(第{len(rounds)}輪)' if len(rounds) > 1 else '')
+
+    def make_components(self, title: str, vote_info: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """製作投票表單的元件
+
+        一般投票為一個下拉清單，排序投票則每個順位一個下拉清單。
+        """
+        if 'mode' not in vote_info:
+            return [self.make_select(title, vote_info)]
+
+        options: List[Dict[str, Any]] = [ create_select_option(opt, value=str(i)) for i, opt in enumerate(vote_info['options']) ]
+        return [
+            create_actionrow(create_select(
+                options=options,
+                custom_id=f'vote_rank_{rank}',
+                placeholder=f'第{rank+1}順位',
+                min_values=1,
+                max_values=1,
+                disabled=vote_info['closed'],
+            ))
+            for rank in range(min(vote_info['max_votes'], len(vote_info['options']), tally.MAX_RANKS))
+        ]
+
     def make_select(self, title: str, vote_info: Dict[str, Any]) -> Dict[str, Any]:
         """製作投票表單的下拉清單
 
@@ -681,10 +1105,10 @@ class Vote(commands.Cog):
             tmp_close_date = datetime.strptime(close_date, DATETIME_FORMAT)
             close_date = tmp_close_date.strftime(DATETIME_FORMAT)
         except:
-            raise ValueError('vote', 'close_date格式錯誤。(格式：YYYY/MM/DD HH:MM)')
+            raise UserError('vote', 'close_date格式錯誤。(格式：YYYY/MM/DD HH:MM)')
 
         if tmp_close_date <= utc_plus(8):
-            raise ValueError('vote', f'{close_date}已經過去了！')
+            raise UserError('vote', f'{close_date}已經過去了！')
 
         return close_date
 
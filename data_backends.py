@@ -0,0 +1,545 @@
+from typing import Optional, Callable, Iterator, List, Tuple, Dict, Type, Any
+from contextlib import contextmanager
+import asyncio
+import atexit
+import json
+import os
+import re
+import uuid
+from urllib.parse import unquote
+from variable import SHARD_IDS
+from records import Record, encode
+import monitor
+
+try:
+    import fcntl
+except ImportError:
+    # Windows沒有fcntl，只支援單一行程
+    fcntl = None # type: ignore
+
+try:
+    import redis
+    import redis.asyncio
+except ImportError:
+    redis = None # type: ignore
+
+"""資料庫後端
+
+DataManager依設定選擇其中一個後端，後端只處理以(tags, key)定位的資料，
+tags為字串清單。每個後端提供相同的程序：
+
+get(tags, key)              取內容值，不存在時為None
+get_many(pairs)             依序取多個(tags, key)的內容值
+set(tags, key, data)        設定內容值
+set_many(tags, items)       設定多個(key, data)
+delete(tags, key)           刪除鍵值
+del_many(tags, keys)        刪除多個鍵值
+keys(tags)                  取所有(tags, key)
+reloads                     從其他行程重新讀取全部資料的次數
+on_change                   其他行程修改個別鍵值時呼叫on_change(tags, key)，由DataManager設定
+take_lost()                 上次呼叫後是否可能遺漏了其他行程的修改(reloads與on_change都沒有反映)
+
+有指定record時，讀出的內容值轉換為該紀錄類別，寫入時以records.encode轉換回json。
+"""
+
+def _decode(record: Optional[Type[Record]], data: Dict[str, Any]) -> Any:
+    return record.from_dict(data) if record is not None else data
+
+class _Node:
+    __slots__ = ('keys', 'children')
+
+    def __init__(self) -> None:
+        self.keys:     Dict[str, Dict[str, Any]] = {}
+        self.children: Dict[str, '_Node'] = {}
+
+class _Tree:
+    """tag -> tag -> ... -> key 的樹，keys(tags)只需走訪tags的深度並回傳結果"""
+    __slots__ = ('root',)
+
+    def __init__(self) -> None:
+        self.root: _Node = _Node()
+
+    def node(self, tags: List[str]) -> Optional[_Node]:
+        node: Optional[_Node] = self.root
+        for tag in tags:
+            if node is None:
+                break
+            node = node.children.get(tag)
+        return node
+
+    def make_node(self, tags: List[str]) -> _Node:
+        node: _Node = self.root
+        for tag in tags:
+            if tag not in node.children:
+                node.children[tag] = _Node()
+            node = node.children[tag]
+        return node
+
+    def walk(self, node: Optional[_Node] = None, tags: Optional[List[str]] = None) -> Iterator[Tuple[List[str], str, Dict[str, Any]]]:
+        node = node or self.root
+        tags = tags or []
+        for key, data in node.keys.items():
+            yield (tags, key, data)
+        for tag, child in node.children.items():
+            yield from self.walk(child, tags + [tag])
+
+    def get(self, tags: List[str], key: str) -> Optional[Dict[str, Any]]:
+        node: Optional[_Node] = self.node(tags)
+        return node.keys.get(key) if node is not None else None
+
+    def put(self, tags: List[str], key: str, data: Optional[Dict[str, Any]]) -> None:
+        """設定內容值，data為None時刪除"""
+        if data is not None:
+            self.make_node(tags).keys[key] = data
+            return
+        node: Optional[_Node] = self.node(tags)
+        if node is not None:
+            node.keys.pop(key, None)
+
+    def keys(self, tags: Optional[List[str]]) -> List[Tuple[List[str], str]]:
+        if tags is None:
+            return [ (t, key) for t, key, _ in self.walk() ]
+        node: Optional[_Node] = self.node(tags)
+        return [ (tags, key) for key in node.keys ] if node is not None else []
+
+def escape(part: str) -> str:
+    """跳脫鍵值的一段，使「_」只作為分隔字元"""
+    return part.replace('%', '%25').replace('_', '%5F')
+
+def unescape(part: str) -> str:
+    return unquote(part)
+
+# 舊格式中，開頭為Discord id(雪花id)的段落視為tags
+_SNOWFLAKE: 're.Pattern[str]' = re.compile(r'\d{15,}')
+
+class JsonBackend:
+    """json檔
+
+    所有資料存放在 data/<type>.json：
+    { "format": 2, "data": { "tag1_tag2_key": 內容值, ... } }
+    每一段先以escape()跳脫，標題中的「_」不會與分隔字元混淆。
+    讀取後在記憶體中建立 tag -> tag -> ... -> key 的樹(_Tree)。
+
+    舊格式(直接以 tag1_tag2_key 為鍵值，沒有跳脫)在讀取時自動轉換：
+    開頭連續的雪花id為tags，其餘部分(可能包含「_」)為key。
+    """
+    FORMAT: int = 2
+
+    def __init__(self, type: str, record: Optional[Type[Record]] = None) -> None:
+        self.type: str = type
+        self.record: Optional[Type[Record]] = record
+        self.__reloads: int = 0
+        self.on_change: Optional[Callable[[List[str], str], None]] = None
+        self.__path: str = f'data/{self.type}.json'
+        with self.__lock():
+            if not os.path.isfile(self.__path):
+                with open(self.__path, 'w', encoding='utf-8') as f:
+                    f.write('{}')
+            if self.__load():
+                self.__dump()
+
+    """多行程運作
+
+    多個分片行程共用同一個json檔時：
+    - 寫入前取得檔案鎖，並在檔案被其他行程修改過時重新讀取，只覆蓋自己修改的鍵值。
+    - 以暫存檔取代的方式寫入，讀取的行程不會讀到寫到一半的檔案。
+    - 讀取前以檔案的修改時間判斷是否需要重新讀取。
+    """
+
+    @contextmanager
+    def __lock(self) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        with open(f'{self.__path}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def __stat(self) -> Tuple[int, int]:
+        st: os.stat_result = os.stat(self.__path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def __load(self) -> bool:
+        """讀取檔案並建立索引，回傳是否從舊格式轉換"""
+        with open(self.__path, 'r', encoding='utf-8') as f:
+            raw: Dict[str, Any] = json.load(f)
+        self.__tree: _Tree = _Tree()
+        migrated: bool = raw.get('format') != self.FORMAT
+        if migrated:
+            for flat, data in raw.items():
+                parts: List[str] = flat.split('_')
+                depth: int = 0
+                while depth < len(parts) - 1 and _SNOWFLAKE.fullmatch(parts[depth]):
+                    depth += 1
+                self.__tree.put(parts[:depth], '_'.join(parts[depth:]), _decode(self.record, data))
+        else:
+            for flat, data in raw['data'].items():
+                parts = [ unescape(part) for part in flat.split('_') ]
+                self.__tree.put(parts[:-1], parts[-1], _decode(self.record, data))
+        self.__mtime: Tuple[int, int] = self.__stat()
+        self.__reloads += 1
+        return migrated and bool(raw)
+
+    def __refresh(self) -> None:
+        if self.__stat() != self.__mtime:
+            self.__load()
+
+    @property
+    def reloads(self) -> int:
+        # 先檢查檔案，沒有讀取時也能得知其他行程的寫入
+        self.__refresh()
+        return self.__reloads
+
+    def __dump(self) -> None:
+        with open(f'{self.__path}.tmp', 'w', encoding='utf-8') as f:
+            json.dump({
+                'format': self.FORMAT,
+                'data': { '_'.join([ escape(part) for part in tags + [key] ]): data for tags, key, data in self.__tree.walk() }
+            }, f, indent=4, default=encode)
+        os.replace(f'{self.__path}.tmp', self.__path)
+        self.__mtime = self.__stat()
+
+    def get(self, tags: List[str], key: str) -> Optional[Dict[str, Any]]:
+        self.__refresh()
+        return self.__tree.get(tags, key)
+
+    def get_many(self, pairs: List[Tuple[List[str], str]]) -> List[Optional[Dict[str, Any]]]:
+        self.__refresh()
+        return [ self.__tree.get(tags, key) for tags, key in pairs ]
+
+    def set(self, tags: List[str], key: str, data: Dict[str, Any]) -> None:
+        self.set_many(tags, [(key, data)])
+
+    def set_many(self, tags: List[str], items: List[Tuple[str, Dict[str, Any]]]) -> None:
+        with self.__lock():
+            self.__refresh()
+            for key, data in items:
+                self.__tree.put(tags, key, data)
+            self.__dump()
+
+    def delete(self, tags: List[str], key: str) -> None:
+        self.del_many(tags, [key])
+
+    def del_many(self, tags: List[str], keys: List[str]) -> None:
+        with self.__lock():
+            self.__refresh()
+            node: Optional[_Node] = self.__tree.node(tags)
+            for key in keys:
+                if node is None:
+                    raise KeyError(key)
+                del node.keys[key]
+            self.__dump()
+
+    def keys(self, tags: Optional[List[str]]) -> List[Tuple[List[str], str]]:
+        self.__refresh()
+        return self.__tree.keys(tags)
+
+    def take_lost(self) -> bool:
+        # 其他行程的寫入都會使reloads改變
+        return False
+
+class ReplitBackend:
+    """Replit db
+
+    每個鍵值一個db項目，鍵值 = type_tag1_tag2_key，每次操作都是一次HTTP請求。
+    每次讀取都向db取得最新的資料，但無法得知其他行程修改了哪些鍵值。
+    """
+    def __init__(self, type: str, record: Optional[Type[Record]] = None) -> None:
+        from replit import db
+        self.type: str = type
+        self.record: Optional[Type[Record]] = record
+        self.reloads: int = 0
+        self.on_change: Optional[Callable[[List[str], str], None]] = None
+        self.db: Any = db
+
+    def __key(self, tags: List[str], key: str) -> str:
+        return '_'.join([self.type] + tags + [key])
+
+    def get(self, tags: List[str], key: str) -> Optional[Dict[str, Any]]:
+        k: str = self.__key(tags, key)
+        return _decode(self.record, json.loads(self.db[k])) if k in self.db else None
+
+    def get_many(self, pairs: List[Tuple[List[str], str]]) -> List[Optional[Dict[str, Any]]]:
+        return [ self.get(tags, key) for tags, key in pairs ]
+
+    def take_lost(self) -> bool:
+        # 多行程分片時其他行程的修改都無法得知
+        return bool(SHARD_IDS)
+
+    def set(self, tags: List[str], key: str, data: Dict[str, Any]) -> None:
+        self.db[self.__key(tags, key)] = json.dumps(data, separators=(',', ':'), default=encode)
+
+    def set_many(self, tags: List[str], items: List[Tuple[str, Dict[str, Any]]]) -> None:
+        for key, data in items:
+            self.set(tags, key, data)
+
+    def delete(self, tags: List[str], key: str) -> None:
+        del self.db[self.__key(tags, key)]
+
+    def del_many(self, tags: List[str], keys: List[str]) -> None:
+        for key in keys:
+            self.delete(tags, key)
+
+    def keys(self, tags: Optional[List[str]]) -> List[Tuple[List[str], str]]:
+        tag_str: str = '_'.join((tags or []) + [''])
+        return [
+            (tags_match.group(1).split('_') if tags_match else [], title)
+            for tags_match, title in [
+                (re.search(f'{self.type}_(.*)_.*', key), re.sub(f'{self.type}_(?:.*_)*', '', key))
+                for key in self.db.keys()
+                if key.startswith(f'{self.type}_{tag_str}')
+            ]
+        ]
+
+def _running() -> bool:
+    """是否在執行中的事件迴圈內"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+class RedisBackend:
+    """Redis相容的伺服器
+
+    每筆資料存成一個hash：type:tag1:tag2:key，每個欄位的值為json。
+    每組tags的鍵值存放在集合 type:__keys:tag1:tag2，所有用過的tags存放在集合 type:__tags。
+    同一個網址的後端共用連線池。空的資料讀取時為None。
+
+    所有資料在建立時讀入記憶體(與json檔相同的樹)，讀取不需要等待網路，不會阻塞事件迴圈：
+    - 寫入先修改記憶體，再由背景行程以非同步客戶端(redis.asyncio)送出；
+      累積的修改以一次MULTI/EXEC寫入，同一個鍵值只送出最後的內容，失敗時稍後重試。
+      沒有執行中的事件迴圈時(指令列工具)，以及行程結束時，以同步客戶端直接送出。
+    - 寫入的交易同時將修改的鍵值發布到頻道 type:__changes，其他行程收到後重新讀取這些鍵值，
+      並以on_change通知DataManager(鍵值版本加一、記錄為備份需要的修改)。
+    - 訂閱(重新)建立後重新讀取全部資料並使reloads加一，訂閱前與中斷期間的修改不會遺失，
+      此時take_lost()回傳True。
+
+    伺服器的資料只由負責該伺服器的分片寫入，同一個鍵值通常不會被多個行程同時修改；
+    收到其他行程的修改時，本行程尚未送出的同一個鍵值以本行程的內容為準。
+    """
+    pools: Dict[str, Any] = {}
+    async_clients: Dict[str, Any] = {}
+    # 送出或訂閱失敗時重試的間隔秒數
+    RETRY_SECONDS: float = 1.0
+
+    def __init__(self, type: str, url: str, record: Optional[Type[Record]] = None) -> None:
+        if redis is None:
+            raise RuntimeError('REDIS_URL is set but the redis package is not installed')
+        self.type: str = type
+        self.record: Optional[Type[Record]] = record
+        self.url: str = url
+        self.reloads: int = 0
+        self.on_change: Optional[Callable[[List[str], str], None]] = None
+        # 辨識自己發布的修改
+        self.origin: str = uuid.uuid4().hex
+        if url not in RedisBackend.pools:
+            RedisBackend.pools[url] = redis.ConnectionPool.from_url(url, decode_responses=True)
+        self.client: Any = redis.Redis(connection_pool=RedisBackend.pools[url])
+        # (tags..., key) -> (序號, 內容值或None)，送出成功且之後沒有再修改時才移除
+        self.__pending: Dict[Tuple[str, ...], Tuple[int, Optional[Dict[str, Any]]]] = {}
+        self.__sequence: int = 0
+        self.__lost: bool = True
+        self.__flusher: Optional['asyncio.Task[None]'] = None
+        self.__listener: Optional['asyncio.Task[None]'] = None
+        self.__tree: _Tree = self.__read_all()
+        atexit.register(self.flush)
+
+    def __key(self, tags: List[str], key: str) -> str:
+        return ':'.join([self.type] + tags + [key])
+
+    def __keys_set(self, tags: List[str]) -> str:
+        return ':'.join([self.type, '__keys'] + tags)
+
+    def __tags_set(self) -> str:
+        return f'{self.type}:__tags'
+
+    def __channel(self) -> str:
+        return f'{self.type}:__changes'
+
+    def __async(self) -> Any:
+        if self.url not in RedisBackend.async_clients:
+            RedisBackend.async_clients[self.url] = redis.asyncio.Redis.from_url(self.url, decode_responses=True)
+        return RedisBackend.async_clients[self.url]
+
+    def __decode(self, fields: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        return _decode(self.record, { k: json.loads(v) for k, v in fields.items() }) if fields else None
+
+    """讀取
+
+    全部讀取分三次往返：所有tags、每組tags的鍵值、每個鍵值的內容，每次都是一個pipeline。
+    建立時以同步客戶端讀取，重新訂閱時以非同步客戶端讀取。
+    """
+
+    def __read_all(self) -> _Tree:
+        paths: List[str] = list(self.client.smembers(self.__tags_set()))
+        pipe: Any = self.client.pipeline(transaction=False)
+        for path in paths:
+            pipe.smembers(self.__keys_set(path.split(':') if path else []))
+        pairs: List[Tuple[List[str], str]] = self.__pairs(paths, pipe.execute())
+        pipe = self.client.pipeline(transaction=False)
+        for tags, key in pairs:
+            pipe.hgetall(self.__key(tags, key))
+        return self.__build(pairs, pipe.execute())
+
+    async def __read_all_async(self) -> _Tree:
+        client: Any = self.__async()
+        paths: List[str] = list(await client.smembers(self.__tags_set()))
+        pipe: Any = client.pipeline(transaction=False)
+        for path in paths:
+            pipe.smembers(self.__keys_set(path.split(':') if path else []))
+        pairs: List[Tuple[List[str], str]] = self.__pairs(paths, await pipe.execute())
+        pipe = client.pipeline(transaction=False)
+        for tags, key in pairs:
+            pipe.hgetall(self.__key(tags, key))
+        return self.__build(pairs, await pipe.execute())
+
+    @staticmethod
+    def __pairs(paths: List[str], key_sets: List[Any]) -> List[Tuple[List[str], str]]:
+        return [ (path.split(':') if path else [], key) for path, keys in zip(paths, key_sets) for key in keys ]
+
+    def __build(self, pairs: List[Tuple[List[str], str]], results: List[Dict[str, str]]) -> _Tree:
+        tree: _Tree = _Tree()
+        for (tags, key), fields in zip(pairs, results):
+            tree.put(tags, key, self.__decode(fields))
+        # 尚未送出的修改較新
+        for path, (_, data) in self.__pending.items():
+            tree.put(list(path[:-1]), path[-1], data)
+        return tree
+
+    def get(self, tags: List[str], key: str) -> Optional[Dict[str, Any]]:
+        self.__start()
+        return self.__tree.get(tags, key)
+
+    def get_many(self, pairs: List[Tuple[List[str], str]]) -> List[Optional[Dict[str, Any]]]:
+        self.__start()
+        return [ self.__tree.get(tags, key) for tags, key in pairs ]
+
+    def keys(self, tags: Optional[List[str]]) -> List[Tuple[List[str], str]]:
+        self.__start()
+        return self.__tree.keys(tags)
+
+    def take_lost(self) -> bool:
+        self.__start()
+        lost: bool = self.__lost
+        self.__lost = False
+        return lost
+
+    """寫入"""
+
+    def set(self, tags: List[str], key: str, data: Dict[str, Any]) -> None:
+        self.set_many(tags, [(key, data)])
+
+    def set_many(self, tags: List[str], items: List[Tuple[str, Dict[str, Any]]]) -> None:
+        for key, data in items:
+            self.__put(tags, key, data)
+        self.__flush_later()
+
+    def delete(self, tags: List[str], key: str) -> None:
+        self.del_many(tags, [key])
+
+    def del_many(self, tags: List[str], keys: List[str]) -> None:
+        for key in keys:
+            self.__put(tags, key, None)
+        self.__flush_later()
+
+    def __put(self, tags: List[str], key: str, data: Optional[Dict[str, Any]]) -> None:
+        self.__tree.put(tags, key, data)
+        self.__sequence += 1
+        self.__pending[tuple(tags) + (key,)] = (self.__sequence, data)
+
+    def __flush_later(self) -> None:
+        if not _running():
+            self.flush()
+            return
+        self.__start()
+        if self.__flusher is None:
+            self.__flusher = monitor.spawn(self.__flush(), name=f'redis_flush:{self.type}')
+
+    def __queue_writes(self, pipe: Any, pending: Dict[Tuple[str, ...], Tuple[int, Optional[Dict[str, Any]]]]) -> Any:
+        """將修改加入交易，內容值在此時轉換為json"""
+        for path, (_, data) in pending.items():
+            tags, key = list(path[:-1]), path[-1]
+            k: str = self.__key(tags, key)
+            pipe.delete(k)
+            if data is None:
+                pipe.srem(self.__keys_set(tags), key)
+                continue
+            if data:
+                pipe.hset(k, mapping={ field: json.dumps(value, separators=(',', ':'), default=encode) for field, value in data.items() })
+            pipe.sadd(self.__keys_set(tags), key)
+            pipe.sadd(self.__tags_set(), ':'.join(tags))
+        pipe.publish(self.__channel(), json.dumps({ 'origin': self.origin, 'keys': [ list(path) for path in pending ] }, ensure_ascii=False))
+        return pipe
+
+    def __confirm(self, pending: Dict[Tuple[str, ...], Tuple[int, Optional[Dict[str, Any]]]]) -> None:
+        """移除已送出且之後沒有再修改的鍵值"""
+        for path, (sequence, _) in pending.items():
+            if path in self.__pending and self.__pending[path][0] == sequence:
+                del self.__pending[path]
+
+    def flush(self) -> None:
+        """以同步客戶端立即送出所有尚未送出的修改"""
+        if self.__pending:
+            pending: Dict[Tuple[str, ...], Tuple[int, Optional[Dict[str, Any]]]] = dict(self.__pending)
+            self.__queue_writes(self.client.pipeline(transaction=True), pending).execute()
+            self.__confirm(pending)
+
+    async def __flush(self) -> None:
+        try:
+            while self.__pending:
+                pending: Dict[Tuple[str, ...], Tuple[int, Optional[Dict[str, Any]]]] = dict(self.__pending)
+                try:
+                    await self.__queue_writes(self.__async().pipeline(transaction=True), pending).execute()
+                except Exception as ex:
+                    # 相同的錯誤由monitor.errors合併，Redis斷線時不會每次重試都輸出
+                    monitor.errors.report('task:redis_flush', ex)
+                    await asyncio.sleep(self.RETRY_SECONDS)
+                    continue
+                self.__confirm(pending)
+        finally:
+            self.__flusher = None
+
+    """其他行程的修改"""
+
+    def __start(self) -> None:
+        if self.__listener is None and _running():
+            self.__listener = monitor.spawn(self.__listen(), name=f'redis_listen:{self.type}')
+
+    async def __listen(self) -> None:
+        while True:
+            pubsub: Any = self.__async().pubsub()
+            try:
+                await pubsub.subscribe(self.__channel())
+                # 訂閱後才重新讀取，讀取期間的修改也會收到
+                self.__tree = await self.__read_all_async()
+                self.reloads += 1
+                self.__lost = True
+                async for message in pubsub.listen():
+                    if message['type'] != 'message':
+                        continue
+                    change: Dict[str, Any] = json.loads(message['data'])
+                    if change['origin'] != self.origin:
+                        await self.__reload([ tuple(path) for path in change['keys'] ])
+            except Exception as ex:
+                monitor.errors.report('task:redis_listen', ex)
+                await asyncio.sleep(self.RETRY_SECONDS)
+            finally:
+                try:
+                    await pubsub.reset()
+                except Exception:
+                    pass
+
+    async def __reload(self, paths: List[Tuple[str, ...]]) -> None:
+        pipe: Any = self.__async().pipeline(transaction=False)
+        for path in paths:
+            pipe.hgetall(self.__key(list(path[:-1]), path[-1]))
+        for path, fields in zip(paths, await pipe.execute()):
+            if path in self.__pending:
+                continue
+            self.__tree.put(list(path[:-1]), path[-1], self.__decode(fields))
+            if self.on_change is not None:
+                self.on_change(list(path[:-1]), path[-1])
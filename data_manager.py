@@ -1,87 +1,167 @@
-from replit import db
-from typing import Union, Optional, List, Tuple, Dict, Any
-import json
+from typing import Union, Optional, Callable, List, Tuple, Dict, Set, Type, Any
 import os
-import re
-from variable import REPLIT
-from utils import get_bit_positions
+from variable import REPLIT, REDIS_URL
+from data_backends import JsonBackend, ReplitBackend, RedisBackend
+from records import Record
+import tracing
 
-if not REPLIT:
+if not REPLIT and not REDIS_URL:
     if not os.path.isdir('data'):
         os.mkdir('data')
 
+Tags = Optional[Union[List[str], Tuple[str], str, int]]
+
 class DataManager:
     
-    def __init__(self, type: str):
+    def __init__(self, type: str, record: Optional[Type[Record]] = None):
         self.type = type
-        if not REPLIT:
-            if not os.path.isfile(f'data/{self.type}.json'):
-                with open(f'data/{self.type}.json', 'w', encoding='utf-8') as f:
-                    f.write('{}')
-            self.__data: Dict[str, Any] = json.load(open(f'data/{self.type}.json', 'r', encoding='utf-8'))
+        self.record: Optional[Type[Record]] = record
+        self.__versions: Dict[Tuple[str, ...], int] = {}
+        self.__dirty: Set[Tuple[str, ...]] = set()
+        self.__dirty_reloads: int = -1
+        self.__listeners: List[Callable[[List[str], str], None]] = []
+        self.__backend: Union[JsonBackend, ReplitBackend, RedisBackend]
+        if REDIS_URL:
+            self.__backend = RedisBackend(type, REDIS_URL, record)
+        elif REPLIT:
+            self.__backend = ReplitBackend(type, record)
+        else:
+            self.__backend = JsonBackend(type, record)
+        self.__backend.on_change = self.__changed
+
+    """紀錄
+
+    有指定record(見records)時，內容值在記憶體中是該紀錄類別，可以像dict一樣存取；
+    寫入時可以傳入dict或紀錄，dict會先轉換為紀錄。
+    """
 
     """tags運作
     
     tags: Optional[list[str|int] | Tuple[str|int] | str | int]
     tags = [tag1, tag2, tag3]
-    鍵值 = tag1_tag2_tag3_key
+    鍵值 = (tag1, tag2, tag3, key)，各後端再轉換為自己的格式
     """
+
+    def __tags(self, tags: Tags) -> List[str]:
+        if tags is not None and not isinstance(tags, list) and not isinstance(tags, tuple):
+            tags = [str(tags)]
+        return [ str(tag) for tag in tags or [] ]
+
+    def __coerce(self, data: Any) -> Any:
+        if not isinstance(data, (dict, Record)):
+            raise ValueError
+        return self.record.coerce(data) if self.record is not None else data
+
+    def __touch(self, tags: List[str], key: str) -> None:
+        k: Tuple[str, ...] = tuple(tags + [key])
+        self.__versions[k] = self.__versions.get(k, 0) + 1
+        self.__dirty.add(k)
+
+    def __changed(self, tags: List[str], key: str) -> None:
+        """其他行程修改了鍵值"""
+        self.__touch(tags, key)
+        for callback in self.__listeners:
+            callback(tags, key)
+
+    def listen(self, callback: Callable[[List[str], str], None]) -> None:
+        """其他行程修改個別鍵值時呼叫callback(tags, key)，用於更新快取
+
+        後端無法得知個別的鍵值時不會呼叫，而是使reloads改變。
+        """
+        self.__listeners.append(callback)
     
-    def get_val(self, key: str, tags: Optional[Union[List[str], Tuple[str], str, int]] = None) -> Dict[str, Any]:
+    def get_val(self, key: str, tags: Tags = None) -> Dict[str, Any]:
         """取內容值
         
         """
-        if not isinstance(key, str):
-            key = str(key)
-        if tags is not None and not isinstance(tags, list) and not isinstance(tags, tuple):
-            tags = [str(tags)]
+        with tracing.span('db.get', **{ 'db.collection': self.type, 'db.key': str(key) }):
+            return self.__backend.get(self.__tags(tags), str(key))
 
-        k: str
-        if REPLIT:
-            k = '_'.join([self.type] + [ str(tag) for tag in tags or [] ] + [key])
-            return json.loads(db[k]) if k in db else None
-        else:
-            k = '_'.join([ str(tag) for tag in tags or [] ] + [key])
-            return self.__data.get(k, None)
+    def get_many(self, pairs: List[Tuple[List[str], str]]) -> List[Optional[Dict[str, Any]]]:
+        """一次取多個內容值
+
+        pairs為keys()回傳的(tags, key)清單，依序回傳內容值，不存在時為None。
+        Redis時以一次pipeline取得。
+        """
+        with tracing.span('db.get_many', **{ 'db.collection': self.type, 'db.count': len(pairs) }):
+            return self.__backend.get_many([ (self.__tags(tags), str(key)) for tags, key in pairs ])
 
-    def set_val(self, key: str, data: Dict[str, Any], tags: Optional[Union[List[str], Tuple[str], str, int]] = None) -> None:
+    def set_val(self, key: str, data: Dict[str, Any], tags: Tags = None) -> None:
         """設定內容值
         
         """
-        if not isinstance(key, str):
-            key = str(key)
-        if not isinstance(data, dict):
-            raise ValueError
-        if tags is not None and not isinstance(tags, list) and not isinstance(tags, tuple):
-            tags = [str(tags)]
-        
-        k: str
-        if REPLIT:
-            k = '_'.join([self.type] + [ str(tag) for tag in tags or [] ] + [key])
-            db[k] = json.dumps(data, separators=(',', ':'))
-        else:
-            k = '_'.join([ str(tag) for tag in tags or [] ] + [key])
-            self.__data[k] = data
-            json.dump(self.__data, open(f'data/{self.type}.json', 'w', encoding='utf-8'), indent=4)
+        t: List[str] = self.__tags(tags)
+        data = self.__coerce(data)
+        with tracing.span('db.set', **{ 'db.collection': self.type, 'db.key': str(key) }):
+            self.__backend.set(t, str(key), data)
+        self.__touch(t, str(key))
+
+    def set_many(self, items: List[Tuple[str, Dict[str, Any]]], tags: Tags = None) -> None:
+        """一次設定多個內容值
+
+        json檔只取得一次檔案鎖並只寫入一次，Redis時以一次交易寫入。
+        """
+        items = [ (key, self.__coerce(data)) for key, data in items ]
+        if not items:
+            return
+        t: List[str] = self.__tags(tags)
+        with tracing.span('db.set_many', **{ 'db.collection': self.type, 'db.count': len(items) }):
+            self.__backend.set_many(t, [ (str(key), data) for key, data in items ])
+        for key, _ in items:
+            self.__touch(t, str(key))
 
-    def del_val(self, key: str, tags: Optional[Union[List[str], Tuple[str], str, int]] = None) -> None:
+    def del_val(self, key: str, tags: Tags = None) -> None:
         """刪除鍵值
         
         """
-        if not isinstance(key, str):
-            key = str(key)
-        if tags is not None and not isinstance(tags, list) and not isinstance(tags, tuple):
-            tags = [str(tags)]
-        k: str
-        if REPLIT:
-            k = '_'.join([self.type] + [ str(tag) for tag in tags or [] ] + [key])
-            del db[k]
-        else:
-            k = '_'.join([ str(tag) for tag in tags or [] ] + [key])
-            del self.__data[k]
-            json.dump(self.__data, open(f'data/{self.type}.json', 'w', encoding='utf-8'), indent=4)
+        t: List[str] = self.__tags(tags)
+        with tracing.span('db.delete', **{ 'db.collection': self.type, 'db.key': str(key) }):
+            self.__backend.delete(t, str(key))
+        self.__touch(t, str(key))
+
+    def del_many(self, keys: List[str], tags: Tags = None) -> None:
+        """一次刪除多個鍵值
+
+        json檔只取得一次檔案鎖並只寫入一次，Redis時以一次交易刪除。
+        """
+        if not keys:
+            return
+        t: List[str] = self.__tags(tags)
+        with tracing.span('db.del_many', **{ 'db.collection': self.type, 'db.count': len(keys) }):
+            self.__backend.del_many(t, [ str(key) for key in keys ])
+        for key in keys:
+            self.__touch(t, str(key))
+
+    def version(self, key: Union[str, int], tags: Tags = None) -> int:
+        """取鍵值版本
+        
+        每次經由此程序修改或刪除鍵值，或其他行程修改鍵值時，版本都會加一，可用於判斷快取是否過期。
+        """
+        k: Tuple[str, ...] = tuple(self.__tags(tags) + [str(key)])
+        # 從其他行程重新讀取時無法得知哪些鍵值被修改，所有鍵值的版本都視為改變
+        return self.__versions.get(k, 0) + self.__backend.reloads
         
-    def keys(self, tags: Optional[Union[List[str], Tuple[str], str, int]] = None) -> List[Tuple[List[str], str]]:
+    def take_dirty(self) -> Optional[List[Tuple[List[str], str]]]:
+        """取出上次呼叫後修改或刪除過的鍵值
+
+        回傳(tags, key)清單並清空，包含此行程與後端通知的其他行程(Redis)的修改。
+        第一次呼叫、從其他行程重新讀取過全部資料，或後端可能遺漏了其他行程的修改時(見take_lost)，
+        無法得知哪些鍵值改變，回傳None，呼叫者需要檢查所有鍵值。
+        """
+        dirty: List[Tuple[List[str], str]] = [ (list(k[:-1]), k[-1]) for k in self.__dirty ]
+        self.__dirty.clear()
+        lost: bool = self.__backend.take_lost()
+        if self.__backend.reloads != self.__dirty_reloads or lost:
+            self.__dirty_reloads = self.__backend.reloads
+            return None
+        return dirty
+
+    @property
+    def reloads(self) -> int:
+        """後端從其他行程重新讀取的次數，改變時所有鍵值的快取都應視為過期"""
+        return self.__backend.reloads
+
+    def keys(self, tags: Tags = None) -> List[Tuple[List[str], str]]:
         """取所有鍵值
         
         如有輸入tags
@@ -100,30 +180,8 @@ class DataManager:
             ...
         ]
         """
-        if tags is not None:
-            if not isinstance(tags, list) and not isinstance(tags, tuple):
-                tags = [str(tags)]
-
-        tag_str: str = '_'.join([ str(tag) for tag in tags or [] ] + [''])
-        
-        if REPLIT:
-            return [ 
-                (tags_match.group(1).split('_') if tags_match else [], title)
-                for tags_match, title in [
-                    (re.search(f'{self.type}_(.*)_.*', key), re.sub(f'{self.type}_(?:.*_)*', '', key))
-                    for key in db.keys()
-                    if key.startswith(f'{self.type}_{tag_str}')
-                ]
-            ]
-        else:
-            return [ 
-                (tags_match.group(1).split('_') if tags_match else [], title)
-                for tags_match, title in [
-                    (re.search(f'(.*)_.*', key), re.sub(f'(?:.*_)*', '', key))
-                    for key in self.__data.keys()
-                    if key.startswith(tag_str)
-                ]
-            ]
+        with tracing.span('db.keys', **{ 'db.collection': self.type }):
+            return self.__backend.keys(self.__tags(tags) if tags is not None else None)
 
 """
 Response
@@ -1,31 +1,38 @@
 from discord.ext import commands
 from discord_slash.context import SlashContext, ComponentContext
-import traceback
+from typing import Union, Optional
+from rest_scheduler import scheduler
+from utils import UserError
+import monitor
+import tracing
 
 def setup(bot: commands.Bot) -> None:
     """設置錯誤處理器
-    
+
     接收所有指令與元件的錯誤，以將自定義錯誤訊息回傳到使用者。
+    未預期的錯誤交給monitor.errors，在背景執行緒中合併相同的錯誤後輸出。
     """
-    
+
+    async def handle(ctx: Union[SlashContext, ComponentContext], source: str, ex: Exception) -> None:
+        if isinstance(ex, UserError):
+            monitor.errors.user_error(source)
+            # 不需要traceback，先釋放其中的框架
+            ex.__traceback__ = None
+            await scheduler.respond(ctx, content=ex.message, hidden=True)
+        else:
+            span: Optional[tracing.Span] = tracing.current()
+            monitor.errors.report(source, ex, span.trace_id if span is not None else None)
+
     @bot.event
     async def on_slash_command_error(ctx: SlashContext, ex: Exception) -> None:
         """
         接收所有指令錯誤
         """
-        if ex.args and ex.args[0] in ('vote', 'permission', 'response'):
-            await ctx.send(content=ex.args[1], hidden=True)
-        else:
-            traceback.print_tb(ex.__traceback__)
-            print(ex)
+        await handle(ctx, '/' + ' '.join([ n for n in (ctx.name, ctx.subcommand_group, ctx.subcommand_name) if n ]), ex)
 
     @bot.event
     async def on_component_callback_error(ctx: ComponentContext, ex: Exception) -> None:
         """
         接收所有元件錯誤
         """
-        if ex.args and ex.args[0] in ('vote', 'permission', 'response'):
-            await ctx.send(content=ex.args[1], hidden=True)
-        else:
-            traceback.print_tb(ex.__traceback__)
-            print(ex)
\ No newline at end of file
+        await handle(ctx, f'component:{ctx.custom_id}', ex)
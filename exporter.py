@@ -0,0 +1,88 @@
+from typing import Optional, Union, Iterator, Iterable, List, Dict, Any, IO
+import csv
+import io
+import json
+from utils import get_bit_positions
+import tally
+
+"""資料匯出
+
+將投票與回應資料逐列產生並編碼成CSV或JSONL，
+不會先組出整份文件，記憶體用量與資料大小無關。
+"""
+
+FORMATS: Dict[str, str] = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson'
+}
+
+VOTE_FIELDS: List[str] = ['title', 'member_id', 'choices', 'ranking']
+RESPONSE_FIELDS: List[str] = ['trip', 'mode', 'react', 'weight']
+
+# 寫入檔案或網路時，累積到這個大小再送出
+CHUNK_SIZE: int = 64 * 1024
+
+def vote_rows(data_manager: Any, guild_id: Union[str, int], title: Optional[str]=None) -> Iterator[Dict[str, Any]]:
+    """產生投票資料列
+
+    每個投票者一列，choices為投給的選項(以「|」分開)，排序投票時ranking為依順位排列的選項。
+    沒有指定title時產生伺服器上所有投票。
+    """
+    titles: Iterable[str] = [title] if title is not None else (t for _, t in data_manager.keys(guild_id))
+    for t in titles:
+        vote_info: Optional[Dict[str, Any]] = data_manager.get_val(t, guild_id)
+        if not vote_info:
+            continue
+        options: List[str] = vote_info['options']
+        ballots: Dict[str, str] = vote_info.get('ballots', {})
+        for member_id, votes in vote_info['voted'].items():
+            ballot: Optional[str] = ballots.get(member_id)
+            yield {
+                'title': t,
+                'member_id': member_id,
+                'choices': '|'.join([ options[bit.bit_length()-1] for bit in get_bit_positions(votes) ]),
+                'ranking': '|'.join([ options[o] for o in tally.unpack_ballot(ballot) ]) if ballot is not None else ''
+            }
+
+def response_rows(data: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """產生回應資料列
+
+    每個觸發詞與其連結的每個回應一列。
+    """
+    for trip in data['trips']:
+        weights: Dict[str, int] = trip.get('weights', {})
+        for bit in get_bit_positions(trip['links']):
+            pos: int = bit.bit_length()-1
+            yield {
+                'trip': trip['word'],
+                'mode': trip.get('mode', 'literal'),
+                'react': data['reacts'][pos],
+                'weight': weights.get(str(pos), 1)
+            }
+
+def encode(rows: Iterable[Dict[str, Any]], fields: List[str], fmt: str) -> Iterator[str]:
+    """將資料列編碼成文字，每次產生約CHUNK_SIZE大小的一段"""
+    buffer: io.StringIO = io.StringIO()
+    writer: Any = None
+    if fmt == 'csv':
+        writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+
+    for row in rows:
+        if writer is not None:
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(row, ensure_ascii=False))
+            buffer.write('\n')
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def write(fp: IO[bytes], rows: Iterable[Dict[str, Any]], fields: List[str], fmt: str) -> None:
+    """將資料列編碼並寫入檔案"""
+    for chunk in encode(rows, fields, fmt):
+        fp.write(chunk.encode('utf-8'))
@@ -0,0 +1,273 @@
+from typing import Optional, Iterator, List, Tuple, Dict, Set, Any, IO
+from tempfile import SpooledTemporaryFile
+from urllib.parse import urlparse
+import aiohttp
+import csv
+import io
+import json
+from normalizer import normalize
+from trip_matcher import MODES, check_pattern
+import react_template
+import tally
+from utils import UserError
+
+"""資料匯入
+
+匯入的檔案格式與exporter匯出的相同(CSV或JSONL)，以第一個字元是否為「{」判斷。
+檔案先串流下載到暫存檔(過大時寫入磁碟)，再逐列讀取合併，
+以雜湊表查找既有資料與去除重複，處理時間與檔案大小成正比，最後只寫入一次。
+
+discord-py-slash-command 不支援附件選項，改為輸入Discord附件的連結。
+"""
+
+ALLOWED_HOSTS: Tuple[str, ...] = ('cdn.discordapp.com', 'media.discordapp.net')
+# Discord一般使用者的附件上限
+MAX_IMPORT_SIZE: int = 8 * 1024 * 1024
+# Discord id(雪花id)為正的64位元整數
+MAX_ID: int = 1 << 64
+
+# 錯誤訊息依模組的語言
+MESSAGES: Dict[str, Tuple[str, str, str]] = {
+    'vote': (
+        '只能匯入Discord附件的連結！',
+        '無法下載檔案！(HTTP {})',
+        '檔案不能超過{}MB！'
+    ),
+    'response': (
+        'Only links to Discord attachments can be imported!',
+        'Failed to download the file! (HTTP {})',
+        'The file can not be larger than {}MB!'
+    )
+}
+
+class ImportResult:
+    """匯入結果
+
+    added:   新增的項目
+    merged:  已經存在、合併或更新的項目
+    skipped: 格式錯誤或檔案中重複的列
+    """
+    __slots__ = ('added', 'merged', 'skipped')
+
+    def __init__(self) -> None:
+        self.added:   int = 0
+        self.merged:  int = 0
+        self.skipped: int = 0
+
+async def download(url: str, category: str) -> IO[bytes]:
+    """下載Discord附件
+
+    只接受Discord附件網址，超過MAX_IMPORT_SIZE則錯誤跳出。
+    """
+    parsed = urlparse(url.strip())
+    if parsed.scheme != 'https' or parsed.hostname not in ALLOWED_HOSTS:
+        raise UserError(category, MESSAGES[category][0])
+
+    fp = SpooledTemporaryFile(max_size=1024 * 1024)
+    size: int = 0
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(parsed.geturl()) as resp:
+                if resp.status != 200:
+                    raise UserError(category, MESSAGES[category][1].format(resp.status))
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    size += len(chunk)
+                    if size > MAX_IMPORT_SIZE:
+                        raise UserError(category, MESSAGES[category][2].format(MAX_IMPORT_SIZE // 1024 // 1024))
+                    fp.write(chunk)
+    except BaseException:
+        fp.close()
+        raise
+    fp.seek(0)
+    return fp
+
+def rows(fp: IO[bytes]) -> Iterator[Optional[Dict[str, Any]]]:
+    """逐列讀取CSV或JSONL，無法解析的列產生None"""
+    text: io.TextIOWrapper = io.TextIOWrapper(fp, encoding='utf-8-sig', errors='replace', newline='')
+    first: str = text.read(1)
+    while first.isspace():
+        first = text.read(1)
+    if not first:
+        return
+
+    if first == '{':
+        for line in _prepend(first, text):
+            if not line.strip():
+                continue
+            try:
+                row: Any = json.loads(line)
+            except ValueError:
+                yield None
+                continue
+            yield row if isinstance(row, dict) else None
+    else:
+        for row in csv.DictReader(_prepend(first, text)):
+            yield row
+
+def _prepend(first: str, text: io.TextIOWrapper) -> Iterator[str]:
+    yield first + text.readline()
+    yield from text
+
+def merge_responses(data: Dict[str, Any], rows: Iterator[Optional[Dict[str, Any]]]) -> ImportResult:
+    """將回應資料列合併至伺服器回應資料
+
+    每列為(trip, mode, react, weight)，一個觸發詞連結一個回應。
+    已存在的連結視為合併，並以檔案中的模式與權重為準。
+    """
+    result: ImportResult = ImportResult()
+    react_pos: Dict[str, int] = { r: i for i, r in enumerate(data['reacts']) if r is not None }
+    free_pos: List[int] = [ i for i, r in enumerate(data['reacts']) if r is None ][::-1]
+    trip_index: Dict[str, Dict[str, Any]] = { t['word']: t for t in data['trips'] }
+    checked: Set[Tuple[str, str]] = set()
+    seen: Set[Tuple[str, str]] = set()
+
+    for row in rows:
+        if row is None:
+            result.skipped += 1
+            continue
+        try:
+            mode: str = str(row['mode'] or 'literal').strip()
+            word: str = str(row['trip'])
+            word = (word if mode == 'regex' else normalize(word)).strip()
+            react: str = str(row['react']).strip()
+            weight: int = int(row.get('weight') or 1)
+            if not word or not react or mode not in MODES or weight <= 0:
+                raise ValueError
+            if mode != 'literal' and (word, mode) not in checked:
+                check_pattern(word, mode)
+                checked.add((word, mode))
+            react_template.load(react)
+        except (TypeError, KeyError, ValueError, UserError):
+            result.skipped += 1
+            continue
+
+        if (word, react) in seen:
+            result.skipped += 1
+            continue
+        seen.add((word, react))
+
+        pos: Optional[int] = react_pos.get(react)
+        if pos is None:
+            if free_pos:
+                pos = free_pos.pop()
+                data['reacts'][pos] = react
+            else:
+                pos = len(data['reacts'])
+                data['reacts'].append(react)
+            react_pos[react] = pos
+
+        trip: Optional[Dict[str, Any]] = trip_index.get(word)
+        if trip is None:
+            trip = trip_index[word] = { 'word': word, 'links': 0 }
+            data['trips'].append(trip)
+        if trip['links'] >> pos & 1:
+            result.merged += 1
+        else:
+            result.added += 1
+        trip['links'] |= 1 << pos
+
+        if mode == 'literal':
+            trip.pop('mode', None)
+        else:
+            trip['mode'] = mode
+        weights: Dict[str, int] = trip.setdefault('weights', {})
+        if weight == 1:
+            weights.pop(str(pos), None)
+        else:
+            weights[str(pos)] = weight
+        if not weights:
+            del trip['weights']
+
+    return result
+
+def merge_votes(polls: Dict[str, Dict[str, Any]], rows: Iterator[Optional[Dict[str, Any]]]) -> Tuple[Dict[str, Dict[str, Any]], ImportResult]:
+    """將投票資料列合併至投票
+
+    每列為(title, member_id, choices, ranking)，一個投票者一列。
+    polls為伺服器上既有的投票(標題 -> 投票資料)；
+    不存在的投票會以檔案中出現的選項建立(最多tally.MAX_SELECT_OPTIONS個)，沒有投票訊息，需以 /vote repost 傳送。
+    已投過的成員視為合併，以檔案中的選擇為準。
+    排序只保留前max_votes個順位(新建立的投票為tally.MAX_RANKS個)，與 /vote 排序時相同；
+    一般投票的選擇超過既有投票的max_votes時略過。
+    每列先檢查完才修改投票，略過的列不會留下選項。
+    回傳(有修改的投票, 匯入結果)。
+    """
+    result: ImportResult = ImportResult()
+    changed: Dict[str, Dict[str, Any]] = {}
+    created: Set[str] = set()
+    option_pos: Dict[str, Dict[str, int]] = {}
+    seen: Set[Tuple[str, str]] = set()
+
+    for row in rows:
+        if row is None:
+            result.skipped += 1
+            continue
+        try:
+            title: str = str(row['title']).strip()
+            member_id: str = str(int(row['member_id']))
+            if not 0 < int(member_id) < MAX_ID:
+                raise ValueError
+            choices: List[str] = [ c for c in str(row.get('choices') or '').split('|') if c ]
+            ranking: List[str] = [ c for c in str(row.get('ranking') or '').split('|') if c ]
+            if not title or not (choices or ranking):
+                raise ValueError
+        except (TypeError, KeyError, ValueError):
+            result.skipped += 1
+            continue
+
+        if (title, member_id) in seen:
+            result.skipped += 1
+            continue
+        seen.add((title, member_id))
+
+        vote_info: Optional[Dict[str, Any]] = changed.get(title) or polls.get(title)
+        if vote_info is None:
+            vote_info = {
+                'options': [],
+                'close_date': None,
+                'max_votes': 1,
+                'show_members': False,
+                'closed': False,
+                'forced': False,
+                'voted': {},
+                'vote_msgs': []
+            }
+            if ranking:
+                vote_info['mode'] = 'ranked'
+                vote_info['ballots'] = {}
+            created.add(title)
+
+        positions: Dict[str, int] = option_pos.setdefault(title, { o: i for i, o in enumerate(vote_info['options']) })
+        names: List[str] = list(dict.fromkeys(ranking if 'mode' in vote_info else choices))
+        if 'mode' in vote_info:
+            del names[tally.MAX_RANKS if title in created else vote_info['max_votes']:]
+        elif title not in created and len(names) > vote_info['max_votes']:
+            result.skipped += 1
+            continue
+        new_names: List[str] = [ name for name in names if name not in positions ]
+        if not names or new_names and title not in created or len(vote_info['options']) + len(new_names) > tally.MAX_SELECT_OPTIONS:
+            result.skipped += 1
+            continue
+
+        for name in new_names:
+            positions[name] = len(vote_info['options'])
+            vote_info['options'].append(name)
+        indices: List[int] = [ positions[name] for name in names ]
+        changed[title] = vote_info
+
+        if member_id in vote_info['voted']:
+            result.merged += 1
+        else:
+            result.added += 1
+        vote_info['voted'][member_id] = sum(1 << i for i in indices)
+        if 'mode' in vote_info:
+            vote_info['ballots'][member_id] = tally.pack_ballot(indices)
+        if title in created:
+            vote_info['max_votes'] = max(vote_info['max_votes'], len(indices))
+
+    for title, vote_info in changed.items():
+        if 'mode' in vote_info:
+            if title in created:
+                vote_info['max_votes'] = min(vote_info['max_votes'], tally.MAX_RANKS)
+            vote_info['standings'] = tally.standings(vote_info)
+    return changed, result
@@ -0,0 +1,80 @@
+from typing import List, Dict
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from variable import TOKEN, PORT, SHARD_COUNT
+
+# Discord限制每5秒只能有一個分片連線(IDENTIFY)
+IDENTIFY_INTERVAL: float = 5.0
+
+def recommended_shards() -> int:
+    """向Discord取得建議的分片數量"""
+    request: urllib.request.Request = urllib.request.Request(
+        'https://discord.com/api/v8/gateway/bot',
+        headers={ 'Authorization': f'Bot {TOKEN}', 'User-Agent': 'DayBot' }
+    )
+    with urllib.request.urlopen(request) as response:
+        return int(json.load(response)['shards'])
+
+def shard_groups(shard_count: int, workers: int) -> List[List[int]]:
+    """將分片平均分給各個行程
+
+    例：10個分片、3個行程
+    將傳回：
+    [0, 1, 2, 3], [4, 5, 6], [7, 8, 9]
+    """
+    workers = max(1, min(workers, shard_count))
+    size, extra = divmod(shard_count, workers)
+    groups: List[List[int]] = []
+    start: int = 0
+    for i in range(workers):
+        end: int = start + size + (1 if i < extra else 0)
+        groups.append(list(range(start, end)))
+        start = end
+    return groups
+
+def spawn(shard_count: int, index: int, shard_ids: List[int]) -> subprocess.Popen:
+    env: Dict[str, str] = dict(os.environ,
+        SHARD_COUNT=str(shard_count),
+        SHARD_IDS=','.join([ str(i) for i in shard_ids ]),
+        PORT=str(PORT + index)
+    )
+    return subprocess.Popen([sys.executable, 'main.py'], env=env)
+
+def main() -> None:
+    """分片啟動器
+
+    將機器人的分片分散到WORKERS個行程上執行，每個行程使用各自的網頁伺服器埠號(PORT+n)，
+    行程結束時自動重新啟動。
+    """
+    shard_count: int = SHARD_COUNT or recommended_shards()
+    workers: int = int(os.getenv('WORKERS', str(os.cpu_count() or 1)))
+    groups: List[List[int]] = shard_groups(shard_count, workers)
+    processes: Dict[int, subprocess.Popen] = {}
+
+    print(f'Launching {shard_count} shards on {len(groups)} processes')
+    try:
+        for i, shard_ids in enumerate(groups):
+            processes[i] = spawn(shard_count, i, shard_ids)
+            time.sleep(IDENTIFY_INTERVAL * len(shard_ids))
+
+        while True:
+            time.sleep(IDENTIFY_INTERVAL)
+            for i, process in processes.items():
+                if process.poll() is not None:
+                    print(f'Shards {groups[i]} exited with {process.returncode}, restarting')
+                    processes[i] = spawn(shard_count, i, groups[i])
+                    break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.wait()
+
+if __name__ == '__main__':
+    main()
@@ -1,24 +1,41 @@
-from threading import Thread
 import discord
 from discord.ext import commands
 from discord_slash import SlashCommand
 from typing import List
-from variable import TOKEN
+from variable import TOKEN, PORT, SHARD_COUNT, SHARD_IDS, TRACE_FILE
 import error_handler
+import autocomplete
+import tracing
 import app
 
 intents: discord.Intents = discord.Intents.default()
 intents.members = True
-bot:     commands.Bot = commands.Bot(intents=intents, command_prefix='nebot:')
-slash:   SlashCommand = SlashCommand(bot, sync_commands=True)
-extensions: List[str] = ['cogs.vote', 'cogs.response', 'cogs.misc']
+# 成員只在 /vote notify 時按需取得，不快取也不在啟動時分塊載入
+bot:     commands.Bot
+if SHARD_COUNT:
+    bot = commands.AutoShardedBot(intents=intents, command_prefix='nebot:',
+                                  shard_count=SHARD_COUNT, shard_ids=SHARD_IDS,
+                                  member_cache_flags=discord.MemberCacheFlags.none(),
+                                  chunk_guilds_at_startup=False)
+else:
+    bot = commands.Bot(intents=intents, command_prefix='nebot:',
+                       member_cache_flags=discord.MemberCacheFlags.none(),
+                       chunk_guilds_at_startup=False)
+# 多行程分片時只由負責分片0的行程同步指令
+slash:   SlashCommand = SlashCommand(bot, sync_commands=not SHARD_IDS or 0 in SHARD_IDS)
+extensions: List[str] = ['cogs.vote', 'cogs.response', 'cogs.misc', 'cogs.backup']
 
 if __name__ == '__main__':
+    if TRACE_FILE:
+        tracing.setup(TRACE_FILE)
+        tracing.instrument_http(bot.http)
+        tracing.instrument_slash(slash)
     error_handler.setup(bot)
-    server: Thread = Thread(target=app.run)
-    server.start()
+    autocomplete.setup(bot, slash)
 
     for ext in extensions:
         bot.load_extension(ext)
 
+    bot.loop.create_task(app.run(bot, port=PORT))
+
     bot.run(TOKEN)
\ No newline at end of file
@@ -0,0 +1,101 @@
+from typing import List, Dict, Any, Callable
+from array import array
+import argparse
+import asyncio
+import random
+import tracemalloc
+from records import Poll
+
+"""記憶體基準測試
+
+polls：產生數個伺服器的投票資料，比較以dict保存與以records.Poll保存時佔用的記憶體：
+
+python memory_benchmark.py polls --guilds 50 --polls 20 --voters 5000
+
+members：比較discord.py快取所有成員(Member物件)與/vote notify暫存單一伺服器成員id(array('Q'))佔用的記憶體：
+
+python memory_benchmark.py members --guilds 100 --members 20000
+"""
+
+def make_poll(rng: random.Random, voters: int, options: int) -> Dict[str, Any]:
+    """產生一個和json讀出來一樣的投票(所有id都是各自的字串)"""
+    return {
+        'options': [ f'選項{i}' for i in range(options) ],
+        'close_date': None,
+        'max_votes': 1,
+        'show_members': False,
+        'closed': False,
+        'forced': False,
+        'voted': { str(rng.getrandbits(60)): 1 << rng.randrange(options) for _ in range(voters) },
+        'vote_msgs': [ str(rng.getrandbits(60)) for _ in range(rng.randrange(1, 4)) ]
+    }
+
+def measure(build: Callable[[], Any]) -> int:
+    """回傳build()的結果保留的記憶體(bytes)"""
+    tracemalloc.start()
+    start: int = tracemalloc.get_traced_memory()[0]
+    data: Any = build()
+    size: int = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del data
+    return size
+
+def member_payload(rng: random.Random, i: int) -> Dict[str, Any]:
+    """產生一個和GUILD_MEMBERS_CHUNK中一樣的最小成員資料"""
+    return {
+        'user': { 'id': str(rng.getrandbits(60)), 'username': f'user{i}', 'discriminator': f'{i % 10000:04}', 'avatar': None },
+        'roles': [],
+        'joined_at': '2021-01-01T00:00:00+00:00',
+        'deaf': False,
+        'mute': False
+    }
+
+def compare_members(args: argparse.Namespace) -> None:
+    """以一個伺服器量測每個成員佔用的記憶體，再換算成args.guilds個伺服器"""
+    import discord
+    from discord.state import ConnectionState
+    loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+    state: ConnectionState = ConnectionState(
+        dispatch=lambda *_: None, handlers={}, hooks={}, syncer=None, http=None, loop=loop,
+        intents=discord.Intents.default(), member_cache_flags=discord.MemberCacheFlags.none()
+    )
+    guild: discord.Guild = discord.Guild(data={ 'id': '1', 'name': 'benchmark' }, state=state)
+    rng: random.Random = random.Random(args.seed)
+    payloads: List[Dict[str, Any]] = [ member_payload(rng, i) for i in range(args.members) ]
+
+    cached: int = measure(lambda: [ discord.Member(data=payload, guild=guild, state=state) for payload in payloads ])
+    ids: int = measure(lambda: array('Q', [ int(payload['user']['id']) for payload in payloads ]))
+    loop.close()
+    print(f'{args.guilds} guilds × {args.members} members')
+    print(f'member cache: {cached / args.members:7.1f} B/member  {cached * args.guilds / 2**20:9.1f} MiB (all guilds, always)')
+    print(f'notify ids:   {ids / args.members:7.1f} B/member  {ids / 2**20:9.1f} MiB (one guild, while cached)')
+
+def main() -> None:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description='memory benchmarks')
+    parser.add_argument('kind', nargs='?', choices=['polls', 'members'], default='polls')
+    parser.add_argument('--guilds', type=int, default=50)
+    parser.add_argument('--polls', type=int, default=20)
+    parser.add_argument('--voters', type=int, default=2000)
+    parser.add_argument('--options', type=int, default=8)
+    parser.add_argument('--members', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    args: argparse.Namespace = parser.parse_args()
+
+    if args.kind == 'members':
+        compare_members(args)
+        return
+
+    def polls() -> List[List[Dict[str, Any]]]:
+        rng: random.Random = random.Random(args.seed)
+        return [ [ make_poll(rng, args.voters, args.options) for _ in range(args.polls) ] for _ in range(args.guilds) ]
+
+    dicts: int = measure(polls)
+    records: int = measure(lambda: [ [ Poll.from_dict(poll) for poll in guild ] for guild in polls() ])
+    total: int = args.guilds * args.polls * args.voters
+    print(f'{args.guilds} guilds × {args.polls} polls × {args.voters} voters')
+    print(f'dict:   {dicts / 2**20:9.1f} MiB  {dicts / total:6.1f} B/voter')
+    print(f'record: {records / 2**20:9.1f} MiB  {records / total:6.1f} B/voter')
+    print(f'ratio:  {dicts / records:9.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+from typing import Optional, Set, List, Tuple, Deque, Dict, Any, Coroutine, Counter
+from collections import deque
+import collections
+import asyncio
+import hashlib
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+
+background_tasks: Set['asyncio.Task[Any]'] = set()
+
+def spawn(coro: Coroutine[Any, Any, Any], name: Optional[str] = None) -> 'asyncio.Task[Any]':
+    """建立背景行程
+
+    建立一個會被追蹤的背景行程，行程結束後自動移除，並將未處理的錯誤印出。
+    """
+    task: 'asyncio.Task[Any]' = asyncio.get_event_loop().create_task(coro)
+    if name is not None:
+        task.set_name(name)
+    background_tasks.add(task)
+    task.add_done_callback(_on_task_done)
+    return task
+
+def _on_task_done(task: 'asyncio.Task[Any]') -> None:
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        # 名稱中「:」之後為個別的伺服器或投票，只以前段分類
+        errors.report(f'task:{task.get_name().split(":")[0]}', task.exception()) # type: ignore
+
+class LoopLagMonitor:
+    """事件迴圈延遲監控
+
+    定時睡眠固定時間，實際醒來時間與預期時間的差即為事件迴圈的延遲。
+    """
+    def __init__(self, interval: float = 0.5) -> None:
+        self.interval: float = interval
+        self.lag: float = 0.0
+        self.max_lag: float = 0.0
+
+    async def run(self) -> None:
+        loop: asyncio.AbstractEventLoop = asyncio.get_event_loop()
+        while True:
+            start: float = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - start - self.interval)
+            self.max_lag = max(self.max_lag, self.lag)
+
+    def snapshot(self) -> Dict[str, float]:
+        """取得延遲資料並重設最大值"""
+        data: Dict[str, float] = { 'lag_ms': self.lag * 1000, 'max_lag_ms': self.max_lag * 1000 }
+        self.max_lag = self.lag
+        return data
+
+loop_lag: LoopLagMonitor = LoopLagMonitor()
+
+class LatencyRecorder:
+    """延遲記錄器
+
+    保留最近size筆延遲，用來計算百分位數。
+    """
+    def __init__(self, size: int = 1000) -> None:
+        self.samples: Deque[float] = deque(maxlen=size)
+        self.count: int = 0
+
+    def record(self, seconds: float) -> None:
+        self.samples.append(seconds)
+        self.count += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """回傳p50/p90/p99(毫秒)"""
+        ordered: List[float] = sorted(self.samples)
+        if not ordered:
+            return { 'count': self.count }
+        return {
+            'count': self.count,
+            **{ f'p{p}_ms': ordered[min(len(ordered)-1, len(ordered)*p//100)] * 1000 for p in (50, 90, 99) }
+        }
+
+ack_latency: LatencyRecorder = LatencyRecorder()
+
+class CallbackRecorder:
+    """回呼耗時記錄器
+
+    保留最近size筆(耗時, 名稱, 結束時間)，用來列出最慢的回呼。
+    """
+    def __init__(self, size: int = 500) -> None:
+        self.records: Deque[Tuple[float, str, float]] = deque(maxlen=size)
+
+    def record(self, name: str, seconds: float) -> None:
+        self.records.append((seconds, name, time.time()))
+
+    def slowest(self, limit: int = 10) -> List[Tuple[float, str, float]]:
+        """回傳最慢的limit筆"""
+        return sorted(self.records, reverse=True)[:limit]
+
+callbacks: CallbackRecorder = CallbackRecorder()
+
+class ErrorSink:
+    """錯誤記錄器
+
+    事件迴圈上只計數並將錯誤放入佇列，由背景執行緒計算指紋(錯誤類型與每一層的檔案、函式、行號)後輸出：
+    - 同一指紋第一次出現時印出完整traceback，之後每interval秒最多印出一行重複次數的摘要。
+    - 佇列已滿時丟棄並計數，不會阻塞事件迴圈。
+    沒有錯誤時不會建立執行緒。
+    """
+    def __init__(self, interval: float = 60.0, maxsize: int = 1000) -> None:
+        self.interval:     float = interval
+        self.counts:       'Counter[str]' = collections.Counter()
+        self.user_counts:  'Counter[str]' = collections.Counter()
+        self.fingerprints: Dict[str, int] = {}
+        self.dropped:      int = 0
+        self._queue:  'queue.Queue[Tuple[str, BaseException, Optional[str]]]' = queue.Queue(maxsize)
+        self._thread: Optional[threading.Thread] = None
+
+    def report(self, source: str, ex: BaseException, trace_id: Optional[str] = None) -> None:
+        """記錄未預期的錯誤，source為指令或行程名稱"""
+        self.counts[source] += 1
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='error_sink', daemon=True)
+            self._thread.start()
+        try:
+            self._queue.put_nowait((source, ex, trace_id))
+        except queue.Full:
+            self.dropped += 1
+
+    def user_error(self, source: str) -> None:
+        """記錄使用者操作錯誤，只計數不輸出"""
+        self.user_counts[source] += 1
+
+    @staticmethod
+    def fingerprint(ex: BaseException) -> str:
+        frames: List[str] = [
+            f'{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}:{lineno}'
+            for frame, lineno in traceback.walk_tb(ex.__traceback__)
+        ]
+        return hashlib.sha1('|'.join([type(ex).__qualname__] + frames).encode('utf-8')).hexdigest()[:12]
+
+    def _run(self) -> None:
+        printed_at: Dict[str, float] = {}
+        suppressed: Dict[str, Tuple[int, str, str]] = {}
+        while True:
+            try:
+                item: Optional[Tuple[str, BaseException, Optional[str]]] = self._queue.get(timeout=self.interval)
+            except queue.Empty:
+                item = None
+            now: float = time.monotonic()
+
+            if item is not None:
+                source, ex, trace_id = item
+                fp: str = self.fingerprint(ex)
+                self.fingerprints[fp] = self.fingerprints.get(fp, 0) + 1
+                if fp not in printed_at:
+                    printed_at[fp] = now
+                    print(f'{source} failed [{fp}]' + (f' trace={trace_id}' if trace_id else '') + ':', file=sys.stderr)
+                    traceback.print_exception(type(ex), ex, ex.__traceback__)
+                else:
+                    count: int = suppressed[fp][0] if fp in suppressed else 0
+                    suppressed[fp] = (count + 1, source, f'{type(ex).__name__}: {ex}')
+                del item, ex
+
+            for fp in [ fp for fp in suppressed if now - printed_at[fp] >= self.interval ]:
+                count, source, summary = suppressed.pop(fp)
+                printed_at[fp] = now
+                print(f'{source} failed [{fp}] {count} more times: {summary}', file=sys.stderr)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """回傳各指令的錯誤次數"""
+        return {
+            'commands': {
+                source: { 'errors': self.counts[source], 'user_errors': self.user_counts[source] }
+                for source in set(self.counts) | set(self.user_counts)
+            },
+            'fingerprints': len(self.fingerprints),
+            'dropped': self.dropped
+        }
+
+errors: ErrorSink = ErrorSink()
@@ -0,0 +1,67 @@
+from typing import Optional, List, Tuple, Dict
+import unicodedata
+
+"""文字正規化
+
+觸發詞與訊息都經過相同的正規化再比對：
+- NFKC相容分解：全形英數、符號轉為半形，「①」轉為「1」等。
+- 轉小寫。
+- 常用簡體字轉為繁體字。
+
+所有轉換在載入時預先算成str.translate用的表，比對時只需一次translate。
+轉換以單一字元為單位，不會合併組合字元。
+"""
+
+# 只收錄一對一、沒有歧義的常用字(例如「后」「里」「干」等不轉換)
+SIMPLIFIED:  str = (
+    '这个们来时说会对国过没还发问让见开关听头马吗么为学长东车书买卖钱电话动点热爱欢乐兴语认识谁谢请读写门间场实现经济样种应该岁钟饭鸡鱼鸟龙龟图画乡农义习飞'
+    '气风网号无与专业丝两严丧丰临丽举乌乔乱争亏产亲亿仅从仓仪众优伤伦体侠侣侦侧债倾偿儿党兰养兽册军决况冻净凉减凤处击则刚创删别剂剑剧劝办务劳势勋区医华协单卢卫却厅'
+    '压厌厕县参双变叙叹吓吕启员呜咏响哑唤喷园围圆圣坏块坚坛执扩扫扬扰抚抢护报担拟拥择挂挡挤挥损换据掷搁摄摆摇携敌数断旧显晒晓晕暂机杀杂权条杨极构枪柜标栏树桥检楼欧'
+    '残毕毁汉汤沟沪泪泻泼洁浅测浑浓润涨渐温湾湿满滚滞灭灯灵灾炉炼烂烟烦烧爷牵状犹独狮猎猫献环畅疗疯痒瘾盐监盖盘矿码础确礼祸离积称稳穷窃竞笔笼简类粮紧红纪约级纯纳纸'
+    '线练组细终绍结绕绘给络绝统继绩续维绿编缘罗罚职联聪肃肠肤肿胜胆胶脑脚脸舰艺节芦苏苹茧荐药获莲萝营虑虫虽虾蚁蛮补装观规视览觉计订讨训议讯记讲许论设访证评诉词译试'
+    '诗诚询详误诸课调谈谊谋谓谨贝负贡财责贤败货质贩贪贫购贯贵费贴贸资赏赔赖赚赛赶趋跃践轨转轮软轻载较辆辈边辽达迁运进远违连迟选递逻遗邮邻郑酱释钢钥钦铁铃银铺链销锁'
+    '锅错键镇镜闪闭闯闲闹闻阅队阳阴阵阶际陆陈险随隐难雾韩页顶项顺须顾顿预领频题颜额飘饮饱饿馆驾验骑骗鸭麦黄齐龄齿态总恋恶悬惊惯愿忆忧怀怜战'
+)
+TRADITIONAL: str = (
+    '這個們來時說會對國過沒還發問讓見開關聽頭馬嗎麼為學長東車書買賣錢電話動點熱愛歡樂興語認識誰謝請讀寫門間場實現經濟樣種應該歲鐘飯雞魚鳥龍龜圖畫鄉農義習飛'
+    '氣風網號無與專業絲兩嚴喪豐臨麗舉烏喬亂爭虧產親億僅從倉儀眾優傷倫體俠侶偵側債傾償兒黨蘭養獸冊軍決況凍淨涼減鳳處擊則剛創刪別劑劍劇勸辦務勞勢勳區醫華協單盧衛卻廳'
+    '壓厭廁縣參雙變敘嘆嚇呂啟員嗚詠響啞喚噴園圍圓聖壞塊堅壇執擴掃揚擾撫搶護報擔擬擁擇掛擋擠揮損換據擲擱攝擺搖攜敵數斷舊顯曬曉暈暫機殺雜權條楊極構槍櫃標欄樹橋檢樓歐'
+    '殘畢毀漢湯溝滬淚瀉潑潔淺測渾濃潤漲漸溫灣濕滿滾滯滅燈靈災爐煉爛煙煩燒爺牽狀猶獨獅獵貓獻環暢療瘋癢癮鹽監蓋盤礦碼礎確禮禍離積稱穩窮竊競筆籠簡類糧緊紅紀約級純納紙'
+    '線練組細終紹結繞繪給絡絕統繼績續維綠編緣羅罰職聯聰肅腸膚腫勝膽膠腦腳臉艦藝節蘆蘇蘋繭薦藥獲蓮蘿營慮蟲雖蝦蟻蠻補裝觀規視覽覺計訂討訓議訊記講許論設訪證評訴詞譯試'
+    '詩誠詢詳誤諸課調談誼謀謂謹貝負貢財責賢敗貨質販貪貧購貫貴費貼貿資賞賠賴賺賽趕趨躍踐軌轉輪軟輕載較輛輩邊遼達遷運進遠違連遲選遞邏遺郵鄰鄭醬釋鋼鑰欽鐵鈴銀鋪鏈銷鎖'
+    '鍋錯鍵鎮鏡閃閉闖閒鬧聞閱隊陽陰陣階際陸陳險隨隱難霧韓頁頂項順須顧頓預領頻題顏額飄飲飽餓館駕驗騎騙鴨麥黃齊齡齒態總戀惡懸驚慣願憶憂懷憐戰'
+)
+
+def _build_table() -> Dict[int, str]:
+    s2t: Dict[str, str] = dict(zip(SIMPLIFIED, TRADITIONAL))
+    table: Dict[int, str] = {}
+    for cp in range(0x10000):
+        if 0xD800 <= cp < 0xE000:
+            continue
+        c: str = chr(cp)
+        n: str = ''.join([ s2t.get(x, x) for x in unicodedata.normalize('NFKC', c).lower() ])
+        # 表中不會有刪除字元的項目，長度不變即代表每個字元都是一對一轉換
+        if n and n != c:
+            table[cp] = n
+    return table
+
+TABLE: Dict[int, str] = _build_table()
+
+def normalize(text: str) -> str:
+    """正規化文字"""
+    return text.translate(TABLE)
+
+def normalize_with_offsets(text: str) -> Tuple[str, Optional[List[int]]]:
+    """正規化文字並回傳位置對照
+
+    回傳(正規化後的文字, 對照表)，對照表的第i項為正規化後第i個字元在原文中的位置。
+    如果每個字元都是一對一轉換，則對照表為None，位置與原文相同。
+    """
+    normalized: str = text.translate(TABLE)
+    if len(normalized) == len(text):
+        return normalized, None
+
+    offsets: List[int] = []
+    for i, c in enumerate(text):
+        offsets.extend([i] * len(TABLE.get(ord(c), c)))
+    return normalized, offsets
@@ -0,0 +1,75 @@
+from typing import Optional, List, Dict, Any, Counter
+import collections
+from types import FrameType
+import asyncio
+import os
+import sys
+import threading
+import time
+
+"""取樣分析器
+
+需要時才啟動：在執行緒池中的一個執行緒裡，每隔interval秒以sys._current_frames()
+取得所有其他執行緒(包含事件迴圈所在的執行緒)的呼叫堆疊並計數，
+結果輸出為collapsed stack格式，每行「外層;內層;... 次數」，可直接交給flamegraph.pl或speedscope。
+沒有在分析時不會有任何額外的執行緒或追蹤。
+"""
+
+MAX_SECONDS:      float = 60.0
+DEFAULT_INTERVAL: float = 0.005
+
+_lock: threading.Lock = threading.Lock()
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+def _current_tasks() -> Dict[Any, Any]:
+    # 事件迴圈 -> 正在執行的asyncio行程，取不到時(其他Python版本)只標示執行緒
+    tasks: Any = getattr(asyncio.tasks, '_current_tasks', None)
+    return dict(tasks) if isinstance(tasks, dict) else {}
+
+def sample(seconds: float, interval: float = DEFAULT_INTERVAL, loop: Optional[asyncio.AbstractEventLoop] = None) -> 'Counter[str]':
+    """取樣seconds秒，回傳 collapsed stack -> 次數
+
+    loop為事件迴圈時，其所在執行緒的堆疊最外層會標示當下執行中的asyncio行程名稱。
+    同一時間只能有一個取樣，重複呼叫時錯誤跳出。
+    """
+    if not _lock.acquire(blocking=False):
+        raise RuntimeError('profiler is already running')
+    try:
+        stacks: 'Counter[str]' = collections.Counter()
+        me: int = threading.get_ident()
+        loop_thread: Optional[int] = getattr(loop, '_thread_id', None)
+        end: float = time.monotonic() + min(seconds, MAX_SECONDS)
+        while time.monotonic() < end:
+            names: Dict[Optional[int], str] = { t.ident: t.name for t in threading.enumerate() }
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                labels: List[str] = []
+                f: Optional[FrameType] = frame
+                while f is not None:
+                    labels.append(_frame_label(f))
+                    f = f.f_back
+                root: str = names.get(thread_id, str(thread_id))
+                if thread_id == loop_thread:
+                    task: Any = _current_tasks().get(loop)
+                    root += f';task:{task.get_name()}' if task is not None else ';idle'
+                stacks[root + ';' + ';'.join(reversed(labels))] += 1
+            time.sleep(interval)
+        return stacks
+    finally:
+        _lock.release()
+
+async def profile(seconds: float, interval: float = DEFAULT_INTERVAL) -> 'Counter[str]':
+    """在背景執行緒取樣，不阻塞事件迴圈"""
+    loop: asyncio.AbstractEventLoop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, sample, seconds, interval, loop)
+
+def collapsed(stacks: 'Counter[str]') -> bytes:
+    """輸出collapsed stack格式"""
+    return ''.join([ f'{stack} {count}\n' for stack, count in stacks.most_common() ]).encode('utf-8')
+
+def running() -> bool:
+    return _lock.locked()
@@ -0,0 +1,138 @@
+from typing import Optional, List, Tuple, Dict, Any
+from random import choice
+import re
+import discord
+from utils import UserError
+
+"""React templates
+
+Reacts may contain placeholders in double braces:
+
+{{}} or {{word}}     the matched trip, as written in the message
+{{author}}           mention of the message author
+{{random:a/b/c}}     one of the options, picked randomly
+{{"text"}}           the text itself, useful with repeats
+
+A placeholder may be repeated, either inside or right after the braces:
+'{{word * 3}}', '{{}} * 2'. Reacts without placeholders are sent as is.
+"""
+
+MAX_REPEAT: int = 50
+MAX_LENGTH: int = 2000
+
+# {{}} echoes text from the message, which may contain @everyone, @here or
+# role mentions. Rendered reacts only ping the author they reply to.
+ALLOWED_MENTIONS: discord.AllowedMentions = discord.AllowedMentions(everyone=False, roles=False, users=False, replied_user=True)
+
+TEXT:   int = 0
+WORD:   int = 1
+AUTHOR: int = 2
+RANDOM: int = 3
+
+PLACEHOLDER: 're.Pattern[str]' = re.compile(r'\{\{(.*?)\}\}(?:\s*\*\s*(\d+))?')
+EXPRESSION:  're.Pattern[str]' = re.compile(r'^(.*?)\s*(?:\*\s*(\d+))?$', re.DOTALL)
+
+class ReactTemplate:
+    """Compiled react
+
+    A react is parsed once into a list of (kind, value, repeat) parts, so
+    rendering it is only a loop over the parts.
+    """
+    __slots__ = ('parts', 'constant')
+
+    def __init__(self, react: str) -> None:
+        self.parts: List[Tuple[int, Any, int]] = []
+        pos: int = 0
+        for match in PLACEHOLDER.finditer(react):
+            if match.start() > pos:
+                self.parts.append((TEXT, react[pos:match.start()], 1))
+            kind, value, repeat = self.parse(match.group(1))
+            if match.group(2):
+                repeat *= int(match.group(2))
+            if repeat > MAX_REPEAT:
+                raise UserError('response', f'"{match.group(0)}" repeats more than {MAX_REPEAT} times!')
+            self.parts.append((kind, value, repeat))
+            pos = match.end()
+        if pos < len(react):
+            self.parts.append((TEXT, react[pos:], 1))
+
+        self.constant: Optional[str] = None
+        if all(kind == TEXT for kind, _, _ in self.parts):
+            self.constant = self.render('', '')
+
+    @staticmethod
+    def parse(expression: str) -> Tuple[int, Any, int]:
+        match: Optional['re.Match[str]'] = EXPRESSION.match(expression.strip())
+        assert match is not None
+        atom: str = match.group(1)
+        repeat: int = int(match.group(2)) if match.group(2) else 1
+
+        if atom in ('', 'word'):
+            return WORD, None, repeat
+        if atom == 'author':
+            return AUTHOR, None, repeat
+        if atom.startswith('random:'):
+            options: List[str] = [ o.strip() for o in atom[len('random:'):].split('/') if o.strip() ]
+            if not options:
+                raise UserError('response', f'"{{{{{expression}}}}}" has no options to pick from!')
+            return RANDOM, options, repeat
+        if len(atom) >= 2 and atom[0] == atom[-1] == '"':
+            return TEXT, atom[1:-1], repeat
+        raise UserError('response', f'Unknown placeholder "{{{{{expression}}}}}"!')
+
+    def render(self, word: str, author: str) -> str:
+        """Render the react, the result is at most MAX_LENGTH characters"""
+        if self.constant is not None:
+            return self.constant
+
+        out: List[str] = []
+        length: int = 0
+        for kind, value, repeat in self.parts:
+            text: str
+            if kind == TEXT:
+                text = value
+            elif kind == WORD:
+                text = word
+            elif kind == AUTHOR:
+                text = author
+            else:
+                text = choice(value)
+            if text:
+                repeat = min(repeat, (MAX_LENGTH - length) // len(text) + 1)
+                out.append(text * repeat)
+                length += len(text) * repeat
+                if length >= MAX_LENGTH:
+                    break
+        return ''.join(out)[:MAX_LENGTH]
+
+_templates: Dict[str, ReactTemplate] = {}
+
+def load(react: str) -> ReactTemplate:
+    """Compile a react and cache it
+
+    Raise UserError('response', ...) if the react has an invalid placeholder.
+    """
+    template: Optional[ReactTemplate] = _templates.get(react)
+    if template is None:
+        template = _templates[react] = ReactTemplate(react)
+    return template
+
+def get(react: str) -> ReactTemplate:
+    """Get the compiled react
+
+    Reacts added before templates existed may have invalid placeholders,
+    those are sent as plain text.
+    """
+    template: Optional[ReactTemplate] = _templates.get(react)
+    if template is None:
+        try:
+            template = load(react)
+        except UserError:
+            template = _templates[react] = ReactTemplate.__new__(ReactTemplate)
+            template.parts = [(TEXT, react, 1)]
+            template.constant = react[:MAX_LENGTH]
+    return template
+
+def discard(react: str) -> None:
+    """Drop a react from the cache"""
+    _templates.pop(react, None)
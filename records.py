@@ -0,0 +1,326 @@
+from typing import Optional, Union, Iterable, Iterator, List, Tuple, Dict, Any, Type, TypeVar
+from array import array
+from bisect import bisect_left
+import sys
+
+"""資料紀錄
+
+投票與回應在記憶體中以有__slots__的紀錄保存，只在寫入資料庫(或封存檔)時轉換成json：
+- 成員id與訊息id以整數存放在array中，不再是一個個十進位字串。
+- 投票者以兩個平行的array保存：依成員id排序的array('Q')與對應的選擇array('I')，以二分搜尋查詢。
+  數值超出array的範圍時(超過64個選項的bitmask、不正確的id)改用list，不會無法讀取。
+- 選項、觸發詞、回應等重複出現的字串以sys.intern共用。
+
+紀錄可以像原本的dict一樣以鍵值存取欄位(vote_info['closed']、'mode' in vote_info、
+vote_info.pop('closed_at', None)…)，沒有設定的欄位視為不存在；
+id欄位的存取與迭代仍使用字串，使用紀錄的程式不需要知道內部的格式。
+json.dump時以default=encode轉換。
+"""
+
+def _intern(value: Any) -> Any:
+    return sys.intern(value) if isinstance(value, str) else value
+
+# 依序嘗試的array型別，都放不下時改用list
+_WIDER: Dict[str, Optional[str]] = { 'I': 'Q', 'Q': None }
+
+def _column(typecode: Optional[str], values: List[int]) -> Any:
+    """以能放下所有數值的最小array保存整數，都放不下時為list"""
+    while typecode is not None:
+        try:
+            return array(typecode, values)
+        except OverflowError:
+            typecode = _WIDER[typecode]
+    return list(values)
+
+def _widen(column: Any) -> Any:
+    return _column(_WIDER[column.typecode], list(column)) if isinstance(column, array) else column
+
+class IdColumn:
+    """Discord id清單，以array('Q')保存，存取時為字串"""
+    __slots__ = ('ids',)
+
+    def __init__(self, ids: Iterable[Union[str, int]] = ()) -> None:
+        self.ids: Any = _column('Q', [ int(i) for i in ids ])
+
+    def append(self, value: Union[str, int]) -> None:
+        try:
+            self.ids.append(int(value))
+        except OverflowError:
+            self.ids = _widen(self.ids)
+            self.ids.append(int(value))
+
+    def remove(self, value: Union[str, int]) -> None:
+        self.ids.remove(int(value))
+
+    def __contains__(self, value: Any) -> bool:
+        try:
+            return int(value) in self.ids
+        except (TypeError, ValueError):
+            return False
+
+    def __iter__(self) -> Iterator[str]:
+        return ( str(i) for i in self.ids )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, index: Any) -> Any:
+        if isinstance(index, slice):
+            return [ str(i) for i in self.ids[index] ]
+        return str(self.ids[index])
+
+    def to_json(self) -> List[str]:
+        return list(self)
+
+    def __repr__(self) -> str:
+        return f'IdColumn({self.to_json()!r})'
+
+class VotedColumns:
+    """投票者 -> 選擇(bitmask)
+
+    members為依成員id排序的array('Q')，masks為對應的array('I')，
+    選項超過32個時masks自動改為array('Q')，超過64個時改為list。存取時成員id為字串。
+    """
+    __slots__ = ('members', 'masks')
+
+    def __init__(self, voted: Optional[Dict[str, int]] = None) -> None:
+        pairs: List[Tuple[int, int]] = sorted([ (int(member_id), mask) for member_id, mask in (voted or {}).items() ])
+        self.members: Any = _column('Q', [ m for m, _ in pairs ])
+        self.masks:   Any = _column('I', [ mask for _, mask in pairs ])
+
+    def __find(self, member_id: Union[str, int]) -> Tuple[int, int, bool]:
+        m: int = int(member_id)
+        i: int = bisect_left(self.members, m)
+        return m, i, i < len(self.members) and self.members[i] == m
+
+    def __getitem__(self, member_id: Union[str, int]) -> int:
+        _, i, found = self.__find(member_id)
+        if not found:
+            raise KeyError(member_id)
+        return self.masks[i]
+
+    def __setitem__(self, member_id: Union[str, int], mask: int) -> None:
+        m, i, found = self.__find(member_id)
+        # 先放大欄位，不會只寫入其中一個欄位
+        while isinstance(self.masks, array) and not 0 <= mask < 1 << (self.masks.itemsize * 8):
+            self.masks = _widen(self.masks)
+        if found:
+            self.masks[i] = mask
+            return
+        while isinstance(self.members, array) and not 0 <= m < 1 << (self.members.itemsize * 8):
+            self.members = _widen(self.members)
+        self.members.insert(i, m)
+        self.masks.insert(i, mask)
+
+    def __delitem__(self, member_id: Union[str, int]) -> None:
+        _, i, found = self.__find(member_id)
+        if not found:
+            raise KeyError(member_id)
+        del self.members[i]
+        del self.masks[i]
+
+    def __contains__(self, member_id: Any) -> bool:
+        try:
+            return self.__find(member_id)[2]
+        except (TypeError, ValueError):
+            return False
+
+    def get(self, member_id: Union[str, int], default: Any = None) -> Any:
+        _, i, found = self.__find(member_id)
+        return self.masks[i] if found else default
+
+    def pop(self, member_id: Union[str, int], *default: Any) -> Any:
+        _, i, found = self.__find(member_id)
+        if not found:
+            if default:
+                return default[0]
+            raise KeyError(member_id)
+        mask: int = self.masks[i]
+        del self.members[i]
+        del self.masks[i]
+        return mask
+
+    def __iter__(self) -> Iterator[str]:
+        return ( str(m) for m in self.members )
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def keys(self) -> Iterator[str]:
+        return iter(self)
+
+    def values(self) -> Iterator[int]:
+        return iter(self.masks)
+
+    def items(self) -> Iterator[Tuple[str, int]]:
+        return ( (str(m), mask) for m, mask in zip(self.members, self.masks) )
+
+    def to_json(self) -> Dict[str, int]:
+        return dict(self.items())
+
+    def __repr__(self) -> str:
+        return f'VotedColumns({self.to_json()!r})'
+
+R = TypeVar('R', bound='Record')
+
+class Record:
+    """有__slots__的紀錄，可以像dict一樣存取
+
+    子類別在__slots__列出所有欄位，convert()在設定欄位時轉換值的格式；
+    不認得的欄位(例如較新版本寫入的資料)存放在extra，不會遺失。
+    """
+    __slots__ = ('extra',)
+
+    def convert(self, key: str, value: Any) -> Any:
+        return value
+
+    @classmethod
+    def fields(cls) -> Tuple[str, ...]:
+        return cls.__slots__ # type: ignore
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.fields():
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if hasattr(self, 'extra') and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key in self.fields():
+            setattr(self, key, self.convert(key, value))
+        else:
+            if not hasattr(self, 'extra'):
+                self.extra: Dict[str, Any] = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        try:
+            if key in self.fields():
+                delattr(self, key)
+            else:
+                del self.extra[key]
+        except (AttributeError, KeyError):
+            raise KeyError(key) from None
+
+    def __contains__(self, key: Any) -> bool:
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key: str, *default: Any) -> Any:
+        try:
+            value: Any = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[key]
+        return value
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def keys(self) -> List[str]:
+        return [ k for k in self.fields() if hasattr(self, k) ] + list(getattr(self, 'extra', {}))
+
+    def items(self) -> List[Tuple[str, Any]]:
+        return [ (k, self[k]) for k in self.keys() ]
+
+    def values(self) -> List[Any]:
+        return [ self[k] for k in self.keys() ]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({dict(self.items())!r})'
+
+    @classmethod
+    def from_dict(cls: Type[R], data: Dict[str, Any]) -> R:
+        record: R = cls.__new__(cls)
+        for key, value in data.items():
+            record[key] = value
+        return record
+
+    @classmethod
+    def coerce(cls: Type[R], data: Any) -> R:
+        """轉換成紀錄，已經是紀錄時整理其中以dict加入的子項目"""
+        if isinstance(data, cls):
+            data.normalize()
+            return data
+        return cls.from_dict(data)
+
+    def normalize(self) -> None:
+        pass
+
+    def to_json(self) -> Dict[str, Any]:
+        return dict(self.items())
+
+def encode(value: Any) -> Any:
+    """json.dump的default"""
+    if isinstance(value, (Record, IdColumn, VotedColumns)):
+        return value.to_json()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+class Poll(Record):
+    """投票，欄位見cogs.vote"""
+    __slots__ = ('options', 'close_date', 'max_votes', 'show_members', 'closed', 'forced',
+                 'voted', 'vote_msgs', 'closed_at', 'mode', 'ballots', 'standings')
+
+    def convert(self, key: str, value: Any) -> Any:
+        if key == 'voted':
+            return value if isinstance(value, VotedColumns) else VotedColumns(value)
+        if key == 'vote_msgs':
+            return value if isinstance(value, IdColumn) else IdColumn(value)
+        if key == 'options':
+            return [ _intern(option) for option in value ]
+        if key in ('close_date', 'mode'):
+            return _intern(value)
+        return value
+
+class Trip(Record):
+    """回應的觸發詞，欄位見cogs.response"""
+    __slots__ = ('word', 'links', 'mode', 'weights')
+
+    def convert(self, key: str, value: Any) -> Any:
+        return _intern(value) if key in ('word', 'mode') else value
+
+class ResponseSet(Record):
+    """伺服器的回應，欄位見cogs.response與response_presets"""
+    __slots__ = ('trips', 'reacts', 'presets', 'masked', 'burst')
+
+    def convert(self, key: str, value: Any) -> Any:
+        if key == 'trips':
+            return [ Trip.coerce(trip) for trip in value ]
+        if key in ('reacts', 'presets', 'masked'):
+            return [ _intern(v) for v in value ]
+        if key == 'burst':
+            return _intern(value)
+        return value
+
+    def normalize(self) -> None:
+        # 指令新增的觸發詞與回應是dict與新的字串
+        for key in ('trips', 'reacts'):
+            if key in self:
+                self[key] = self[key]
+
+RECORDS: Dict[str, Type[Record]] = {
+    'vote': Poll,
+    'response': ResponseSet
+}
@@ -0,0 +1,146 @@
+from typing import Optional, List, Tuple, Dict, Any
+from collections import Counter, OrderedDict
+import asyncio
+import time
+from variable import REPLY_RATE, REPLY_BURST
+from rest_scheduler import scheduler, REPLY
+import react_template
+import monitor
+import tracing
+
+"""自動回應節流
+
+每個頻道一個權杖桶(每秒補充rate個，最多burst個)，自動回應每次送出需要一個權杖。
+有權杖時立即送出；沒有權杖(洗版中)時依伺服器的設定處理：
+- merge：暫存回應，下一個權杖補充時合併成一則訊息，回覆最後一則觸發的訊息。
+- drop：直接捨棄回應。
+合併時超過訊息長度上限的較舊回應會被捨棄。送出、合併、捨棄的次數記錄在stats()。
+"""
+
+MERGE: str = 'merge'
+DROP:  str = 'drop'
+POLICIES: List[str] = [MERGE, DROP]
+
+# 超過此數量的頻道時，移除最久沒有使用的頻道(權杖桶重新開始)
+MAX_CHANNELS: int = 10000
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate:     float = rate
+        self.capacity: float = capacity
+        self.tokens:   float = capacity
+        self.updated:  float = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: float) -> bool:
+        """取得一個權杖，沒有權杖時回傳False"""
+        self.refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def delay(self, now: float) -> float:
+        """回傳距離下一個權杖的秒數"""
+        self.refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+class _Channel:
+    __slots__ = ('bucket', 'pending', 'flusher')
+
+    def __init__(self, bucket: TokenBucket) -> None:
+        self.bucket:  TokenBucket = bucket
+        self.pending: List[Tuple[Any, str]] = []
+        self.flusher: Optional['asyncio.Task[Any]'] = None
+
+def merge(replies: List[str], limit: int = react_template.MAX_LENGTH) -> Tuple[str, int]:
+    """將回應合併成一則訊息，保留最新且不超過limit的部分，回傳(內容, 保留的數量)"""
+    kept: List[str] = []
+    length: int = -1
+    for reply in reversed(replies):
+        if kept and length + 1 + len(reply) > limit:
+            break
+        kept.append(reply)
+        length += 1 + len(reply)
+    return '\n'.join(reversed(kept))[:limit], len(kept)
+
+class ReplyThrottle:
+    def __init__(self, rate: float = REPLY_RATE, burst: int = REPLY_BURST) -> None:
+        self.rate:     float = rate
+        self.burst:    int = burst
+        self.channels: 'OrderedDict[int, _Channel]' = OrderedDict()
+        self.counts:   'Counter[str]' = Counter()
+
+    def channel(self, channel_id: int) -> _Channel:
+        """取得頻道，頻道依最後使用的順序排列"""
+        if channel_id in self.channels:
+            self.channels.move_to_end(channel_id)
+            return self.channels[channel_id]
+        if len(self.channels) >= MAX_CHANNELS:
+            self.evict()
+        self.channels[channel_id] = _Channel(TokenBucket(self.rate, self.burst))
+        return self.channels[channel_id]
+
+    def evict(self) -> None:
+        """移除最久沒有使用的頻道
+
+        有暫存回應或正在送出的頻道不能移除，移到最後，下次不會再檢查到。
+        """
+        for _ in range(len(self.channels)):
+            channel_id, channel = self.channels.popitem(last=False)
+            if not channel.pending and channel.flusher is None:
+                return
+            self.channels[channel_id] = channel
+
+    def send(self, message: Any, reply: str, policy: str = MERGE) -> Optional['asyncio.Future[Any]']:
+        """送出對message的回應
+
+        立即送出時回傳請求的Future；被暫存或捨棄時回傳None。
+        """
+        channel: _Channel = self.channel(message.channel.id)
+        if not channel.pending and channel.bucket.take(time.monotonic()):
+            self.counts['sent'] += 1
+            return scheduler.submit(REPLY, ('channel', message.channel.id), lambda: message.reply(reply, allowed_mentions=react_template.ALLOWED_MENTIONS))
+
+        if policy == DROP:
+            self.counts['suppressed'] += 1
+            return None
+        channel.pending.append((message, reply))
+        if channel.flusher is None:
+            channel.flusher = monitor.spawn(self.__flush(message.channel.id, channel), name=f'reply_flush:{message.channel.id}')
+        return None
+
+    async def __flush(self, channel_id: int, channel: _Channel) -> None:
+        try:
+            while channel.pending:
+                await asyncio.sleep(channel.bucket.delay(time.monotonic()))
+                if not channel.bucket.take(time.monotonic()):
+                    continue
+                pending: List[Tuple[Any, str]] = channel.pending
+                channel.pending = []
+                content, kept = merge([ reply for _, reply in pending ])
+                self.counts['sent'] += 1
+                self.counts['merged'] += kept - 1
+                self.counts['suppressed'] += len(pending) - kept
+                message: Any = pending[-1][0]
+                with tracing.span('reply.flush', **{ 'reply.channel_id': str(channel_id), 'reply.count': len(pending) }):
+                    await scheduler.submit(REPLY, ('channel', channel_id), lambda: message.reply(content, allowed_mentions=react_template.ALLOWED_MENTIONS))
+        finally:
+            channel.flusher = None
+
+    def stats(self) -> Dict[str, int]:
+        """回傳送出、合併、捨棄的次數與暫存中的回應數量"""
+        return {
+            'sent': self.counts['sent'],
+            'merged': self.counts['merged'],
+            'suppressed': self.counts['suppressed'],
+            'pending': sum(len(c.pending) for c in self.channels.values()),
+            'channels': len(self.channels)
+        }
+
+throttle: ReplyThrottle = ReplyThrottle()
@@ -0,0 +1,166 @@
+from typing import Optional, Iterator, List, Tuple, Dict, Set, Any
+import json
+import os
+import sys
+from utils import get_bit_positions, AliasTable, UserError
+from trip_matcher import TripMatcher, check_pattern
+from normalizer import normalize
+
+"""Response presets
+
+A preset is a shared, read-only set of responses in presets/<name>.json,
+in the same shape as a guild's response data plus a description:
+
+{
+    'description': 'Greetings',
+    'trips': [ { 'word': 'hello', 'links': 1 } ],
+    'reacts': [ 'Hi {{author}}!' ]
+}
+
+Presets are loaded once at startup with every string interned, and each
+preset compiles its own TripMatcher and samplers once for all the guilds
+that installed it. A guild only stores the names of its presets:
+
+data = {
+    'trips': [ ... ],           local trips, these shadow preset trips with the same word
+    'reacts': [ ... ],
+    'presets': [ 'greetings' ],
+    'masked': [ 'hello' ]       preset trips removed by the guild
+}
+
+Nothing is copied until a guild edits a preset trip, then copy_on_write()
+copies that trip and its reacts into the guild's local data.
+"""
+
+PRESET_DIR: str = 'presets'
+
+class Preset:
+    __slots__ = ('name', 'description', 'trips', 'reacts', 'words', 'matcher', 'samplers')
+
+    def __init__(self, name: str, raw: Dict[str, Any]) -> None:
+        self.name:        str = name
+        self.description: str = raw.get('description', name)
+        self.reacts:      List[Optional[str]] = [ sys.intern(r) if r is not None else None for r in raw['reacts'] ]
+        self.trips:       List[Dict[str, Any]] = []
+        for trip in raw['trips']:
+            # stored the same way /response add stores trips, so guilds can shadow them by word
+            trip['word'] = sys.intern(trip['word'] if trip.get('mode') == 'regex' else normalize(trip['word']).strip())
+            if trip.get('mode', 'literal') != 'literal':
+                try:
+                    check_pattern(trip['word'], trip['mode'])
+                except UserError as ex:
+                    print(f'Preset {name}: skipped trip: {ex.message}')
+                    continue
+            self.trips.append(trip)
+        self.words:    Dict[str, Dict[str, Any]] = { t['word']: t for t in self.trips }
+        self.matcher:  TripMatcher = TripMatcher(self.trips)
+        self.samplers: Dict[str, AliasTable] = {}
+
+    def sampler(self, trip: Dict[str, Any]) -> AliasTable:
+        """Get the react sampler of a trip, shared by every guild"""
+        sampler: Optional[AliasTable] = self.samplers.get(trip['word'])
+        if sampler is None:
+            weights: Dict[str, int] = trip.get('weights', {})
+            react_pos_list: List[int] = [ bit.bit_length()-1 for bit in get_bit_positions(trip['links']) ]
+            sampler = self.samplers[trip['word']] = AliasTable(react_pos_list, [ weights.get(str(pos), 1) for pos in react_pos_list ])
+        return sampler
+
+presets: Dict[str, Preset] = {}
+
+def load(root: str = PRESET_DIR) -> None:
+    """Load every preset in root, replacing the loaded ones"""
+    presets.clear()
+    if not os.path.isdir(root):
+        return
+    for file_name in sorted(os.listdir(root)):
+        if file_name.endswith('.json'):
+            with open(os.path.join(root, file_name), 'r', encoding='utf-8') as f:
+                presets[file_name[:-len('.json')]] = Preset(file_name[:-len('.json')], json.load(f))
+
+def installed(data: Dict[str, Any]) -> Iterator[Preset]:
+    """Yield the presets a guild installed, skipping the ones no longer available"""
+    for name in data.get('presets', []):
+        if name in presets:
+            yield presets[name]
+
+def hidden_words(data: Dict[str, Any]) -> Set[str]:
+    """Preset trip words a guild does not use, either shadowed or masked"""
+    return { t['word'] for t in data['trips'] } | set(data.get('masked', []))
+
+def find_preset_trip(data: Dict[str, Any], word: str) -> Optional[Tuple[Preset, Dict[str, Any]]]:
+    """Find the preset trip a guild would match for word, if it is not masked"""
+    if word in data.get('masked', []):
+        return None
+    for preset in installed(data):
+        if word in preset.words:
+            return preset, preset.words[word]
+    return None
+
+def copy_on_write(data: Dict[str, Any], word: str) -> bool:
+    """Copy a preset trip and its reacts into the guild's local data
+
+    Reacts reuse the guild's free react slots, the same way /response add does.
+    Return whether a trip was copied.
+    """
+    if any(t['word'] == word for t in data['trips']):
+        return False
+    found: Optional[Tuple[Preset, Dict[str, Any]]] = find_preset_trip(data, word)
+    if found is None:
+        return False
+    preset, trip = found
+
+    links: int = 0
+    weights: Dict[str, int] = {}
+    for bit in get_bit_positions(trip['links']):
+        pos: int = bit.bit_length()-1
+        react: Optional[str] = preset.reacts[pos]
+        if react in data['reacts']:
+            i: int = data['reacts'].index(react)
+        elif None in data['reacts']:
+            i = data['reacts'].index(None)
+            data['reacts'][i] = react
+        else:
+            i = len(data['reacts'])
+            data['reacts'].append(react)
+        links |= 1 << i
+        if str(pos) in trip.get('weights', {}):
+            weights[str(i)] = trip['weights'][str(pos)]
+
+    local: Dict[str, Any] = { 'word': word, 'links': links }
+    if 'mode' in trip:
+        local['mode'] = trip['mode']
+    if weights:
+        local['weights'] = weights
+    data['trips'].append(local)
+    return True
+
+def mask(data: Dict[str, Any], word: str) -> None:
+    """Stop matching a preset trip in a guild"""
+    if any(word in preset.words for preset in installed(data)) and word not in data.get('masked', []):
+        data.setdefault('masked', []).append(word)
+
+def flatten(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge the guild's presets into a plain { 'trips', 'reacts' } copy
+
+    Used for showing and exporting. Preset reacts are appended after the
+    guild's reacts, with the preset trips' links shifted to match.
+    """
+    if not data.get('presets'):
+        return data
+    hidden: Set[str] = hidden_words(data)
+    trips: List[Dict[str, Any]] = list(data['trips'])
+    reacts: List[Optional[str]] = list(data['reacts'])
+    for preset in installed(data):
+        offset: int = len(reacts)
+        reacts.extend(preset.reacts)
+        for trip in preset.trips:
+            if trip['word'] in hidden:
+                continue
+            hidden.add(trip['word'])
+            shifted: Dict[str, Any] = { **trip, 'links': trip['links'] << offset }
+            if 'weights' in trip:
+                shifted['weights'] = { str(int(pos) + offset): w for pos, w in trip['weights'].items() }
+            trips.append(shifted)
+    return { 'trips': trips, 'reacts': reacts }
+
+load()
@@ -0,0 +1,175 @@
+from typing import Optional, Callable, Awaitable, Hashable, List, Dict, Deque, Any
+from collections import deque
+import asyncio
+import heapq
+import time
+import monitor
+import tracing
+
+# 優先度，數字越小越優先
+INTERACTION: int = 0
+REPLY:       int = 1
+BOARD_EDIT:  int = 2
+CLOSER:      int = 3
+
+PRIORITY_NAMES: Dict[int, str] = {
+    INTERACTION: 'interaction',
+    REPLY: 'reply',
+    BOARD_EDIT: 'board_edit',
+    CLOSER: 'closer'
+}
+
+class _Job:
+    __slots__ = ('priority', 'seq', 'bucket', 'key', 'factory', 'future', 'queued_at', 'parent')
+
+    def __init__(self, priority: int, seq: int, bucket: Hashable, key: Optional[Hashable],
+                 factory: Callable[[], Awaitable[Any]], future: 'asyncio.Future[Any]') -> None:
+        self.priority:  int = priority
+        self.seq:       int = seq
+        self.bucket:    Hashable = bucket
+        self.key:       Optional[Hashable] = key
+        self.factory:   Callable[[], Awaitable[Any]] = factory
+        self.future:    'asyncio.Future[Any]' = future
+        self.queued_at: float = time.monotonic()
+        self.parent:    Optional[tracing.Span] = tracing.current()
+
+    def __lt__(self, other: '_Job') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class RestScheduler:
+    """對外請求排程器
+
+    所有送往Discord的請求都經由此排程器，依優先度執行：
+    - 同一個bucket(例如同一個頻道)同時最多執行per_bucket個請求，避免同時打到同一個速率限制；
+      一個伺服器的大量請求只會在自己的bucket排隊，不會佔住其他伺服器的名額。
+    - 所有請求同時執行的數量另有上限concurrency(對應Discord的全域速率限制)，
+      並保留reserved個名額給互動回應。
+    - 指定key的請求在排隊期間會被合併，只執行最後一次提交的內容，優先度取較高者。
+    - 請求失敗或被取消時，Future也會得到例外或被取消；排隊期間Future被取消的請求不會執行。
+    """
+    def __init__(self, concurrency: int = 40, reserved: int = 5, per_bucket: int = 1) -> None:
+        self.concurrency: int = concurrency
+        self.reserved:    int = reserved
+        self.per_bucket:  int = per_bucket
+        self._queue:   List[_Job] = []
+        self._pending: Dict[Hashable, _Job] = {}
+        # bucket -> 執行中的數量；bucket -> 因bucket已滿而等待的請求
+        self._active:  Dict[Hashable, int] = {}
+        self._busy:    Dict[Hashable, Deque[_Job]] = {}
+        self._seq:       int = 0
+        self._in_flight: int = 0
+        self._wakeup:  Optional[asyncio.Event] = None
+        self._waits:   Dict[int, Dict[str, float]] = {
+            priority: { 'count': 0, 'total': 0.0, 'max': 0.0 } for priority in PRIORITY_NAMES
+        }
+
+    def submit(self, priority: int, bucket: Hashable, factory: Callable[[], Awaitable[Any]],
+               key: Optional[Hashable] = None) -> 'asyncio.Future[Any]':
+        """提交請求
+
+        回傳一個會在請求完成時得到結果的Future。
+        如果同key的請求還在排隊，則以新的factory取代舊的，並共用同一個Future；
+        新的優先度較高時改以新的優先度排隊。
+        """
+        if key is not None and key in self._pending:
+            job: _Job = self._pending[key]
+            job.factory = factory
+            job.parent = tracing.current()
+            if priority < job.priority:
+                # 等待bucket的請求在放回佇列時才依優先度排序
+                job.priority = priority
+                heapq.heapify(self._queue)
+                assert self._wakeup is not None
+                self._wakeup.set()
+            return job.future
+
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+            monitor.spawn(self._dispatch(), name='rest_scheduler')
+
+        self._seq += 1
+        job = _Job(priority, self._seq, bucket, key, factory, asyncio.get_event_loop().create_future())
+        if key is not None:
+            self._pending[key] = job
+        heapq.heappush(self._queue, job)
+        self._wakeup.set()
+        return job.future
+
+    async def respond(self, ctx: Any, **kwargs: Any) -> Any:
+        """以最高優先度回應互動"""
+        return await self.submit(INTERACTION, ('interaction', ctx.interaction_id), lambda: ctx.send(**kwargs))
+
+    async def defer(self, ctx: Any, hidden: bool = False) -> None:
+        """以最高優先度延後回應互動"""
+        await self.submit(INTERACTION, ('interaction', ctx.interaction_id), lambda: ctx.defer(hidden=hidden))
+
+    async def _dispatch(self) -> None:
+        assert self._wakeup is not None
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._queue and self._in_flight < self.concurrency:
+                if self._queue[0].priority != INTERACTION and self._in_flight >= self.concurrency - self.reserved:
+                    break
+                job: _Job = heapq.heappop(self._queue)
+                if job.future.done():
+                    # 排隊期間被取消
+                    if job.key is not None:
+                        del self._pending[job.key]
+                    continue
+                if self._active.get(job.bucket, 0) >= self.per_bucket:
+                    self._busy.setdefault(job.bucket, deque()).append(job)
+                    continue
+                if job.key is not None:
+                    del self._pending[job.key]
+                self._active[job.bucket] = self._active.get(job.bucket, 0) + 1
+                self._in_flight += 1
+                asyncio.get_event_loop().create_task(self._run(job))
+
+    async def _run(self, job: _Job) -> None:
+        wait: float = time.monotonic() - job.queued_at
+        stat: Dict[str, float] = self._waits[job.priority]
+        stat['count'] += 1
+        stat['total'] += wait
+        stat['max'] = max(stat['max'], wait)
+        try:
+            # 請求在排程器的行程中執行，接續提交時的span
+            with tracing.attach(job.parent), tracing.span('rest.job', **{
+                'rest.priority': PRIORITY_NAMES[job.priority], 'rest.bucket': str(job.bucket), 'rest.wait_ms': wait * 1000
+            }):
+                result: Any = await job.factory()
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+        except Exception as ex:
+            if not job.future.done():
+                job.future.set_exception(ex)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._in_flight -= 1
+            self._active[job.bucket] -= 1
+            if not self._active[job.bucket]:
+                del self._active[job.bucket]
+            for deferred in self._busy.pop(job.bucket, ()):
+                heapq.heappush(self._queue, deferred)
+            assert self._wakeup is not None
+            self._wakeup.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """回傳排隊深度與各優先度的等待時間"""
+        return {
+            'depth': len(self._queue) + sum(len(d) for d in self._busy.values()),
+            'in_flight': self._in_flight,
+            'wait': {
+                PRIORITY_NAMES[priority]: {
+                    'count': int(stat['count']),
+                    'avg_ms': stat['total'] / stat['count'] * 1000 if stat['count'] else 0.0,
+                    'max_ms': stat['max'] * 1000
+                }
+                for priority, stat in self._waits.items()
+            }
+        }
+
+scheduler: RestScheduler = RestScheduler()
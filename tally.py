@@ -0,0 +1,182 @@
+from typing import Optional, Iterable, List, Tuple, Dict, Set, Any
+
+"""計票
+
+排序投票的選票以bytes存放，第i個byte為第i順位的選項索引，
+存入資料庫時轉為16進位字串，例：
+第1順位選項2、第2順位選項0 -> bytes([2, 0]) -> '0200'
+
+投票資料的 standings 保存可以逐票更新的統計：
+- 即時決選：{ 'rounds': 各輪票數, 'eliminated': 各輪淘汰的選項, 'winner': 勝出選項 } (見instant_runoff)
+- 波達計數：{ 'points': 各選項的分數 }
+成員改票時以update()在每一輪扣掉舊選票、加上新選票，不需要重新計票；
+只有某一輪的勝出或淘汰因此改變時，才從所有選票重新計算。顯示時以result()直接讀取。
+"""
+
+# 排序投票每個順位一個下拉清單，一則訊息最多5列元件
+MAX_RANKS:   int = 5
+# 選項索引以一個byte存放
+MAX_OPTIONS: int = 256
+# Discord下拉清單最多25個選項，投票的選項不能超過此數量
+MAX_SELECT_OPTIONS: int = 25
+
+MODES: Dict[str, str] = {
+    'plurality': '一般',
+    'ranked': '即時決選',
+    'borda': '波達計數'
+}
+
+def pack_ballot(ranking: Iterable[int]) -> str:
+    return bytes(ranking).hex()
+
+def unpack_ballot(ballot: str) -> bytes:
+    return bytes.fromhex(ballot)
+
+def borda(ballots: Iterable[bytes], option_count: int) -> List[int]:
+    """波達計數
+
+    第1順位得option_count-1分，第2順位得option_count-2分，依此類推，未排序的選項不得分。
+    """
+    points: List[int] = [0] * option_count
+    for ballot in ballots:
+        for rank, option in enumerate(ballot):
+            points[option] += option_count - 1 - rank
+    return points
+
+def instant_runoff(ballots: List[bytes], option_count: int) -> Dict[str, Any]:
+    """即時決選
+
+    每輪淘汰票數最少的選項，並將其選票轉給選票上下一個尚未淘汰的選項，
+    直到有選項過半或只剩一個選項。
+
+    每個選項保留一疊目前算在它名下的選票，淘汰時只移動被淘汰選項那一疊，
+    其他選票不會重新計算，總工作量與所有選票的長度總和成正比。
+
+    回傳：
+    {
+        'rounds': [ [各選項票數, 已淘汰為None], ... ],
+        'eliminated': [ 第1輪淘汰的選項, 第2輪淘汰的選項, ... ],
+        'winner': 勝出選項索引或None
+    }
+    """
+    piles: List[List[int]] = [ [] for _ in range(option_count) ]
+    positions: List[int] = [0] * len(ballots)
+    for i, ballot in enumerate(ballots):
+        if ballot:
+            piles[ballot[0]].append(i)
+
+    eliminated: List[bool] = [False] * option_count
+    rounds: List[List[Optional[int]]] = []
+    order: List[int] = []
+
+    while True:
+        counts: List[Optional[int]] = [ None if eliminated[o] else len(piles[o]) for o in range(option_count) ]
+        rounds.append(counts)
+        winner, loser = _decide(counts, rounds[-2] if len(rounds) > 1 else None)
+        if loser is None:
+            break
+
+        eliminated[loser] = True
+        order.append(loser)
+        for i in piles[loser]:
+            ranking: bytes = ballots[i]
+            pos: int = positions[i] + 1
+            while pos < len(ranking) and eliminated[ranking[pos]]:
+                pos += 1
+            positions[i] = pos
+            if pos < len(ranking):
+                piles[ranking[pos]].append(i)
+        piles[loser] = []
+
+    return { 'rounds': rounds, 'eliminated': order, 'winner': winner }
+
+def _decide(counts: List[Optional[int]], previous: Optional[List[Optional[int]]]) -> Tuple[Optional[int], Optional[int]]:
+    """即時決選一輪的結果
+
+    回傳(勝出選項, 淘汰選項)，有選項過半或只剩一個選項時勝出，都為None代表沒有選票。
+    同票時淘汰前一輪票數較少者，再相同則淘汰索引較大者。
+    """
+    active: List[int] = [ o for o, count in enumerate(counts) if count is not None ]
+    total: int = sum(counts[o] or 0 for o in active)
+    if not active or total == 0:
+        return None, None
+    leader: int = max(active, key=lambda o: counts[o] or 0)
+    if (counts[leader] or 0) * 2 > total or len(active) == 1:
+        return leader, None
+    return None, min(active, key=lambda o: (counts[o] or 0, (previous[o] or 0) if previous is not None else 0, -o))
+
+def _top(ballot: bytes, eliminated: Set[int]) -> Optional[int]:
+    """選票上第一個尚未淘汰的選項"""
+    for option in ballot:
+        if option not in eliminated:
+            return option
+    return None
+
+def _cached(current: Dict[str, Any], option_count: int) -> bool:
+    """standings是否為目前格式的即時決選結果(舊版資料只有第1順位票數)"""
+    rounds: List[List[Optional[int]]] = current.get('rounds') or []
+    return 'eliminated' in current and len(rounds) == len(current['eliminated']) + 1 and all(len(counts) == option_count for counts in rounds)
+
+def standings(vote_info: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """從所有選票計算排序投票的統計
+
+    只在建立投票、修改選項與匯入時使用，成員改票時使用update()。
+    """
+    mode: str = vote_info.get('mode', 'plurality')
+    ballots: List[bytes] = [ unpack_ballot(b) for b in vote_info.get('ballots', {}).values() ]
+    if mode == 'ranked':
+        return instant_runoff(ballots, len(vote_info['options']))
+    if mode == 'borda':
+        return { 'points': borda(ballots, len(vote_info['options'])) }
+    return None
+
+def update(vote_info: Dict[str, Any], old: bytes, new: bytes) -> None:
+    """選票由old改為new時更新投票資料的 standings
+
+    即時決選在每一輪只移動這張選票，再依序檢查每一輪的勝出與淘汰是否改變，
+    改變時(票數接近時才會發生)從所有選票重新計算。
+    統計不存在或與選項數量不符(舊版資料)時也從所有選票重新計算。
+    """
+    mode: str = vote_info.get('mode', 'plurality')
+    option_count: int = len(vote_info['options'])
+    current: Dict[str, Any] = vote_info.get('standings') or {}
+    if not (_cached(current, option_count) if mode == 'ranked' else len(current.get('points') or []) == option_count):
+        vote_info['standings'] = standings(vote_info)
+        return
+
+    if mode == 'borda':
+        points: List[int] = current['points']
+        for rank, option in enumerate(old):
+            points[option] -= option_count - 1 - rank
+        for rank, option in enumerate(new):
+            points[option] += option_count - 1 - rank
+    elif mode == 'ranked':
+        rounds: List[List[Optional[int]]] = current['rounds']
+        eliminated: Set[int] = set()
+        for k, counts in enumerate(rounds):
+            for ballot, delta in ((old, -1), (new, 1)):
+                top: Optional[int] = _top(ballot, eliminated)
+                if top is not None:
+                    counts[top] = (counts[top] or 0) + delta
+            if k < len(current['eliminated']):
+                eliminated.add(current['eliminated'][k])
+
+        for k, counts in enumerate(rounds):
+            winner, loser = _decide(counts, rounds[k-1] if k else None)
+            expected: Tuple[Optional[int], Optional[int]] = (None, current['eliminated'][k]) if k < len(current['eliminated']) else (current['winner'], None)
+            if (winner, loser) != expected:
+                vote_info['standings'] = standings(vote_info)
+                return
+    vote_info['standings'] = current
+
+def result(vote_info: Dict[str, Any]) -> Dict[str, Any]:
+    """顯示用的目前結果
+
+    直接使用 standings，即時決選為instant_runoff()格式的各輪結果。
+    舊版資料沒有各輪結果時才從所有選票計算。
+    """
+    current: Dict[str, Any] = vote_info.get('standings') or {}
+    if vote_info.get('mode') != 'ranked' or _cached(current, len(vote_info['options'])):
+        return current
+    ballots: List[bytes] = [ unpack_ballot(b) for b in vote_info.get('ballots', {}).values() ]
+    return instant_runoff(ballots, len(vote_info['options']))
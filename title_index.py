@@ -0,0 +1,79 @@
+from typing import Optional, Union, Callable, Iterable, List, Tuple, Dict
+from bisect import bisect_left, insort
+
+"""投票標題索引
+
+每個伺服器一個依標題(不分大小寫)排序的清單與 標題 -> 是否關閉 的對照，
+以二分搜尋找出前綴相符的標題，不需要讀取資料庫，用於自動完成與 /vote show list。
+伺服器第一次被查詢時才以loader從資料庫載入，之後由投票模組在新增、刪除、改名、開啟、關閉、封存時更新。
+尚未載入的伺服器不需要更新，載入時會讀到最新的資料。
+其他行程(或還原備份)修改資料時reloads()會改變，此時清除所有已載入的伺服器，下次查詢時重新載入。
+"""
+
+MAX_CHOICES: int = 25
+
+class GuildTitles:
+    __slots__ = ('keys', 'closed')
+
+    def __init__(self, titles: Iterable[Tuple[str, bool]]) -> None:
+        self.closed: Dict[str, bool] = dict(titles)
+        self.keys:   List[Tuple[str, str]] = sorted([ (title.casefold(), title) for title in self.closed ])
+
+    def set(self, title: str, closed: bool) -> None:
+        if title not in self.closed:
+            insort(self.keys, (title.casefold(), title))
+        self.closed[title] = closed
+
+    def remove(self, title: str) -> None:
+        if self.closed.pop(title, None) is None:
+            return
+        del self.keys[bisect_left(self.keys, (title.casefold(), title))]
+
+    def match(self, state: str, title: str) -> bool:
+        return state == 'all' or self.closed[title] == (state == 'close')
+
+class TitleIndex:
+    def __init__(self, loader: Callable[[str], Iterable[Tuple[str, bool]]], reloads: Optional[Callable[[], int]] = None) -> None:
+        self.loader:  Callable[[str], Iterable[Tuple[str, bool]]] = loader
+        self.reloads: Optional[Callable[[], int]] = reloads
+        self.loaded:  int = reloads() if reloads is not None else 0
+        self.guilds:  Dict[str, GuildTitles] = {}
+
+    def guild(self, guild_id: Union[str, int]) -> GuildTitles:
+        guild_id = str(guild_id)
+        if self.reloads is not None and self.reloads() != self.loaded:
+            self.loaded = self.reloads()
+            self.guilds.clear()
+        if guild_id not in self.guilds:
+            self.guilds[guild_id] = GuildTitles(self.loader(guild_id))
+        return self.guilds[guild_id]
+
+    def set(self, guild_id: Union[str, int], title: str, closed: bool) -> None:
+        """新增標題或更新開啟/關閉狀態"""
+        if str(guild_id) in self.guilds:
+            self.guilds[str(guild_id)].set(title, closed)
+
+    def remove(self, guild_id: Union[str, int], title: str) -> None:
+        if str(guild_id) in self.guilds:
+            self.guilds[str(guild_id)].remove(title)
+
+    def drop(self, guild_id: Union[str, int]) -> None:
+        self.guilds.pop(str(guild_id), None)
+
+    def titles(self, guild_id: Union[str, int], state: str = 'all') -> List[str]:
+        """依標題排序回傳符合狀態的標題，state為 'all' | 'open' | 'close'"""
+        guild: GuildTitles = self.guild(guild_id)
+        return [ title for _, title in guild.keys if guild.match(state, title) ]
+
+    def complete(self, guild_id: Union[str, int], prefix: str, state: str = 'all', limit: int = MAX_CHOICES) -> List[str]:
+        """回傳最多limit個以prefix開頭(不分大小寫)且符合狀態的標題"""
+        guild: GuildTitles = self.guild(guild_id)
+        folded: str = prefix.strip().casefold()
+        result: List[str] = []
+        for i in range(bisect_left(guild.keys, (folded, '')), len(guild.keys)):
+            key, title = guild.keys[i]
+            if not key.startswith(folded) or len(result) >= limit:
+                break
+            if guild.match(state, title):
+                result.append(title)
+        return result
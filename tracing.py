@@ -0,0 +1,212 @@
+from typing import Optional, Iterator, Callable, Dict, Any, Coroutine, TypeVar
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from functools import wraps
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import aiohttp
+import json
+import logging
+import os
+import queue
+import time
+import monitor
+
+"""追蹤
+
+每個gateway事件或互動產生一個trace id，經由contextvar傳遞給其中呼叫的所有程序與建立的背景行程，
+cog處理程序、DataManager操作與對外的REST請求各自是一個span。
+span寫入輪替的JSONL檔，格式參考OTLP：
+
+{
+    "traceId": "32位16進位", "spanId": "16位16進位", "parentSpanId": "...或null",
+    "name": "vote_select", "startTimeUnixNano": 0, "endTimeUnixNano": 0,
+    "attributes": { ... }, "status": { "code": "OK" | "ERROR", "message": "..." }
+}
+
+沒有呼叫setup()時不會產生任何span，span()只是一個空的context manager。
+序列化與寫檔都在QueueListener的執行緒中進行，不佔用事件迴圈。
+"""
+
+MAX_BYTES:    int = 16 * 1024 * 1024
+BACKUP_COUNT: int = 5
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'start_ns', 'end_ns', 'attributes', 'error')
+
+    def __init__(self, name: str, parent: Optional['Span'], attributes: Dict[str, Any]) -> None:
+        self.trace_id:   str = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.span_id:    str = os.urandom(8).hex()
+        self.parent_id:  Optional[str] = parent.span_id if parent is not None else None
+        self.name:       str = name
+        self.start_ns:   int = time.time_ns()
+        self.end_ns:     int = 0
+        self.attributes: Dict[str, Any] = attributes
+        self.error:      Optional[str] = None
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_id,
+            'name': self.name,
+            'startTimeUnixNano': self.start_ns,
+            'endTimeUnixNano': self.end_ns,
+            'attributes': self.attributes,
+            'status': { 'code': 'ERROR', 'message': self.error } if self.error is not None else { 'code': 'OK' }
+        }
+
+class _SpanQueueHandler(QueueHandler):
+    # 不在事件迴圈上格式化，直接將span放入佇列
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+class _SpanFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record.msg.to_dict(), ensure_ascii=False, default=str) # type: ignore
+
+_current:  ContextVar[Optional[Span]] = ContextVar('span', default=None)
+_logger:   Optional[logging.Logger] = None
+_listener: Optional[QueueListener] = None
+
+def setup(path: str, max_bytes: int = MAX_BYTES, backup_count: int = BACKUP_COUNT) -> None:
+    """開始將span寫入path"""
+    global _logger, _listener
+    if _logger is not None:
+        return
+    file_handler: RotatingFileHandler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    file_handler.setFormatter(_SpanFormatter())
+    spans: 'queue.SimpleQueue[Any]' = queue.SimpleQueue()
+    _listener = QueueListener(spans, file_handler)
+    _listener.start()
+
+    logger: logging.Logger = logging.getLogger('daybot.trace')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(_SpanQueueHandler(spans))
+    _logger = logger
+
+def current() -> Optional[Span]:
+    """目前的span"""
+    return _current.get()
+
+@contextmanager
+def attach(parent: Optional[Span]) -> Iterator[None]:
+    """在不同的行程中接續parent，例如排程器代為執行的請求"""
+    token: 'Token[Optional[Span]]' = _current.set(parent)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """建立span，沒有上層span時開始新的trace
+
+    span內發生的錯誤會記錄在status後繼續拋出。
+    """
+    if _logger is None:
+        yield None
+        return
+    s: Span = Span(name, _current.get(), attributes)
+    token: 'Token[Optional[Span]]' = _current.set(s)
+    try:
+        yield s
+    except BaseException as ex:
+        s.error = f'{type(ex).__name__}: {ex}'
+        raise
+    finally:
+        s.end_ns = time.time_ns()
+        _current.reset(token)
+        _logger.info(s)
+
+def _attributes(args: Any) -> Dict[str, Any]:
+    # 從互動或訊息參數取出可識別的資訊
+    attributes: Dict[str, Any] = {}
+    for arg in args:
+        if hasattr(arg, 'interaction_id'):
+            attributes['discord.interaction_id'] = str(arg.interaction_id)
+            attributes['discord.guild_id'] = str(arg.guild_id)
+            break
+        if hasattr(arg, 'channel') and hasattr(arg, 'author'):
+            attributes['discord.message_id'] = str(arg.id)
+            attributes['discord.channel_id'] = str(arg.channel.id)
+            break
+    return attributes
+
+F = TypeVar('F', bound=Callable[..., Coroutine[Any, Any, Any]])
+
+def traced(name: str) -> Callable[[F], F]:
+    """以span包住協程函式，並記錄每次執行的耗時至monitor.callbacks
+
+    保留原函式的名稱，可放在cog_ext與commands.Cog.listener等裝飾器下方。
+    """
+    def decorator(func: F) -> F:
+        @wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            start: float = time.perf_counter()
+            try:
+                with span(name, **(_attributes(args) if _logger is not None else {})):
+                    return await func(*args, **kwargs)
+            finally:
+                monitor.callbacks.record(name, time.perf_counter() - start)
+        return wrapper # type: ignore
+    return decorator
+
+async def _on_request_end(session: Any, context: Any, params: Any) -> None:
+    # 在發出請求的行程中執行，目前的span即為該請求的span
+    s: Optional[Span] = current()
+    if s is not None:
+        s.set('http.status_code', params.response.status)
+
+def _trace_config() -> aiohttp.TraceConfig:
+    config: aiohttp.TraceConfig = aiohttp.TraceConfig()
+    config.on_request_end.append(_on_request_end)
+    config.freeze()
+    return config
+
+_TRACE_CONFIG: aiohttp.TraceConfig = _trace_config()
+
+def instrument_http(http: Any) -> None:
+    """以span包住discord.py的每個REST請求，記錄路徑與狀態碼(包含404等錯誤)
+
+    discord.py只回傳解析後的內容，狀態碼由加在aiohttp session上的TraceConfig記錄，
+    429重試時記錄最後一次的狀態碼。session在登入與重新連線時才建立，每次請求時檢查。
+    """
+    request: Callable[..., Coroutine[Any, Any, Any]] = http.request
+
+    @wraps(request)
+    async def traced_request(route: Any, **kwargs: Any) -> Any:
+        session: Any = getattr(http, '_HTTPClient__session', None)
+        if session is not None and _TRACE_CONFIG not in session._trace_configs:
+            session._trace_configs.append(_TRACE_CONFIG)
+        with span(f'HTTP {route.method}', **{ 'http.method': route.method, 'http.route': route.path }) as s:
+            try:
+                return await request(route, **kwargs)
+            except Exception as ex:
+                if s is not None and hasattr(ex, 'status'):
+                    s.set('http.status_code', ex.status) # type: ignore
+                raise
+
+    http.request = traced_request
+
+def instrument_slash(slash: Any) -> None:
+    """每個斜線指令與元件互動開始一個新的trace"""
+    invoke_command: Callable[..., Coroutine[Any, Any, Any]] = slash.invoke_command
+    invoke_component_callback: Callable[..., Coroutine[Any, Any, Any]] = slash.invoke_component_callback
+
+    @wraps(invoke_command)
+    async def traced_command(func: Any, ctx: Any, args: Any) -> Any:
+        name: str = ' '.join([ n for n in (ctx.name, ctx.subcommand_group, ctx.subcommand_name) if n ])
+        with attach(None), span(f'/{name}', **_attributes([ctx])):
+            return await invoke_command(func, ctx, args)
+
+    @wraps(invoke_component_callback)
+    async def traced_component(func: Any, ctx: Any) -> Any:
+        with attach(None), span(f'component {ctx.custom_id}', **_attributes([ctx])):
+            return await invoke_component_callback(func, ctx)
+
+    slash.invoke_command = traced_command
+    slash.invoke_component_callback = traced_component
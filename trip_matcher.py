@@ -0,0 +1,396 @@
+from typing import Optional, Callable, Iterator, List, Tuple, Dict, Set, Any
+import re
+from normalizer import normalize
+from utils import UserError
+
+try:
+    from re import _parser as sre_parse, _compiler as sre_compile # type: ignore
+except ImportError:
+    import sre_parse, sre_compile
+
+"""Trip modes
+
+literal:  the trip is a plain substring (default)
+word:     the trip must not be surrounded by other word characters
+wildcard: '*' matches any run of non-space characters, '?' matches one,
+          a '*' at the start or end changes nothing and is dropped
+regex:    the trip is a regular expression
+"""
+MODES: Tuple[str, ...] = ('literal', 'word', 'wildcard', 'regex')
+
+MAX_PATTERN_LENGTH: int = 200
+# Discord messages are at most 4000 characters, nothing after that is scanned
+MAX_SCAN_LENGTH:    int = 4000
+# a pattern with one unbounded repeat can still take time quadratic in the
+# length of the text, so pattern trips only scan the start of a message
+MAX_PATTERN_SCAN_LENGTH: int = 1000
+
+def to_regex(word: str, mode: str) -> str:
+    """Turn a trip into the source of a regular expression"""
+    if mode == 'word':
+        return rf'(?<!\w){re.escape(word)}(?!\w)'
+    if mode == 'wildcard':
+        return ''.join([ r'\S*' if c == '*' else r'\S' if c == '?' else re.escape(c) for c in re.sub(r'\*+', '*', word).strip('*') ])
+    if mode == 'regex':
+        return word
+    return re.escape(word)
+
+def check_pattern(word: str, mode: str) -> None:
+    """Check if a pattern trip is safe to run on every message
+
+    Patterns that are too long, match an empty string, use backreferences,
+    named groups or global flags (they break the combined regex), or can
+    backtrack catastrophically are rejected. The usual causes of
+    catastrophic backtracking are:
+
+    - a repeat nested in another repeat, e.g. '(a+)+'
+    - a repeated alternation whose branches can start with the same
+      character, e.g. '(a|aa)+'
+    - two unbounded repeats in a row that can match the same characters,
+      e.g. 'x.*.*y', '\\w*\\s*\\w*x' or the wildcard 'a*?*b'
+
+    Repeats separated by literal text, e.g. 'a.*b.*c' or the wildcard
+    'a*b*c', are allowed, see _separator.
+    """
+    if len(word) > MAX_PATTERN_LENGTH:
+        raise UserError('response', f'Pattern trips can not be longer than {MAX_PATTERN_LENGTH} characters!')
+
+    source: str = to_regex(word, mode)
+    try:
+        parsed: Any = sre_parse.parse(source)
+    except re.error as ex:
+        raise UserError('response', f'"{word}" is not a valid pattern: {ex}')
+
+    if parsed.state.groupdict:
+        raise UserError('response', f'"{word}" uses named groups, which are not supported!')
+    if parsed.state.flags & ~re.UNICODE:
+        raise UserError('response', f'"{word}" uses global flags like "(?i)", use a scoped group like "(?i:...)" instead!')
+    if re.compile(source).fullmatch(''):
+        raise UserError('response', f'"{word}" matches an empty message!')
+    _check_subpattern(word, parsed, False)
+    _check_sequence(word, parsed, None)
+
+def _check_subpattern(word: str, subpattern: Any, in_repeat: bool) -> None:
+    for op, av in subpattern:
+        if op in (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS):
+            raise UserError('response', f'"{word}" uses backreferences, which are not supported!')
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            _, max_repeat, item = av
+            if max_repeat > 1:
+                if in_repeat:
+                    raise UserError('response', f'"{word}" has nested repeats, which can make the bot hang!')
+                _check_subpattern(word, item, True)
+            else:
+                _check_subpattern(word, item, in_repeat)
+        elif op == sre_parse.SUBPATTERN:
+            _check_subpattern(word, av[-1], in_repeat)
+        elif op == sre_parse.BRANCH:
+            if in_repeat:
+                firsts: List[Optional[List[Any]]] = [ None if _nullable(branch) else _first(branch) for branch in av[1] ]
+                for i in range(len(firsts)):
+                    for j in range(i):
+                        if _overlap(firsts[i], firsts[j]):
+                            raise UserError('response', f'"{word}" repeats a choice whose options overlap, which can make the bot hang!')
+            for branch in av[1]:
+                _check_subpattern(word, branch, in_repeat)
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            _check_subpattern(word, av[1], in_repeat)
+
+"""Character sets
+
+To compare what parts of a pattern can match, a set of characters is kept
+as a list of single-character items from the parsed pattern (LITERAL,
+NOT_LITERAL, IN, ANY), or None when it is unknown and may be anything.
+Two sets overlap if any character of a small probe alphabet, plus every
+literal and range end they mention, is matched by both.
+"""
+
+_PROBES: str = 'aZ0_ -\n.\u00e9\u4e2d\uff10'
+_CATEGORIES: Dict[Any, Callable[[str], bool]] = {
+    sre_parse.CATEGORY_DIGIT:     lambda c: c.isdecimal(),
+    sre_parse.CATEGORY_NOT_DIGIT: lambda c: not c.isdecimal(),
+    sre_parse.CATEGORY_SPACE:     lambda c: c.isspace(),
+    sre_parse.CATEGORY_NOT_SPACE: lambda c: not c.isspace(),
+    sre_parse.CATEGORY_WORD:      lambda c: c.isalnum() or c == '_',
+    sre_parse.CATEGORY_NOT_WORD:  lambda c: not (c.isalnum() or c == '_')
+}
+
+def _matches(item: Tuple[Any, Any], c: str) -> bool:
+    op, av = item
+    if op == sre_parse.ANY:
+        return c != '\n'
+    if op == sre_parse.LITERAL:
+        return chr(av).casefold() == c.casefold()
+    if op == sre_parse.NOT_LITERAL:
+        return chr(av).casefold() != c.casefold()
+    if op == sre_parse.RANGE:
+        return any(av[0] <= ord(x) <= av[1] for x in (c.lower(), c.upper()))
+    if op == sre_parse.CATEGORY:
+        return _CATEGORIES[av](c) if av in _CATEGORIES else True
+    if op == sre_parse.IN:
+        negate: bool = bool(av) and av[0][0] == sre_parse.NEGATE
+        found: bool = any(_matches(i, c) for i in (av[1:] if negate else av))
+        return found != negate
+    return True
+
+def _chars(items: List[Any]) -> Iterator[str]:
+    for op, av in items:
+        if op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL):
+            yield chr(av)
+        elif op == sre_parse.RANGE:
+            yield chr(av[0])
+            yield chr(av[1])
+        elif op == sre_parse.IN:
+            yield from _chars(av)
+
+def _overlap(a: Optional[List[Any]], b: Optional[List[Any]]) -> bool:
+    if a is None or b is None:
+        return True
+    return any(
+        any(_matches(x, c) for x in a) and any(_matches(y, c) for y in b)
+        for c in set(_PROBES) | set(_chars(a)) | set(_chars(b))
+    )
+
+def _union(a: Optional[List[Any]], b: Optional[List[Any]]) -> Optional[List[Any]]:
+    return None if a is None or b is None else a + b
+
+def _either(a: Optional[List[Any]], b: Optional[List[Any]]) -> Optional[List[Any]]:
+    """Active repeats after one of two paths, None is no active repeat"""
+    return b if a is None else a if b is None else a + b
+
+_ZERO_WIDTH: Tuple[Any, ...] = (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT)
+_REPEATS:    Tuple[Any, ...] = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT)
+_CHAR_OPS:   Tuple[Any, ...] = (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.IN, sre_parse.ANY)
+
+def _nullable(subpattern: Any) -> bool:
+    """Whether the subpattern can match an empty string"""
+    for op, av in subpattern:
+        if op in _ZERO_WIDTH:
+            continue
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            if av[0] > 0 and not _nullable(av[2]):
+                return False
+        elif op == sre_parse.SUBPATTERN:
+            if not _nullable(av[-1]):
+                return False
+        elif op == sre_parse.BRANCH:
+            if not any(_nullable(branch) for branch in av[1]):
+                return False
+        else:
+            return False
+    return True
+
+def _first(subpattern: Any) -> Optional[List[Any]]:
+    """The characters the subpattern can start with"""
+    for op, av in subpattern:
+        if op in _ZERO_WIDTH:
+            continue
+        if op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.IN, sre_parse.ANY):
+            return [(op, av)]
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            return _first(av[2]) if av[0] > 0 else None
+        if op == sre_parse.SUBPATTERN:
+            return None if _nullable(av[-1]) else _first(av[-1])
+        if op == sre_parse.BRANCH:
+            result: Optional[List[Any]] = []
+            for branch in av[1]:
+                result = None if _nullable(branch) else _union(result, _first(branch))
+            return result
+        return None
+    return None
+
+def _char_repeat(op: Any, av: Any) -> Optional[Tuple[Any, Any]]:
+    """The character item of an unbounded repeat of one character, like '.*' or '[a-z]+'"""
+    if op in _REPEATS and av[1] == sre_parse.MAXREPEAT and len(av[2]) == 1 and av[2][0][0] in _CHAR_OPS:
+        return av[2][0]
+    return None
+
+def _separator(subpattern: Any, i: int) -> int:
+    """Length of the literal text that separates the repeat at i from the next one
+
+    In 'a.*b.*c' both repeats can take every 'b', so a failed search tries
+    every way to split the text between them. When a repeat of one character
+    is followed by literal text and then by a repeat that can take every
+    character the first one and the text can, the first repeat is compiled
+    to stop at the first occurrence of the text (see _temper). The same
+    messages are found, the later repeat takes what the first one gave up,
+    and the repeats no longer compete. Return 0 if this does not apply.
+    """
+    item: Optional[Tuple[Any, Any]] = _char_repeat(*subpattern[i])
+    if item is None:
+        return 0
+    end: int = i + 1
+    while end < len(subpattern) and subpattern[end][0] == sre_parse.LITERAL:
+        end += 1
+    if end == i + 1 or end == len(subpattern):
+        return 0
+    after: Optional[Tuple[Any, Any]] = _char_repeat(*subpattern[end])
+    if after is None:
+        return 0
+    text: List[str] = [ chr(av) for _, av in subpattern[i+1:end] ]
+    probes: Set[str] = set(_PROBES) | set(_chars([item, after])) | set(text)
+    if not all(_matches(after, c) for c in probes if c in text or _matches(item, c)):
+        return 0
+    return end - i - 1
+
+def _temper(subpattern: Any) -> None:
+    """Compile the repeats found by _separator to stop at the text after them
+
+    'C{m,}L' becomes 'C{m}(?:(?!L)C)*L'. The parsed pattern is changed in place.
+    """
+    data: List[Tuple[Any, Any]] = []
+    for i, (op, av) in enumerate(subpattern):
+        size: int = _separator(subpattern, i)
+        if size:
+            minimum, _, item = av
+            text: Any = sre_parse.SubPattern(subpattern.state, subpattern.data[i+1:i+1+size])
+            if minimum:
+                data.append((sre_parse.MAX_REPEAT, (minimum, minimum, item)))
+            data.append((sre_parse.MAX_REPEAT, (0, sre_parse.MAXREPEAT, sre_parse.SubPattern(subpattern.state, [(sre_parse.ASSERT_NOT, (1, text)), item[0]]))))
+            continue
+        if op in _REPEATS:
+            _temper(av[2])
+        elif op == sre_parse.SUBPATTERN:
+            _temper(av[-1])
+        elif op == sre_parse.BRANCH:
+            for branch in av[1]:
+                _temper(branch)
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            _temper(av[1])
+        data.append((op, av))
+    subpattern.data[:] = data
+    subpattern.width = None
+
+def _check_sequence(word: str, subpattern: Any, active: Optional[List[Any]]) -> Optional[List[Any]]:
+    """Reject unbounded repeats that compete for the same characters
+
+    active is the items of the unbounded repeats that can still take the
+    next characters, or None. Return them after the subpattern.
+    """
+    for i, (op, av) in enumerate(subpattern):
+        if op in _ZERO_WIDTH:
+            continue
+        if op in _REPEATS and av[1] == sre_parse.MAXREPEAT:
+            item: Optional[List[Any]] = _first(av[2])
+            if active is not None and _overlap(active, item):
+                raise UserError('response', f'"{word}" has repeats in a row that can match the same text, which can make the bot hang!')
+            _check_sequence(word, av[2], None)
+            # an empty repeat lets the ones before it go on
+            before: Optional[List[Any]] = active if _nullable([(op, av)]) else None
+            if _separator(subpattern, i):
+                # it stops at the text after it, only the ones before it can go past
+                active = before
+            else:
+                active = _either(before, item if item is not None else [(sre_parse.ANY, None)])
+        elif op in _REPEATS:
+            # bounded repeats can not contain unbounded ones (see _check_subpattern)
+            inner: Optional[List[Any]] = _check_sequence(word, av[2], active)
+            active = inner if av[0] > 0 else _either(active, inner)
+        elif op == sre_parse.SUBPATTERN:
+            active = _check_sequence(word, av[-1], active)
+        elif op == sre_parse.BRANCH:
+            results: List[Optional[List[Any]]] = [ _check_sequence(word, branch, active) for branch in av[1] ]
+            active = None
+            for result in results:
+                active = _either(active, result)
+        elif active is not None:
+            # repeats that can not take this character have to stop here
+            first: Optional[List[Any]] = _first([(op, av)])
+            if first is not None:
+                active = [ a for a in active if _overlap([a], first) ] or None
+    return active
+
+class TripMatcher:
+    """Compiled trips of a guild
+
+    Literal trips are searched one by one, longest first, so overlapping
+    trips can all be found. All pattern trips are merged into a single
+    alternation with one named group per trip, so the message is scanned
+    only once no matter how many pattern trips the guild has.
+
+    Trips except regex are normalized the same way as messages, regex trips
+    are used as is and should be written against normalized text.
+
+    Pattern trips are checked again here, trips saved before a check was
+    added are skipped instead of breaking the whole guild.
+    """
+    def __init__(self, trips: List[Dict[str, Any]]) -> None:
+        self.literals: List[Tuple[str, Dict[str, Any]]] = []
+        self.patterns: List[Dict[str, Any]] = []
+        for trip in sorted(trips, key=lambda x:len(x['word']), reverse=True):
+            if trip.get('mode', 'literal') == 'literal':
+                self.literals.append((normalize(trip['word']), trip))
+            else:
+                try:
+                    check_pattern(trip['word'] if trip['mode'] == 'regex' else normalize(trip['word']), trip['mode'])
+                except UserError as ex:
+                    print(f'Skipped trip: {ex.message}')
+                    continue
+                self.patterns.append(trip)
+
+        self.combined: Optional['re.Pattern[str]'] = None
+        if self.patterns:
+            parsed: Any = sre_parse.parse(
+                '|'.join([
+                    f'(?P<t{i}>{to_regex(t["word"] if t["mode"] == "regex" else normalize(t["word"]), t["mode"])})'
+                    for i, t in enumerate(self.patterns)
+                ]),
+                re.IGNORECASE
+            )
+            _temper(parsed)
+            self.combined = sre_compile.compile(parsed, re.IGNORECASE)
+
+    def finditer(self, content: str) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+        """Yield (start, end, trip) of every trip found in content"""
+        content = content[:MAX_SCAN_LENGTH]
+        for word, trip in self.literals:
+            start: int = content.find(word)
+            while start != -1:
+                yield start, start + len(word), trip
+                start = content.find(word, start + len(word))
+
+        if self.combined is not None:
+            for match in self.combined.finditer(content[:MAX_PATTERN_SCAN_LENGTH]):
+                yield match.start(), match.end(), self.patterns[int(match.lastgroup[1:])] # type: ignore
+
+# (pattern, mode, whether check_pattern accepts it)
+_REGRESSIONS: List[Tuple[str, str, bool]] = [
+    (r'(a+)+',        'regex',    False),
+    (r'(a|aa)+',      'regex',    False),
+    (r'x.*.*y',       'regex',    False),
+    (r'\w*\s*\w*x',   'regex',    False),
+    (r'\w*\s?\w*x',   'regex',    False),
+    (r'\w*(?:\s*)\w*x', 'regex',  False),
+    (r'a*?*b',        'wildcard', False),
+    (r'a*a*b',        'wildcard', True),
+    (r'a.*b.*c',      'regex',    True),
+    (r'a.+b.*c.*d',   'regex',    True),
+    (r'\w*\s*x\s*',   'regex',    True),
+    (r'foo.*bar.*baz', 'regex',   True),
+    (r'*cat*',        'wildcard', True),
+    (r'a*b*c',        'wildcard', True)
+]
+
+def _self_check() -> None:
+    """Check the patterns above and time the accepted ones on bad messages
+
+    python trip_matcher.py
+    """
+    import time
+    for word, mode, accepted in _REGRESSIONS:
+        try:
+            check_pattern(word, mode)
+        except UserError as ex:
+            assert not accepted, f'{word!r} was rejected: {ex.message}'
+            continue
+        assert accepted, f'{word!r} was accepted'
+        matcher: TripMatcher = TripMatcher([{ 'word': word, 'mode': mode, 'links': 1 }])
+        for text in ('a' * 1000, 'ab' * 500, 'abc' * 333, 'a ' * 500, 'foobar' * 166):
+            start: float = time.perf_counter()
+            list(matcher.finditer(text))
+            elapsed: float = time.perf_counter() - start
+            assert elapsed < 0.1, f'{word!r} took {elapsed:.2f}s on {text[:6]!r}...'
+    print('ok')
+
+if __name__ == '__main__':
+    _self_check()
@@ -1,5 +1,6 @@
-from typing import Iterator, Optional
+from typing import Iterator, Optional, Union, List, Sequence, Any
 from datetime import datetime, timedelta
+from random import random, randrange
 import re
 from re import match, Match
 
@@ -16,6 +17,78 @@ def get_bit_positions(n: int) -> Iterator[int]:
         yield b
         n ^= b              # 1101 XOR 0001             => 1100
 
+class UserError(Exception):
+    """使用者操作錯誤
+
+    UserError(category, message)，category為 'vote' | 'response' | 'permission'，
+    錯誤處理器會將message回傳給使用者。
+    這是預期中的錯誤，不會被記錄，錯誤處理器也不會格式化它的traceback，
+    回應後立即清除traceback以釋放其中的框架。
+    """
+    __slots__ = ()
+
+    def __init__(self, category: str, message: str) -> None:
+        super().__init__(category, message)
+
+    @property
+    def category(self) -> str:
+        return self.args[0]
+
+    @property
+    def message(self) -> str:
+        return self.args[1]
+
+class AliasTable:
+    """加權隨機抽樣表(Vose's alias method)
+
+    建表O(n)，每次抽樣O(1)，與選項數量無關。
+    outcomes為可抽出的值，weights為對應的權重。
+    """
+    __slots__ = ('outcomes', 'prob', 'alias')
+
+    def __init__(self, outcomes: Sequence[Any], weights: Sequence[float]) -> None:
+        n: int = len(outcomes)
+        total: float = sum(weights)
+        self.outcomes: List[Any] = list(outcomes)
+        self.prob: List[float] = [ w * n / total for w in weights ]
+        self.alias: List[int] = list(range(n))
+
+        small: List[int] = [ i for i, p in enumerate(self.prob) if p < 1.0 ]
+        large: List[int] = [ i for i, p in enumerate(self.prob) if p >= 1.0 ]
+        while small and large:
+            s: int = small.pop()
+            l: int = large[-1]
+            self.alias[s] = l
+            self.prob[l] -= 1.0 - self.prob[s]
+            if self.prob[l] < 1.0:
+                small.append(large.pop())
+        for i in small + large:
+            # 浮點誤差造成的剩餘項目機率視為1
+            self.prob[i] = 1.0
+
+    def sample(self) -> Any:
+        i: int = randrange(len(self.outcomes))
+        return self.outcomes[i] if random() < self.prob[i] else self.outcomes[self.alias[i]]
+
+def shard_of(guild_id: Union[str, int], shard_count: int) -> int:
+    """回傳伺服器所屬的分片
+
+    與Discord分配伺服器給分片的方式相同。
+    """
+    return (int(guild_id) >> 22) % shard_count
+
+def owns_guild(bot: Any, guild_id: Union[str, int]) -> bool:
+    """判斷伺服器是否由此行程的分片負責
+
+    沒有分片時，所有伺服器都由此行程負責。
+    """
+    if not bot.shard_count:
+        return True
+    shard_ids: Optional[List[int]] = getattr(bot, 'shard_ids', None)
+    if shard_ids is None:
+        shard_ids = [bot.shard_id] if bot.shard_id is not None else list(range(bot.shard_count))
+    return shard_of(guild_id, bot.shard_count) in shard_ids
+
 def utc_plus(hours: int) -> datetime:
     """回傳UTC+n的時間
     
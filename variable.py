@@ -1,8 +1,39 @@
 import os
+from typing import Optional, List
 from dotenv import load_dotenv
 load_dotenv()
 
 TOKEN:  str  = os.getenv('BOT_TOKEN', '')
 REPLIT: bool = os.getenv('REPLIT', 'FALSE').lower() == 'true'
+PORT:   int  = int(os.getenv('PORT', '8080'))
 
-DATETIME_FORMAT: str = '%Y/%m/%d %H:%M'
\ No newline at end of file
+# 設定時使用Redis相容的伺服器作為資料庫，例：redis://localhost:6379/0
+REDIS_URL: Optional[str] = os.getenv('REDIS_URL') or None
+
+# 設定時開放 /debug/profile 網頁，請求需帶有 Authorization: Bearer <PROFILE_TOKEN>
+PROFILE_TOKEN: Optional[str] = os.getenv('PROFILE_TOKEN') or None
+
+# 設定時開放 /api/guilds/<guild_id>/export/<kind> 網頁，請求需帶有 Authorization: Bearer <EXPORT_TOKEN>
+EXPORT_TOKEN: Optional[str] = os.getenv('EXPORT_TOKEN') or None
+
+# 設定時將每個互動、資料庫操作與REST請求的span寫入此JSONL檔(自動輪替)，例：data/trace.jsonl
+TRACE_FILE: Optional[str] = os.getenv('TRACE_FILE') or None
+
+# 分片設定，SHARD_COUNT未設定時不分片；SHARD_IDS為此行程負責的分片，以「,」分開
+SHARD_COUNT: Optional[int]       = int(os.getenv('SHARD_COUNT', '')) if os.getenv('SHARD_COUNT') else None
+SHARD_IDS:   Optional[List[int]] = [ int(i) for i in os.getenv('SHARD_IDS', '').split(',') if i ] or None
+
+DATETIME_FORMAT: str = '%Y/%m/%d %H:%M'
+
+# 設定時每BACKUP_INTERVAL_MINUTES分鐘將資料的變更備份至BACKUP_DIR
+BACKUP_INTERVAL_MINUTES: Optional[float] = float(os.getenv('BACKUP_INTERVAL_MINUTES', '')) if os.getenv('BACKUP_INTERVAL_MINUTES') else None
+BACKUP_DIR:              str             = os.getenv('BACKUP_DIR', 'data/backup')
+
+# 每個頻道的自動回應速率：每秒補充REPLY_RATE則，最多連續REPLY_BURST則
+REPLY_RATE:  float = float(os.getenv('REPLY_RATE', '1'))
+REPLY_BURST: int   = int(os.getenv('REPLY_BURST', '5'))
+
+# 關閉超過ARCHIVE_AFTER_DAYS天的投票移至封存檔，0為不封存；
+# ARCHIVE_RETENTION_DAYS未設定時封存檔永久保留
+ARCHIVE_AFTER_DAYS:     float           = float(os.getenv('ARCHIVE_AFTER_DAYS', '30'))
+ARCHIVE_RETENTION_DAYS: Optional[float] = float(os.getenv('ARCHIVE_RETENTION_DAYS', '')) if os.getenv('ARCHIVE_RETENTION_DAYS') else None
@@ -0,0 +1,154 @@
+from typing import Optional, Union, Iterator, Sequence, List, Tuple, Dict, Any
+import gzip
+import json
+import calendar
+import os
+import shutil
+import threading
+import time
+from records import encode
+
+"""投票封存
+
+關閉已久的投票從資料庫移到封存檔，不再出現在需要逐一檢查投票的行程與指令中。
+
+每個伺服器一個資料夾，內含依序編號、以開始的日期(UTC)命名的壓縮片段：
+data/archive/<guild_id>/000000-20210101.jsonl.gz
+每次封存在最新的片段後方附加一個gzip成員，片段超過SEGMENT_SIZE或日期改變時開新片段，已寫入的內容不會被修改。
+每一行為一筆紀錄：
+{ "title": 標題, "archived_at": 時間戳, "vote_info": 投票資料 }
+vote_info為null代表該投票已被取回或刪除，同一標題以最後一筆紀錄為準。
+
+保留期限以片段為單位，片段的日期結束後超過期限就整個刪除。
+片段只在同一天內寫入，取回或刪除時附加的紀錄不會延長舊片段的保留期限；
+取消較早紀錄的紀錄一定在同一個或較新的片段，刪除片段不會使已取回的投票復原。
+舊版沒有日期的片段不會再被寫入，以最後寫入時間判斷。
+
+各程序以鎖保護，可以在執行緒中呼叫。
+"""
+
+SEGMENT_SIZE: int = 256 * 1024
+
+def _day(timestamp: float) -> str:
+    return time.strftime('%Y%m%d', time.gmtime(timestamp))
+
+def _segment_day(path: str) -> Optional[str]:
+    """回傳片段的日期，舊版片段為None"""
+    parts: List[str] = os.path.basename(path).split('.')[0].split('-')
+    return parts[1] if len(parts) > 1 else None
+
+class VoteArchive:
+    """投票封存檔
+
+    每個伺服器的標題索引(標題 -> 片段路徑)在第一次使用時讀取所有片段建立，之後隨寫入更新。
+    """
+    def __init__(self, root: str = 'data/archive') -> None:
+        self.root: str = root
+        self.__index: Dict[str, Dict[str, str]] = {}
+        self.__lock: threading.RLock = threading.RLock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def __guild_dir(self, guild_id: Union[str, int]) -> str:
+        return os.path.join(self.root, str(guild_id))
+
+    def __segments(self, guild_id: Union[str, int]) -> List[str]:
+        guild_dir: str = self.__guild_dir(guild_id)
+        if not os.path.isdir(guild_dir):
+            return []
+        return [ os.path.join(guild_dir, name) for name in sorted(os.listdir(guild_dir)) if name.endswith('.jsonl.gz') ]
+
+    def __read(self, path: str) -> Iterator[Dict[str, Any]]:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def __guild_index(self, guild_id: Union[str, int]) -> Dict[str, str]:
+        index: Optional[Dict[str, str]] = self.__index.get(str(guild_id))
+        if index is None:
+            index = self.__index[str(guild_id)] = {}
+            for path in self.__segments(guild_id):
+                for record in self.__read(path):
+                    if record['vote_info'] is None:
+                        index.pop(record['title'], None)
+                    else:
+                        index[record['title']] = path
+        return index
+
+    def guilds(self) -> List[str]:
+        """回傳有封存檔的伺服器id"""
+        return [ name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name)) ]
+
+    def titles(self, guild_id: Union[str, int]) -> List[str]:
+        """回傳伺服器上已封存的投票標題"""
+        with self.__lock:
+            return list(self.__guild_index(guild_id))
+
+    def get(self, guild_id: Union[str, int], title: str) -> Optional[Dict[str, Any]]:
+        """讀取已封存的投票，只需解壓縮該投票所在的片段"""
+        with self.__lock:
+            path: Optional[str] = self.__guild_index(guild_id).get(title)
+            if path is None:
+                return None
+            vote_info: Optional[Dict[str, Any]] = None
+            for record in self.__read(path):
+                if record['title'] == title:
+                    vote_info = record['vote_info']
+            return vote_info
+
+    def append(self, guild_id: Union[str, int], records: Sequence[Tuple[str, Optional[Dict[str, Any]]]]) -> None:
+        """將(標題, 投票資料)寫入封存檔，投票資料為None時標記為已移除"""
+        if not records:
+            return
+        with self.__lock:
+            now: float = time.time()
+            index: Dict[str, str] = self.__guild_index(guild_id)
+            segments: List[str] = self.__segments(guild_id)
+            path: str
+            if segments and _segment_day(segments[-1]) == _day(now) and os.path.getsize(segments[-1]) < SEGMENT_SIZE:
+                path = segments[-1]
+            else:
+                os.makedirs(self.__guild_dir(guild_id), exist_ok=True)
+                number: int = int(os.path.basename(segments[-1]).split('.')[0].split('-')[0]) + 1 if segments else 0
+                path = os.path.join(self.__guild_dir(guild_id), f'{number:06d}-{_day(now)}.jsonl.gz')
+
+            with gzip.open(path, 'at', encoding='utf-8') as f:
+                for title, vote_info in records:
+                    f.write(json.dumps({ 'title': title, 'archived_at': now, 'vote_info': vote_info }, ensure_ascii=False, separators=(',', ':'), default=encode) + '\n')
+            for title, vote_info in records:
+                if vote_info is None:
+                    index.pop(title, None)
+                else:
+                    index[title] = path
+
+    def pop(self, guild_id: Union[str, int], title: str) -> Optional[Dict[str, Any]]:
+        """取回已封存的投票並從封存檔移除"""
+        with self.__lock:
+            vote_info: Optional[Dict[str, Any]] = self.get(guild_id, title)
+            if vote_info is not None:
+                self.append(guild_id, [(title, None)])
+            return vote_info
+
+    def expire(self, guild_id: Union[str, int], before: float) -> int:
+        """刪除伺服器上所有紀錄都早於before的片段，回傳刪除的片段數
+
+        片段的紀錄都在日期當天寫入，日期結束的時間即為最新紀錄時間的上限。
+        """
+        removed: int = 0
+        with self.__lock:
+            for path in self.__segments(guild_id):
+                day: Optional[str] = _segment_day(path)
+                newest: float = os.path.getmtime(path) if day is None else calendar.timegm(time.strptime(day, '%Y%m%d')) + 86400
+                if newest > before:
+                    # 片段依時間排序，之後的片段都比較新
+                    break
+                os.remove(path)
+                removed += 1
+            if removed:
+                self.__index.pop(str(guild_id), None)
+        return removed
+
+    def drop(self, guild_id: Union[str, int]) -> None:
+        """刪除伺服器所有封存檔"""
+        with self.__lock:
+            shutil.rmtree(self.__guild_dir(guild_id), ignore_errors=True)
+            self.__index.pop(str(guild_id), None)
@@ -0,0 +1,80 @@
+from typing import List, Tuple, Dict, Any
+from array import array
+import numpy as np
+from records import VotedColumns
+
+"""投票統計
+
+將投票的 voted (成員id -> 選項bitmask) 展開成「投票者 × 選項」的布林矩陣，
+所有統計都以向量化運算完成，不需要逐一分解bitmask。
+"""
+
+def voter_ids(vote_info: Dict[str, Any]) -> np.ndarray:
+    """回傳投票者id陣列，VotedColumns已依id排序"""
+    if isinstance(vote_info['voted'], VotedColumns) and isinstance(vote_info['voted'].members, array):
+        return np.frombuffer(vote_info['voted'].members, dtype=np.uint64).copy()
+    return np.fromiter((int(member_id) for member_id in vote_info['voted']), dtype=np.uint64, count=len(vote_info['voted']))
+
+def vote_matrix(vote_info: Dict[str, Any]) -> np.ndarray:
+    """回傳投票者 × 選項的布林矩陣
+
+    第i列第j欄為True代表第i個投票者有投第j個選項。
+    超過64個選項時bitmask放不進uint64，改為逐位元組展開。
+    """
+    options: int = len(vote_info['options'])
+    if options > 64:
+        width: int = (options + 7) // 8
+        raw: np.ndarray = np.frombuffer(b''.join([ mask.to_bytes(width, 'little') for mask in vote_info['voted'].values() ]), dtype=np.uint8)
+        return np.unpackbits(raw.reshape(-1, width), axis=1, bitorder='little')[:, :options].astype(bool)
+
+    masks: np.ndarray
+    if isinstance(vote_info['voted'], VotedColumns) and isinstance(vote_info['voted'].masks, array):
+        masks = np.asarray(vote_info['voted'].masks, dtype=np.uint64)
+    else:
+        masks = np.fromiter(vote_info['voted'].values(), dtype=np.uint64, count=len(vote_info['voted']))
+    shifts: np.ndarray = np.arange(options, dtype=np.uint64)
+    return ((masks[:, None] >> shifts) & np.uint64(1)).astype(bool)
+
+def option_counts(matrix: np.ndarray) -> np.ndarray:
+    """回傳各選項票數"""
+    return matrix.sum(axis=0)
+
+def co_selection(matrix: np.ndarray) -> np.ndarray:
+    """回傳選項 × 選項的矩陣，第i列第j欄為同時投了i與j的人數"""
+    m: np.ndarray = matrix.astype(np.float32)
+    return np.rint(m.T @ m).astype(np.int64)
+
+def top_pairs(square: np.ndarray, limit: int) -> List[Tuple[int, int, int]]:
+    """回傳對稱矩陣中數值最大的limit組(i, j, 數值)，不含對角線"""
+    i, j = np.triu_indices(square.shape[0], k=1)
+    values: np.ndarray = square[i, j]
+    order: np.ndarray = np.argsort(-values, kind='stable')[:limit]
+    return [ (int(i[k]), int(j[k]), int(values[k])) for k in order if values[k] > 0 ]
+
+def intersection_size(small: np.ndarray, large: np.ndarray) -> int:
+    """回傳兩個已排序且不重複的id陣列的交集大小
+
+    在較大的陣列中二分搜尋較小陣列的每個id，時間為 O(小 × log 大)，不需要額外的記憶體。
+    """
+    if len(small) > len(large):
+        small, large = large, small
+    if not len(small):
+        return 0
+    positions: np.ndarray = np.searchsorted(large, small)
+    found: np.ndarray = positions < len(large)
+    return int(np.count_nonzero(large[positions[found]] == small[found]))
+
+def voter_overlap(id_arrays: List[np.ndarray]) -> np.ndarray:
+    """回傳投票 × 投票的矩陣，第i列第j欄為同時參與了投票i與投票j的人數
+
+    對角線即為各投票的投票人數。
+    每對投票以已排序的id陣列求交集大小，記憶體只與投票人數的總和成正比，
+    不需要建立投票 × 所有投票者的矩陣。
+    """
+    sorted_ids: List[np.ndarray] = [ np.unique(ids) for ids in id_arrays ]
+    overlap: np.ndarray = np.zeros((len(sorted_ids), len(sorted_ids)), dtype=np.int64)
+    for i, ids in enumerate(sorted_ids):
+        overlap[i, i] = len(ids)
+        for j in range(i + 1, len(sorted_ids)):
+            overlap[i, j] = overlap[j, i] = intersection_size(ids, sorted_ids[j])
+    return overlap